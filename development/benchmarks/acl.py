@@ -0,0 +1,76 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Measures RPC admission cost (ACL.validate_operation) depending on the number of ACL rules
+compared to the previous implementation which scanned allowed and denied lists linearly.
+
+Usage: python development/benchmarks/acl.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src'))
+
+from common.model import ACL
+
+RULE_COUNTS = (10, 100, 1000)
+ITERATIONS = 100000
+
+
+def legacy_validate_operation(acl: ACL, device_name: str, target_name: str, target_type: str = ACL.TARGET_TYPE_ACTION):
+    def has_entry(collection):
+        for entry in collection:
+            if entry.device_name == device_name and entry.target_name == target_name \
+                    and entry.target_type == target_type:
+                return True
+        return False
+
+    if has_entry(acl.denied):
+        return False
+    return has_entry(acl.allowed)
+
+
+def build_acl(rule_count: int) -> ACL:
+    acl = ACL()
+    for i in range(rule_count):
+        acl.allow('device_{}'.format(i), 'toggle', ACL.TARGET_TYPE_ACTION)
+        acl.deny('device_{}'.format(i), 'reset', ACL.TARGET_TYPE_ACTION)
+    return acl
+
+
+def run():
+    print('{:>8} {:>12} {:>14} {:>12}'.format('rules', 'legacy ns', 'compiled ns', 'wildcard ns'))
+    for count in RULE_COUNTS:
+        acl = build_acl(count)
+        # The worst case for linear scan: the last allowed entry
+        device = 'device_{}'.format(count - 1)
+        legacy = min(timeit.repeat(lambda: legacy_validate_operation(acl, device, 'toggle'),
+                                   number=ITERATIONS, repeat=3))
+        compiled = min(timeit.repeat(lambda: acl.validate_operation(device, 'toggle'), number=ITERATIONS, repeat=3))
+        acl.allow('kitchen_*', '*', ACL.TARGET_TYPE_ACTION)
+        acl.validate_operation('kitchen_lamp', 'on')
+        wildcard = min(timeit.repeat(lambda: acl.validate_operation('kitchen_lamp', 'on'),
+                                     number=ITERATIONS, repeat=3))
+        print('{:>8} {:>12.0f} {:>14.0f} {:>12.0f}'.format(
+            count * 2, legacy / ITERATIONS * 1e9, compiled / ITERATIONS * 1e9, wildcard / ITERATIONS * 1e9))
+
+
+if __name__ == '__main__':
+    run()
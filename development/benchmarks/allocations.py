@@ -0,0 +1,116 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Measures memory allocations caused by the event pipeline: state_changed event is emitted by a sensor, queued and
+dispatched into the pipe. For each message pool size reports:
+
+ * allocated memory blocks per pending event (emitted but not yet dispatched), first round and after warm-up
+ * number of generation 0 garbage collections triggered per 100k pending events, first round and after warm-up.
+   Pending events are what makes the collector run: objects freed right after dispatch don't count
+ * time of emit + dispatch round trip
+
+Usage: python development/benchmarks/allocations.py [--events 10000] [--pool-sizes 0 16384]
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+
+from typing import Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src'))
+
+from common.core import ApplicationManager
+from common.model import PipedEvent, EVENT_STATE_CHANGED
+from event_dispatch import BenchSensor, BenchSink
+
+
+def build_application(pool_size: int):
+    application = ApplicationManager()
+    settings = application.get_instance_settings()
+    settings.event_queue_capacity = 0  # Unbounded, all the emitted events should stay in the queue
+    settings.coalesce_state_events = False
+    settings.flight_recorder_size = 0
+    settings.message_pool_size = pool_size
+    application.apply_instance_settings()
+    sink = BenchSink(application, {})
+    sink.id, sink.name = 0x0200, 'sink'
+    application.register_device(sink)
+    sensor = BenchSensor(application, {})
+    sensor.id, sensor.name = 0x0201, 'sensor'
+    application.register_device(sensor)
+    application.register_pipe(PipedEvent(declared_in=sensor, target=sink,
+                                         event=sensor.get_event_by_name('state_changed'),
+                                         action=sink.get_action_by_name('consume')))
+    return application, sensor
+
+
+def dispatch_pending(application):
+    event = application.next_pending_event()
+    while event is not None:
+        application.dispatch_event(event)
+        event = application.next_pending_event()
+
+
+def pending_events_round(application, sensor, events: int) -> Tuple[float, float]:
+    """
+    :return: allocated blocks per pending event, gen0 collections per 100k pending events
+    """
+    gc.collect()
+    collections = gc.get_stats()[0]['collections']
+    before = sys.getallocatedblocks()
+    for i in range(events):
+        sensor.emit(EVENT_STATE_CHANGED, sensor.state)
+    allocated = sys.getallocatedblocks() - before
+    collections = gc.get_stats()[0]['collections'] - collections
+    dispatch_pending(application)
+    return allocated / events, collections / events * 1e5
+
+
+def round_trip(application, sensor, events: int) -> float:
+    """
+    :return: microseconds per emit + dispatch
+    """
+    start = time.perf_counter()
+    for i in range(events):
+        sensor.emit(EVENT_STATE_CHANGED, sensor.state)
+        application.dispatch_event(application.next_pending_event())
+    return (time.perf_counter() - start) / events * 1e6
+
+
+def run(args):
+    print('{:>10} {:>14} {:>14} {:>14} {:>14} {:>14}'.format('pool size', 'blocks/event', 'blocks/event',
+                                                            'gen0 GC/100k', 'gen0 GC/100k', 'us per event'))
+    print('{:>10} {:>14} {:>14} {:>14} {:>14}'.format('', '(first)', '(warmed up)', '(first)', '(warmed up)'))
+    for pool_size in args.pool_sizes:
+        application, sensor = build_application(pool_size)
+        first_blocks, first_collections = pending_events_round(application, sensor, args.events)
+        warm_blocks, warm_collections = pending_events_round(application, sensor, args.events)
+        duration = min(round_trip(application, sensor, args.events) for _ in range(5))
+        print('{:>10} {:>14.2f} {:>14.2f} {:>14.1f} {:>14.1f} {:>14.2f}'.format(
+            pool_size, first_blocks, warm_blocks, first_collections, warm_collections, duration))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Event pipeline allocations benchmark')
+    parser.add_argument('--events', type=int, default=10000, help='Number of pending events per round')
+    parser.add_argument('--pool-sizes', dest='pool_sizes', type=int, nargs='+', default=(0, 16384))
+    run(parser.parse_args())
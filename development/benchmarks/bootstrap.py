@@ -0,0 +1,125 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Startup benchmark. Bootstraps application from synthetic configs of growing size and reports how bootstrap time
+scales with the number of devices. Each generated device uses the lookups performed at startup:
+
+ * module lookup by name for every device
+ * pinref resolution (buttons are wired to PCF8574 expander pins via #expander/N refs)
+ * pipe links resolved by device and action name (every button is piped into the bus and into a power key)
+
+With indexed registries time per device should stay flat, i.e. bootstrap time grows linearly with config size.
+
+Usage: python development/benchmarks/bootstrap.py [--sizes 100 1000 10000] [--repeat 3] [--output results.json]
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src'))
+
+from common import bootstrap
+
+DEFAULT_SIZES = (100, 1000, 5000, 10000)
+DRIVERS = ['unix.drivers.FakeGPIODriver', 'unix.drivers.FakeI2cDriver', 'unix.drivers.FakeDataChannelDriver']
+BUTTONS_PER_EXPANDER = 8
+BUTTONS_PER_KEY = 16
+
+
+def build_config(device_count: int) -> dict:
+    devices = {
+        'bus': {'module_name': 'CommunicationBus', 'server_address': 'localhost'},
+    }
+    i = 0
+    while len(devices) < device_count:
+        expander = 'expander_{}'.format(i // BUTTONS_PER_EXPANDER)
+        if expander not in devices:
+            devices[expander] = {'module_name': 'PCF8574', 'i2c_address': 0x20}
+        key = 'key_{}'.format(i // BUTTONS_PER_KEY)
+        if key not in devices:
+            devices[key] = {'module_name': 'PowerKey', 'gpio': 'PA1'}
+        devices['button_{}'.format(i)] = {
+            'module_name': 'Button',
+            'gpio': '#{}/{}'.format(expander, i % BUTTONS_PER_EXPANDER),
+            'pipe': {'click': ['#bus.push', '#{}.toggle'.format(key)]},
+        }
+        i += 1
+    return {
+        'instance': {'id': 'bench', 'control_socket': None},
+        'drivers': DRIVERS,
+        'devices': devices,
+    }
+
+
+def measure_bootstrap(config: dict, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        application = bootstrap.bootstrap(config)
+        timings.append(time.perf_counter() - start)
+        application.shutdown()
+    return min(timings)
+
+
+def run_size(device_count: int, repeat: int, baseline: float) -> dict:
+    config = build_config(device_count)
+    best = measure_bootstrap(config, repeat)
+    devices = len(config['devices'])
+    # Fixed cost of the application startup (threads, drivers) is excluded from per device figure
+    return dict(devices=devices, bootstrap_s=best, us_per_device=max(best - baseline, 0) / devices * 1e6)
+
+
+def run(args):
+    logging.basicConfig(level=logging.ERROR)
+    # Warm up: module classes are imported on the first use
+    measure_bootstrap(build_config(BUTTONS_PER_EXPANDER), 1)
+    baseline = measure_bootstrap(build_config(1), args.repeat)
+    print('Baseline (empty config): {:.3f}s'.format(baseline), file=sys.stderr)
+    results = []
+    for size in args.sizes:
+        result = run_size(size, args.repeat, baseline)
+        # Ratio of per device cost to the one of the smallest config, ~1.0 means linear scaling
+        reference = (results[0] if results else result)['us_per_device']
+        result['scaling'] = result['us_per_device'] / reference if reference > 0 else 1.0
+        results.append(result)
+        print('{devices:>6} devices: bootstrap {bootstrap_s:.3f}s, {us_per_device:.1f}us/device, '
+              'scaling x{scaling:.2f}'.format(**result), file=sys.stderr)
+    report = dict(benchmark='bootstrap', timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  python=platform.python_version(), platform=platform.platform(), baseline_s=baseline,
+                  results=results)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bootstrap time scaling benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Number of devices to test')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per size, the best one is reported')
+    parser.add_argument('-o', '--output', required=False, default=None, help='JSON file to write results to')
+    run(parser.parse_args())
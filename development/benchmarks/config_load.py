@@ -0,0 +1,98 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Measures config loading time for generated YAML configs of growing size:
+
+ * pure python YAML loader (yaml.SafeLoader)
+ * libyaml based loader (yaml.CSafeLoader) if PyYAML is built with libyaml
+ * config snapshot hit, i.e. the second start with unchanged config
+
+Usage: python development/benchmarks/config_load.py [--sizes 10 100 1000] [--repeat 5]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src'))
+
+from common import bootstrap
+
+DEFAULT_SIZES = (10, 100, 1000)
+
+
+def write_config(path: str, device_count: int):
+    devices = {
+        'bus': {'module_name': 'CommunicationBus', 'server_address': 'localhost',
+                'acl': {'mode': 'restrictive', 'allow': ['#key_*.state']}},
+    }
+    for i in range(device_count - 1):
+        devices['key_{}'.format(i)] = {'module_name': 'PowerKey', 'gpio': 'PA{}'.format(i % 32),
+                                       'pipe': {'state_changed': ['#bus.push_state']}}
+    config = {
+        'instance': {'id': 'bench', 'control_socket': None},
+        'drivers': ['unix.drivers.FakeGPIODriver', 'unix.drivers.FakeDataChannelDriver'],
+        'devices': devices,
+    }
+    with open(path, 'w') as f:
+        yaml.dump(config, f, default_flow_style=False)
+
+
+def measure(callable, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        callable()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def run(args):
+    directory = tempfile.mkdtemp()
+    loaders = [('pure python', yaml.SafeLoader)]
+    if hasattr(yaml, 'CSafeLoader'):
+        loaders.append(('libyaml', yaml.CSafeLoader))
+    print('{:>8} {:>10} '.format('devices', 'size, KB') + ' '.join('{:>14}'.format(x[0] + ', ms') for x in loaders) +
+          ' {:>14}'.format('snapshot, ms'))
+    try:
+        for size in args.sizes:
+            path = os.path.join(directory, 'config-{}.yaml'.format(size))
+            write_config(path, size)
+            timings = []
+            for name, loader in loaders:
+                bootstrap.YAML_LOADER = loader
+                timings.append(measure(lambda: bootstrap.read_config(path, use_snapshot=False), args.repeat))
+            bootstrap.read_config(path)  # Creates snapshot
+            timings.append(measure(lambda: bootstrap.read_config(path), args.repeat))
+            print('{:>8} {:>10.1f} '.format(size, os.path.getsize(path) / 1024) +
+                  ' '.join('{:>14.2f}'.format(x) for x in timings))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Config loading benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Number of devices to test')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the best one is reported')
+    run(parser.parse_args())
@@ -0,0 +1,110 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Measures the cost of dispatching a single state_changed event depending on the number of devices
+which have piped state_changed event. Dispatch is measured with flight recorder enabled (default) and disabled.
+
+Usage: python development/benchmarks/event_dispatch.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src'))
+
+from common.core import ApplicationManager
+from common.model import StateAwareModule, DeviceModule, ActionDef, PipedEvent, InternalEvent, EVENT_STATE_CHANGED, \
+    InstanceSettings
+from common.recorder import FlightRecorder
+
+DEVICE_COUNTS = (1, 10, 100, 1000)
+DISPATCH_ITERATIONS = 10000
+
+
+class BenchSensor(StateAwareModule):
+    STATE_FIELDS = ['value']
+    IN_LOOP = False
+
+    @staticmethod
+    def typeid() -> int:
+        return 0xff01
+
+    @staticmethod
+    def type_name() -> str:
+        return 'BenchSensor'
+
+
+class BenchSink(DeviceModule):
+    IN_LOOP = False
+
+    def __init__(self, application, drivers):
+        super().__init__(application, drivers)
+        self.invocations = 0
+
+    def consume(self, data=None, **kwargs):
+        self.invocations += 1
+
+    @staticmethod
+    def typeid() -> int:
+        return 0xff02
+
+    @staticmethod
+    def type_name() -> str:
+        return 'BenchSink'
+
+    ACTIONS = [
+        ActionDef(0xff0201, 'consume', consume),
+    ]
+
+
+def build_application(device_count: int, recorder_size: int = InstanceSettings().flight_recorder_size):
+    application = ApplicationManager()
+    application.recorder = FlightRecorder(recorder_size)
+    sink = BenchSink(application, {})
+    sink.id, sink.name = 0x0200, 'sink'
+    application.register_device(sink)
+    sensors = []
+    for i in range(device_count):
+        sensor = BenchSensor(application, {})
+        sensor.id, sensor.name = 0x0201 + i, 'sensor_{}'.format(i)
+        application.register_device(sensor)
+        application.register_pipe(PipedEvent(declared_in=sensor, target=sink,
+                                             event=sensor.get_event_by_name('state_changed'),
+                                             action=sink.get_action_by_name('consume')))
+        sensors.append(sensor)
+    return application, sink, sensors
+
+
+def run():
+    print('{:>8} {:>14} {:>14} {:>16}'.format('devices', 'us per event', 'no recorder', 'pipes per event'))
+    for count in DEVICE_COUNTS:
+        results = []
+        for recorder_size in (InstanceSettings().flight_recorder_size, 0):
+            application, sink, sensors = build_application(count, recorder_size)
+            event = InternalEvent(sensors[0], EVENT_STATE_CHANGED, sensors[0].state)
+            total = min(timeit.repeat(lambda: application.dispatch_event(event), number=DISPATCH_ITERATIONS,
+                                      repeat=5))
+            results.append(total / DISPATCH_ITERATIONS * 1e6)
+        sink.invocations = 0
+        application.dispatch_event(event)
+        print('{:>8} {:>14.2f} {:>14.2f} {:>16}'.format(count, results[0], results[1], sink.invocations))
+
+
+if __name__ == '__main__':
+    run()
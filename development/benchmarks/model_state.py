@@ -0,0 +1,112 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Compares memory footprint and field access time of ModelState against the previous dict based implementation
+which routed every attribute access through __getattr__/__setattr__.
+
+Usage: python development/benchmarks/model_state.py
+"""
+
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src'))
+
+from common.model import ModelState, JsonSerializer
+
+FIELDS = ['temperature', 'humidity']
+INSTANCES = 10000
+ITERATIONS = 200000
+
+
+class LegacyModelState(object):
+    """
+    ModelState implementation before fixed field slots were introduced
+    """
+    __DEFAULT_FILED_NAME = '$default'
+
+    def __init__(self, fields=None, serializer=JsonSerializer()):
+        self.fields = fields
+        self.__data = {}
+        self.serializer = serializer
+        if self.fields is None:
+            self.fields = [self.__DEFAULT_FILED_NAME]
+
+    def as_dict(self):
+        return dict(self.__data)
+
+    def __getattr__(self, item):
+        if item == 'fields':
+            return object.__getattribute__(self, item)
+        if item in self.fields:
+            return self.__data.get(item, None)
+        else:
+            return self.__getattribute__(item)
+
+    def __setattr__(self, name, value):
+        if name != 'fields':
+            if name in self.fields:
+                self.__data[name] = value
+            else:
+                return object.__setattr__(self, name, value)
+        else:
+            return object.__setattr__(self, name, value)
+
+
+def measure_memory(factory) -> float:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    states = [factory() for _ in range(INSTANCES)]
+    for i, state in enumerate(states):
+        state.temperature = float(i)
+        state.humidity = float(i)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(x.size_diff for x in after.compare_to(before, 'filename'))
+    return float(size - sys.getsizeof(states)) / INSTANCES
+
+
+def measure_time(statement: str, state) -> float:
+    return min(timeit.repeat(statement, globals=dict(state=state), number=ITERATIONS, repeat=5)) / ITERATIONS * 1e9
+
+
+def run():
+    candidates = (
+        ('legacy', lambda: LegacyModelState(FIELDS)),
+        ('slotted', lambda: ModelState(FIELDS)),
+    )
+    print('{:<10} {:>14} {:>10} {:>10} {:>12} {:>16}'.format(
+        'impl', 'bytes/instance', 'get ns', 'set ns', 'as_dict ns', 'commit check ns'))
+    for name, factory in candidates:
+        state = factory()
+        state.temperature = 21.5
+        state.humidity = 40.0
+        memory = measure_memory(factory)
+        get_time = measure_time('state.temperature', state)
+        set_time = measure_time('state.temperature = 21.5', state)
+        as_dict_time = measure_time('state.as_dict()', state)
+        # Legacy commit_state always emitted, new one checks dirty flag first
+        commit_check = measure_time('state.dirty', state) if hasattr(type(state), 'dirty') else 0.0
+        print('{:<10} {:>14.0f} {:>10.1f} {:>10.1f} {:>12.1f} {:>16.1f}'.format(
+            name, memory, get_time, set_time, as_dict_time, commit_check))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,178 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+End-to-end benchmark of the event pipeline. Bootstraps application from synthetic config using fake drivers
+(FakeGPIODriver, FakeWireDriver, FakeDataChannelDriver) and measures for each configuration size:
+
+ * bootstrap time
+ * throughput of emit_event -> event_loop -> pipe action (click piped into CommunicationBus.push)
+ * p50/p99 latency between emitting event and pipe action sending data into the channel
+ * CPU consumed by the main loop per idle device
+
+Results are written as JSON so they could be compared between releases.
+
+Usage: python development/benchmarks/pipeline.py [--sizes 10 100 1000 10000] [--output results.json]
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src'))
+
+from common import bootstrap
+from modules.button import EVENT_CLICK
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+DRIVERS = ['unix.drivers.FakeGPIODriver', 'unix.drivers.FakeWireDriver', 'unix.drivers.FakeDataChannelDriver']
+# Fixed part of the config: bus, power key and thermometer. The rest of devices are buttons piped into the bus
+FIXED_DEVICES = 3
+
+# Thread CPU time is available since python 3.7. Process time includes all threads and overestimates main loop cost
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+def build_config(device_count: int) -> dict:
+    devices = {
+        'bus': {'module_name': 'CommunicationBus', 'server_address': 'localhost'},
+        'key': {'module_name': 'PowerKey', 'gpio': 'PA1', 'pipe': {'state_changed': '#bus.push_state'}},
+        'thermometer': {'module_name': '1wireThermometer', 'device_id': '28-00018370300f',
+                        'pipe': {'state_changed': '#bus.push_state'}},
+    }
+    for i in range(max(device_count - FIXED_DEVICES, 1)):
+        devices['button_{}'.format(i)] = {'module_name': 'Button', 'gpio': 'PA6', 'pipe': {'click': '#bus.push'}}
+    return {
+        'instance': {
+            'id': 'bench',
+            'control_socket': None,
+            # Throughput test emits events faster than they're dispatched, nothing should be dropped
+            'event_queue': {'capacity': 0},
+        },
+        'drivers': DRIVERS,
+        'devices': devices,
+    }
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def measure_throughput(buttons: list, channel, events: int) -> float:
+    done = threading.Event()
+    expected = channel.sent + events
+
+    def on_sent(destination, data):
+        if channel.sent >= expected:
+            done.set()
+
+    channel.on_data_sent = on_sent
+    start = time.perf_counter()
+    for i in range(events):
+        buttons[i % len(buttons)].emit(EVENT_CLICK)
+    if not done.wait(60):
+        raise RuntimeError('Only {} of {} events reached pipe action'.format(channel.sent - expected + events, events))
+    return events / (time.perf_counter() - start)
+
+
+def measure_latency(buttons: list, channel, samples: int) -> dict:
+    received = threading.Event()
+    channel.on_data_sent = lambda destination, data: received.set()
+    latencies = []
+    for i in range(samples):
+        received.clear()
+        start = time.perf_counter()
+        buttons[i % len(buttons)].emit(EVENT_CLICK)
+        if not received.wait(5):
+            raise RuntimeError('Event has not reached pipe action')
+        latencies.append((time.perf_counter() - start) * 1000)
+    return dict(p50=percentile(latencies, 50), p99=percentile(latencies, 99), max=max(latencies))
+
+
+def measure_idle_main_loop(application, device_count: int, duration: float) -> dict:
+    result = {}
+
+    def run():
+        start = thread_time()
+        application.main_loop()
+        result['cpu'] = thread_time() - start
+
+    thread = threading.Thread(target=run, name='MainLoop')
+    thread.start()
+    time.sleep(duration)
+    application.shutdown()
+    thread.join()
+    return dict(cpu_percent=result['cpu'] / duration * 100,
+                cpu_us_per_device_per_s=result['cpu'] / duration / device_count * 1e6)
+
+
+def run_size(device_count: int, events: int, latency_samples: int, idle_seconds: float) -> dict:
+    config = build_config(device_count)
+    gc.collect()
+    start = time.perf_counter()
+    application = bootstrap.bootstrap(config)
+    bootstrap_time = time.perf_counter() - start
+    buttons = [x for x in application.devices.values() if x.name.startswith('button_')]
+    channel = application.get_device_by_name('bus').channel
+    channel.connect()
+    try:
+        throughput = measure_throughput(buttons, channel, events)
+        latency = measure_latency(buttons, channel, latency_samples)
+    except Exception:
+        application.shutdown()
+        raise
+    idle = measure_idle_main_loop(application, len(application.devices), idle_seconds)
+    return dict(devices=len(application.devices), bootstrap_s=bootstrap_time, events_per_s=throughput,
+                emit_to_action_latency_ms=latency, main_loop=idle)
+
+
+def run(args):
+    logging.basicConfig(level=logging.ERROR)
+    results = []
+    for size in args.sizes:
+        result = run_size(size, args.events, args.latency_samples, args.idle_seconds)
+        results.append(result)
+        print('{devices:>6} devices: bootstrap {bootstrap_s:.3f}s, {events_per_s:.0f} events/s, '
+              'latency p50 {p50:.3f}ms p99 {p99:.3f}ms, main loop {cpu:.1f}% CPU ({per_device:.2f}us/device/s)'
+              .format(p50=result['emit_to_action_latency_ms']['p50'], p99=result['emit_to_action_latency_ms']['p99'],
+                      cpu=result['main_loop']['cpu_percent'],
+                      per_device=result['main_loop']['cpu_us_per_device_per_s'], **result), file=sys.stderr)
+    report = dict(benchmark='pipeline', timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  python=platform.python_version(), platform=platform.platform(), results=results)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end event pipeline benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Number of devices to test')
+    parser.add_argument('--events', type=int, default=20000, help='Number of events for throughput test')
+    parser.add_argument('--latency-samples', dest='latency_samples', type=int, default=1000)
+    parser.add_argument('--idle-seconds', dest='idle_seconds', type=float, default=2.0,
+                        help='Duration of main loop CPU measurement')
+    parser.add_argument('-o', '--output', required=False, default=None, help='JSON file to write results to')
+    run(parser.parse_args())
@@ -0,0 +1,104 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""
+Compares startup of a fresh interpreter with eager module discovery (StandardModulesOnlyDriver) and lazy
+catalogue based discovery (ModuleCatalogueDriver, with cold and warm catalogue cache). Each run bootstraps
+minimal config with a single Logger device in a new process and reports:
+
+ * time of imports and bootstrap (interpreter startup is excluded, it's the same for all scenarios)
+ * max RSS of the process
+ * number of imported modules from the "modules" package
+
+Usage: python development/benchmarks/startup.py [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'src')
+DRIVERS = {
+    'eager': 'modules.StandardModulesOnlyDriver',
+    'lazy': 'modules.ModuleCatalogueDriver',
+}
+
+
+def child(driver: str, catalogue: [str, None]):
+    started_at = time.perf_counter()
+    sys.path.insert(0, SRC_PATH)
+    from common import bootstrap
+    config = {
+        'instance': {'id': 'bench', 'control_socket': None, 'module_catalogue': catalogue},
+        'drivers': [driver],
+        'devices': {'logger': {'module_name': 'Logger'}},
+    }
+    application = bootstrap.bootstrap(config)
+    bootstrapped_at = time.perf_counter()
+    application.shutdown()
+    print(json.dumps(dict(
+        startup_ms=(bootstrapped_at - started_at) * 1000,
+        max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        modules=len([x for x in sys.modules if x.startswith('modules.')]),
+    )))
+
+
+def run_child(driver: str, catalogue: [str, None]) -> dict:
+    output = subprocess.check_output([sys.executable, os.path.realpath(__file__), '--child', driver,
+                                      '--catalogue', catalogue or ''])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def summarize(results: list) -> dict:
+    return dict(startup_ms=min(x['startup_ms'] for x in results), max_rss_kb=min(x['max_rss_kb'] for x in results),
+                modules=results[0]['modules'])
+
+
+def run(args):
+    catalogue = os.path.join(tempfile.mkdtemp(), 'modules.json')
+    scenarios = [
+        ('eager', lambda: run_child(DRIVERS['eager'], None)),
+        ('lazy, no cache', lambda: run_child(DRIVERS['lazy'], None)),
+        ('lazy, warm cache', lambda: run_child(DRIVERS['lazy'], catalogue)),
+    ]
+    run_child(DRIVERS['lazy'], catalogue)  # Warm up catalogue cache
+    print('{:>18} {:>12} {:>12} {:>10}'.format('discovery', 'startup, ms', 'max RSS, KB', 'modules'))
+    try:
+        for name, scenario in scenarios:
+            result = summarize([scenario() for _ in range(args.repeat)])
+            print('{:>18} {:>12.1f} {:>12} {:>10}'.format(name, result['startup_ms'], result['max_rss_kb'],
+                                                          result['modules']))
+    finally:
+        os.remove(catalogue)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Module discovery startup benchmark')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of runs per scenario, the best one is reported')
+    parser.add_argument('--child', required=False, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--catalogue', required=False, default=None, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.child is not None:
+        child(arguments.child, arguments.catalogue or None)
+    else:
+        run(arguments)
@@ -19,20 +19,41 @@
 import gc
 import logging
 import cli
+from common.asyncio_runtime import AsyncioRuntime
 from common.bootstrap import bootstrap
 from common.core import ApplicationManager
+from common.errors import LifecycleError
+from common.model import InstanceSettings
 from common.utils import CLI
 
 logger = logging.getLogger('App')
 
 
-def run_application(config: dict, application: ApplicationManager = None):
+def run_main_loop(application: ApplicationManager):
+    """
+    Runs application in the runtime selected in instance settings. Blocks until application shutdown
+    """
+    if application.get_instance_settings().runtime == InstanceSettings.RUNTIME_ASYNCIO:
+        logger.info("Started asyncio runtime")
+        AsyncioRuntime(application).run()
+    else:
+        logger.info("Started main application loop")
+        application.main_loop()
+
+
+def run_application(config: dict, application: ApplicationManager = None, runtime: str = None):
+    """
+    :param runtime: one of InstanceSettings.SUPPORTED_RUNTIMES. Overrides instance/runtime config option
+    """
     if application is None:
         # Do bootstrap
+        if runtime is not None:
+            config['instance'] = dict(config.get('instance') or {}, runtime=runtime)
         application = bootstrap(config)
+    elif runtime is not None and runtime != application.get_instance_settings().runtime:
+        raise LifecycleError("Runtime should be selected before application is bootstrapped")
     try:
-        logger.info("Started main application loop")
-        application.main_loop()
+        run_main_loop(application)
     except KeyboardInterrupt:
         application.shutdown()
         logger.info("Bye")
@@ -0,0 +1,107 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import logging
+
+from typing import Dict
+
+from . import utils
+from .model import DeviceModule
+from .scheduler import DeviceScheduler
+
+
+class AsyncioRuntime(object):
+    """
+    Alternative to ApplicationManager.main_loop and event_loop. Device steps are scheduled as timers of asyncio event
+    loop and events are dispatched as soon as they are emitted, everything in the single thread.
+    Blocking calls (IN_BACKGROUND device steps, async actions) are still executed by application worker pool.
+    """
+
+    def __init__(self, application):
+        """
+        :type application: common.core.ApplicationManager
+        """
+        super().__init__()
+        self.__application = application
+        self.__loop = None  # type: asyncio.AbstractEventLoop
+        self.__timers = {}  # type: Dict[int, asyncio.Handle]
+        self.__drain_scheduled = False
+        self.__logger = logging.getLogger('AsyncioRuntime')
+
+    def run(self):
+        """
+        Blocks calling thread until application shutdown is requested
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.__loop = loop
+        application = self.__application
+        application.set_event_notifier(self.__on_event_emitted)
+        try:
+            for device in application.get_loop_devices():
+                self.__timers[device.id] = loop.call_soon(self.__step, device)
+            # Events emitted before runtime has started
+            self.__on_event_emitted()
+            loop.run_forever()
+        finally:
+            application.set_event_notifier(None)
+            for timer in self.__timers.values():
+                timer.cancel()
+            self.__timers.clear()
+            loop.close()
+            self.__loop = None
+
+    def stop(self):
+        loop = self.__loop
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+    def __step(self, device: DeviceModule, scheduled_time: float = None):
+        if self.__application.terminating or self.__application.draining:
+            return
+        if self.__application.get_device(device.id) is not device:
+            self.__timers.pop(device.id, None)  # Device has been unregistered
+            return
+        # Quarantined device keeps its timer, iteration is skipped until device is released
+        self.__application.run_device_iteration(device, scheduled_time)
+        interval = max(device.MINIMAL_ITERATION_INTERVAL, DeviceScheduler.MINIMAL_INTERVAL)
+        self.__timers[device.id] = self.__loop.call_later(float(interval) / 1000, self.__step, device,
+                                                          utils.capture_monotonic_time() + interval)
+
+    def __on_event_emitted(self):
+        # Might be called from any thread. Makes sure there is at most one drain callback scheduled
+        if not self.__drain_scheduled:
+            self.__drain_scheduled = True
+            self.__loop.call_soon_threadsafe(self.__drain_events)
+
+    def __drain_events(self):
+        self.__drain_scheduled = False
+        application = self.__application
+        if application.terminating:
+            self.__loop.stop()
+            return
+        event_task = application.next_pending_event()
+        while event_task is not None:
+            try:
+                application.dispatch_event(event_task)
+            except Exception as e:
+                self.__logger.error("Error in during event dispatching: " + str(e))
+            if application.terminating:
+                self.__loop.stop()
+                return
+            event_task = application.next_pending_event()
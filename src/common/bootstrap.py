@@ -17,32 +17,93 @@
 import sys
 
 import gc
+import hashlib
 import logging
+import marshal
 import os.path
 import yaml
 from typing import List, Tuple
 
 from common import parse_utils
 from common.drivers import ModuleDiscoveryDriver
-from common.model import DeviceModule, PipedEvent
+from common.model import DeviceModule, PipedEvent, InstanceSettings
+from common.queues import OverflowPolicy
 from common.utils import int_to_hex4str
-from modules import StandardModulesOnlyDriver
+from modules import ModuleCatalogueDriver
 from .errors import ConfigValidationError, InvalidDriverError
 from .core import ApplicationManager
 
 MODULE_DISCOVERY_DRIVER = ModuleDiscoveryDriver.typeid()
+DEFAULT_METRICS_PORT = 9464
+# libyaml based loader is an order of magnitude faster than pure python one
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+CONFIG_SNAPSHOT_SUFFIX = '.snapshot'
+CONFIG_SNAPSHOT_VERSION = 1
 
 __logger = logging.getLogger('Bootstrap')
 
 
-def read_config(config_file) -> dict:
-    if isinstance(config_file, str):
-        config_file = open(config_file, mode='r')
+def read_config(config_file, use_snapshot=True) -> dict:
+    """
+    Reads config from the file given by path or file object.
+    If path is given parsed config is cached in the snapshot file next to the config (<config>.snapshot) keyed by the
+    hash of config content, so on the next start unchanged config is loaded without parsing YAML
+    """
+    if not isinstance(config_file, str):
+        try:
+            return yaml.load(config_file, Loader=YAML_LOADER)
+        finally:
+            if hasattr(config_file, 'close'):
+                config_file.close()
+    with open(config_file, mode='rb') as f:
+        content = f.read()
+    if not use_snapshot:
+        return yaml.load(content, Loader=YAML_LOADER)
+    key = hashlib.sha1(content)
+    # Marshal format depends on python version
+    key.update('{}:{}'.format(CONFIG_SNAPSHOT_VERSION, sys.version_info[:2]).encode('utf-8'))
+    key = key.hexdigest()
+    snapshot_path = config_file + CONFIG_SNAPSHOT_SUFFIX
+    config = __load_config_snapshot(snapshot_path, key)
+    if config is None:
+        config = yaml.load(content, Loader=YAML_LOADER)
+        __save_config_snapshot(snapshot_path, key, config)
+    return config
+
+
+def __load_config_snapshot(path: str, key: str) -> [dict, None]:
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, mode='rb') as f:
+            # loads() on the whole content is much faster than load() which reads file in small chunks
+            snapshot_key, config = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        __logger.warning("Ignoring invalid config snapshot {}: {}".format(path, e))
+        return None
+    if snapshot_key != key:
+        __logger.info("Config has been changed since the snapshot was taken")
+        return None
+    __logger.debug("Config loaded from snapshot " + path)
+    return config
+
+
+def __save_config_snapshot(path: str, key: str, config: dict):
+    try:
+        data = marshal.dumps((key, config))
+    except ValueError as e:
+        # Config contains values which could not be marshalled (e.g. dates)
+        __logger.debug("Config snapshot is not supported for this config: " + str(e))
+        return
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
     try:
-        return yaml.load(config_file)
-    finally:
-        if hasattr(config_file, 'close'):
-            config_file.close()
+        with open(tmp_path, mode='wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        __logger.debug("Unable to write config snapshot {}: {}".format(path, e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def bootstrap(config: dict) -> ApplicationManager:
@@ -57,11 +118,14 @@ def bootstrap_from_cli(config: dict, application: ApplicationManager) -> Applica
     __build_pipes(devices_and_configs, application)
     # Initialize components
 
-    # Run event handling loop
-    application.thread_manager.request_thread('EventLoop', application.event_loop,
-                                              step_interval=application.EVENT_HANDLING_LOOP_INTERVAL)
-    application.thread_manager.request_thread('BgLoop', application.background_tasks_loop,
-                                              step_interval=application.BG_TASK_HANDLING_LOOP_INTERVAL)
+    # Run event handling loop. Asyncio runtime dispatches events on its own
+    if application.get_instance_settings().runtime == InstanceSettings.RUNTIME_THREADED:
+        application.thread_manager.request_thread('EventLoop', application.event_loop,
+                                                  step_interval=application.EVENT_HANDLING_LOOP_INTERVAL)
+    application.start_background_workers()
+    application.start_control_server()
+    application.start_metrics_endpoint()
+    application.start_watchdog()
 
     return application
 
@@ -72,16 +136,17 @@ def bootstrap_environment(config: dict, enable_cli=False) -> ApplicationManager:
     __logger.info('Reading config file')
     __save_instance_config(config, application)
     __load_context_path(application)
+    application.apply_instance_settings()
     __logger.info('Config captured')
-    gc.collect()
     # Load drivers
     __logger.info('Loading drivers')
     __load_drivers(config, application)
     __logger.info('Drivers loaded')
-    gc.collect()
     # Discover modules
     module_discovery_driver = application.get_driver(MODULE_DISCOVERY_DRIVER)
     module_discovery_driver.discover_modules(application.get_module_registry())
+    # Single full collection once import and config garbage is gone, intermediate ones just rescan the same objects
+    gc.collect()
     return application
 
 
@@ -98,7 +163,101 @@ def new_application(enable_cli=True):
 def __save_instance_config(config: dict, application: ApplicationManager):
     if 'instance' in config:
         settings = application.get_instance_settings()
+        instance_config = config.get('instance') or {}
         settings.id = config.get('id')
+        # Runtime
+        runtime = instance_config.get('runtime', settings.runtime)
+        if runtime not in InstanceSettings.SUPPORTED_RUNTIMES:
+            raise ConfigValidationError('instance/runtime',
+                                        'Should be one of: ' + str(InstanceSettings.SUPPORTED_RUNTIMES))
+        settings.runtime = runtime
+        # Event dispatch
+        dispatch_mode = instance_config.get('event_dispatch', settings.event_dispatch_mode)
+        if dispatch_mode not in InstanceSettings.SUPPORTED_EVENT_DISPATCH_MODES:
+            raise ConfigValidationError('instance/event_dispatch', 'Should be one of: ' +
+                                        str(InstanceSettings.SUPPORTED_EVENT_DISPATCH_MODES))
+        settings.event_dispatch_mode = dispatch_mode
+        coalesce_state_events = instance_config.get('coalesce_state_events', settings.coalesce_state_events)
+        if not isinstance(coalesce_state_events, bool):
+            raise ConfigValidationError('instance/coalesce_state_events', 'Should be boolean')
+        settings.coalesce_state_events = coalesce_state_events
+        # Background workers
+        workers = instance_config.get('background_workers', settings.background_workers)
+        if not isinstance(workers, int) or workers < 1:
+            raise ConfigValidationError('instance/background_workers', 'Should be positive integer')
+        settings.background_workers = workers
+        lanes = instance_config.get('background_lanes', {})
+        if not isinstance(lanes, dict):
+            raise ConfigValidationError('instance/background_lanes', 'Should be dictionary lane_name: workers_count')
+        for lane, size in lanes.items():
+            if not isinstance(size, int) or size < 1:
+                raise ConfigValidationError('instance/background_lanes/' + str(lane), 'Should be positive integer')
+            settings.background_lanes[lane] = size
+        # Queues
+        for queue_name in ('event_queue', 'task_queue'):
+            queue_config = instance_config.get(queue_name, {})
+            if not isinstance(queue_config, dict):
+                raise ConfigValidationError('instance/' + queue_name, 'Should be dictionary')
+            capacity = queue_config.get('capacity', getattr(settings, queue_name + '_capacity'))
+            if not isinstance(capacity, int) or capacity < 0:
+                raise ConfigValidationError('instance/{}/capacity'.format(queue_name),
+                                            'Should be non-negative integer. 0 means unlimited queue')
+            overflow = queue_config.get('overflow', getattr(settings, queue_name + '_overflow'))
+            if overflow not in OverflowPolicy.SUPPORTED_POLICIES:
+                raise ConfigValidationError('instance/{}/overflow'.format(queue_name),
+                                            'Should be one of: ' + str(OverflowPolicy.SUPPORTED_POLICIES))
+            if queue_name == 'event_queue' and overflow == OverflowPolicy.BLOCK:
+                # Events are emitted from the event loop thread too, so it would wait for itself
+                raise ConfigValidationError('instance/event_queue/overflow',
+                                            'Blocking policy is not supported for event queue')
+            setattr(settings, queue_name + '_capacity', capacity)
+            setattr(settings, queue_name + '_overflow', overflow)
+        # Metrics endpoint
+        metrics_endpoint = instance_config.get('metrics_endpoint')
+        if metrics_endpoint is not None:
+            if not isinstance(metrics_endpoint, dict):
+                raise ConfigValidationError('instance/metrics_endpoint', 'Should be dictionary')
+            port = metrics_endpoint.get('port', DEFAULT_METRICS_PORT)
+            if not isinstance(port, int) or not 0 <= port <= 65535:
+                raise ConfigValidationError('instance/metrics_endpoint/port', 'Should be valid TCP port')
+            settings.metrics_endpoint = (metrics_endpoint.get('bind_address', '127.0.0.1'), port)
+        shutdown_timeout = instance_config.get('shutdown_timeout', settings.shutdown_timeout)
+        if not isinstance(shutdown_timeout, int) or shutdown_timeout < 0:
+            raise ConfigValidationError('instance/shutdown_timeout', 'Should be non-negative integer (ms)')
+        settings.shutdown_timeout = shutdown_timeout
+        # Diagnostics
+        watchdog = instance_config.get('watchdog', {})
+        if not isinstance(watchdog, dict):
+            raise ConfigValidationError('instance/watchdog', 'Should be dictionary')
+        threshold = watchdog.get('threshold', settings.watchdog_threshold)
+        if not isinstance(threshold, int) or threshold < 0:
+            raise ConfigValidationError('instance/watchdog/threshold',
+                                        'Should be non-negative integer (ms). 0 disables watchdog')
+        quarantine = watchdog.get('quarantine', settings.watchdog_quarantine)
+        if not isinstance(quarantine, bool):
+            raise ConfigValidationError('instance/watchdog/quarantine', 'Should be boolean')
+        settings.watchdog_threshold = threshold
+        settings.watchdog_quarantine = quarantine
+        recorder_size = instance_config.get('flight_recorder_size', settings.flight_recorder_size)
+        if not isinstance(recorder_size, int) or recorder_size < 0:
+            raise ConfigValidationError('instance/flight_recorder_size',
+                                        'Should be non-negative integer. 0 disables flight recorder')
+        settings.flight_recorder_size = recorder_size
+        module_catalogue = instance_config.get('module_catalogue', settings.module_catalogue)
+        if module_catalogue is not None and not isinstance(module_catalogue, str):
+            raise ConfigValidationError('instance/module_catalogue', 'Should be path to the cache file or null')
+        settings.module_catalogue = module_catalogue
+        pool_size = instance_config.get('message_pool_size', settings.message_pool_size)
+        if not isinstance(pool_size, int) or pool_size < 0:
+            raise ConfigValidationError('instance/message_pool_size',
+                                        'Should be non-negative integer. 0 disables message pooling')
+        settings.message_pool_size = pool_size
+        dump_dir = instance_config.get('dump_dir', settings.dump_dir)
+        if not isinstance(dump_dir, str) or not os.path.isdir(dump_dir):
+            raise ConfigValidationError('instance/dump_dir', 'Should be existing directory')
+        settings.dump_dir = dump_dir
+        # Control socket
+        settings.control_socket = instance_config.get('control_socket', settings.control_socket)
         # Context Path
         for path in config.get('context_path', []):
             if isinstance(path, str):
@@ -130,8 +289,9 @@ def __load_drivers(config: dict, application: ApplicationManager):
     try:
         application.get_driver(MODULE_DISCOVERY_DRIVER)
     except InvalidDriverError:
-        __logger.info("Since no module discovery driver provided only standard modules might be used")
-        application.register_driver(StandardModulesOnlyDriver)
+        __logger.info("Since no module discovery driver provided only standard modules and modules registered via "
+                      "entry points might be used")
+        application.register_driver(ModuleCatalogueDriver)
 
 
 def __instantiate_devices(config: dict, application: ApplicationManager) -> List[Tuple[DeviceModule, dict]]:
@@ -150,7 +310,7 @@ def __instantiate_devices(config: dict, application: ApplicationManager) -> List
         )
         try:
             # Parse and set parameters
-            for param_def in instance.PARAMS:
+            for param_def in instance.metadata().params:
                 if param_def.name in device_def:
                     val = device_def[param_def.name]
                     if param_def.parser is not None:
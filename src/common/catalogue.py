@@ -0,0 +1,215 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import importlib
+import json
+import logging
+import os
+import stat
+import sys
+import tempfile
+from collections import OrderedDict
+
+from typing import Callable, Dict, List
+
+from .model import Module
+
+
+class CatalogueEntry(object):
+    __slots__ = ('type_name', 'typeid', 'class_ref', 'cli')
+
+    def __init__(self, type_name: str, typeid: int, class_ref: str, cli: bool = False):
+        self.type_name = type_name
+        self.typeid = typeid
+        self.class_ref = class_ref  # package.module:ClassName
+        self.cli = cli  # Module provides CLI extensions
+
+    def load(self):
+        return _import_class(self.class_ref)
+
+    def as_dict(self) -> dict:
+        return dict(name=self.type_name, typeid=self.typeid, ref=self.class_ref, cli=self.cli)
+
+    @classmethod
+    def from_module_class(cls, module_class) -> 'CatalogueEntry':
+        return cls(module_class.type_name(), module_class.typeid(),
+                   '{}:{}'.format(module_class.__module__, module_class.__qualname__),
+                   bool(module_class.CLI_EXTENSIONS))
+
+
+class ModuleCatalogue(object):
+    """
+    Lightweight index of available device modules: type name, type id and reference to the module class.
+    Sources of modules are python packages (each submodule is scanned) and "jointbox.modules" entry points of installed
+    distributions. Catalogue is cached on disk, source is imported only if it's not in the cache or has been changed
+    since (file modification time and size for package submodules, sys.path modification times for entry points).
+    """
+    FORMAT_VERSION = 1
+    ENTRY_POINT_GROUP = 'jointbox.modules'
+
+    def __init__(self, cache_path: [str, None]):
+        super().__init__()
+        self.entries = OrderedDict()  # type: Dict[str, CatalogueEntry]
+        self.imported = 0  # Number of sources imported because they were not in the cache
+        self.__logger = logging.getLogger('ModuleCatalogue')
+        self.__cache_path = cache_path
+        self.__cache = self.__read_cache()  # type: Dict[str, dict]
+        self.__sources = OrderedDict()  # type: Dict[str, dict]
+
+    def scan_package(self, package_name: str):
+        """
+        Scans source submodules of the package: subpackages and .py files.
+        Directory is listed directly, pkgutil.iter_modules imports inspect which costs more than the whole scan
+        """
+        package = importlib.import_module(package_name)
+        for directory in package.__path__:
+            for file_name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, file_name)
+                if file_name.endswith('.py') and file_name != '__init__.py':
+                    name = file_name[:-3]
+                elif os.path.isfile(os.path.join(path, '__init__.py')):
+                    name, path = file_name, os.path.join(path, '__init__.py')
+                else:
+                    continue
+                stat = os.stat(path)
+                name = package_name + '.' + name
+                self.__add_source('package:' + name, '{}:{}'.format(stat.st_mtime_ns, stat.st_size),
+                                  lambda name=name: self.__extract_modules(importlib.import_module(name)))
+
+    def scan_entry_points(self, group: str = ENTRY_POINT_GROUP):
+        """
+        Entry points of all distributions are cached as a single source keyed by modification times of sys.path
+        directories (installing or removing distribution changes them), so distribution metadata is not even read
+        while nothing is installed
+        """
+        key = []
+        for path in sys.path:
+            if not path:
+                continue  # Working directory, changes too often (pid files, logs etc.)
+            try:
+                key.append('{}:{}'.format(path, os.stat(path).st_mtime_ns))
+            except OSError:
+                pass
+        self.__add_source('entry_points:' + group, '|'.join(key), lambda: self.__extract_entry_points(group))
+
+    def save(self):
+        """
+        Writes catalogue into the cache if it has been changed
+        """
+        if self.__cache_path is None or self.__sources == self.__cache:
+            return
+        data = dict(version=self.FORMAT_VERSION, python='{}.{}'.format(*sys.version_info[:2]), sources=self.__sources)
+        directory = os.path.dirname(os.path.abspath(self.__cache_path))
+        tmp_path = None
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.modules-', suffix='.tmp', dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=1)
+            os.replace(tmp_path, self.__cache_path)
+        except OSError as e:
+            self.__logger.warning("Unable to write module catalogue {}: {}".format(self.__cache_path, e))
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def __read_cache(self) -> Dict[str, dict]:
+        if self.__cache_path is None or not os.path.isfile(self.__cache_path):
+            return {}
+        try:
+            with open(self.__cache_path) as f:
+                # Classes referenced by the catalogue get imported, so only trust the file nobody else could modify
+                st = os.fstat(f.fileno())
+                if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                    self.__logger.warning("Ignoring module catalogue {}: it should be owned by the current user and "
+                                          "not writable by others".format(self.__cache_path))
+                    return {}
+                data = json.load(f)
+            if data.get('version') == self.FORMAT_VERSION \
+                    and data.get('python') == '{}.{}'.format(*sys.version_info[:2]):
+                return data.get('sources', {})
+        except (OSError, ValueError, AttributeError) as e:
+            self.__logger.warning("Ignoring invalid module catalogue {}: {}".format(self.__cache_path, e))
+        return {}
+
+    def __add_source(self, source_id: str, key: str, extract: Callable[[], List[dict]]):
+        source = self.__cache.get(source_id)
+        if source is None or source.get('key') != key:
+            try:
+                source = dict(key=key, modules=extract())
+            except Exception as e:
+                # Not cached, so it will be retried on the next start
+                self.__logger.warning("Unable to load modules from {}: {}".format(source_id, e))
+                return
+            self.imported += 1
+        self.__sources[source_id] = source
+        for module in source['modules']:
+            if module['name'] in self.entries:
+                self.__logger.warning("Module {} from {} is ignored: module with the same name is already provided by "
+                                      "{}".format(module['name'], source_id, self.entries[module['name']].class_ref))
+                continue
+            self.entries[module['name']] = CatalogueEntry(module['name'], module['typeid'], module['ref'],
+                                                          module['cli'])
+
+    def __extract_entry_points(self, group: str) -> List[dict]:
+        result = []
+        for name, value in _iter_entry_points(group):
+            try:
+                module_class = _import_class(value.split('[', 1)[0].strip())  # Strip extras
+                result.append(CatalogueEntry.from_module_class(module_class).as_dict())
+            except Exception as e:
+                self.__logger.warning("Unable to load module from entry point {}: {}".format(name, e))
+        return result
+
+    @staticmethod
+    def __extract_modules(module) -> List[dict]:
+        result = []
+        for value in vars(module).values():
+            if isinstance(value, type) and issubclass(value, Module) and value.__module__ == module.__name__ \
+                    and value.typeid() >= 0:
+                result.append(CatalogueEntry.from_module_class(value).as_dict())
+        return result
+
+
+def _import_class(class_ref: str):
+    module_name, class_name = class_ref.split(':', 1)
+    result = importlib.import_module(module_name)
+    for attr in class_name.split('.'):
+        result = getattr(result, attr)
+    return result
+
+
+def _iter_entry_points(group: str):
+    """
+    :return: (name, value) for each entry point of the group
+    """
+    try:
+        from importlib import metadata
+    except ImportError:
+        metadata = None
+    if metadata is not None:
+        entry_points = metadata.entry_points()
+        selected = entry_points.select(group=group) if hasattr(entry_points, 'select') \
+            else entry_points.get(group, ())
+        for entry_point in selected:
+            yield entry_point.name, entry_point.value
+        return
+    try:
+        import pkg_resources
+    except ImportError:
+        return
+    for entry_point in pkg_resources.iter_entry_points(group):
+        yield entry_point.name, '{}:{}'.format(entry_point.module_name, '.'.join(entry_point.attrs))
@@ -19,6 +19,11 @@ from common.parse_utils import parse_link_string
 
 
 class ACLParser(ConfigParser):
+    """
+    Rules are links to device actions: #device.action. Device and action names may contain wildcards (* and ?),
+    rule without action (#kitchen_*) covers all actions of the matching devices
+    """
+
     def parse(self, config_section: dict, application, absolute_path: str = '') -> ACL:
         acl = ACL()
         if 'mode' in config_section:
@@ -26,9 +31,9 @@ class ACLParser(ConfigParser):
         if 'allow' in config_section:
             for rule in config_section['allow']:
                 device, action = parse_link_string(rule)
-                acl.allow(device, action, ACL.TARGET_TYPE_ACTION)
+                acl.allow(device, action or '*', ACL.TARGET_TYPE_ACTION)
         if 'deny' in config_section:
             for rule in config_section['deny']:
                 device, action = parse_link_string(rule)
-                acl.deny(device, action, ACL.TARGET_TYPE_ACTION)
+                acl.deny(device, action or '*', ACL.TARGET_TYPE_ACTION)
         return acl
@@ -0,0 +1,131 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import logging
+import os
+import socket
+import stat
+
+from typing import Callable, Dict
+
+from .errors import SimpleException
+
+
+class ControlError(SimpleException):
+    pass
+
+
+class ControlServer(object):
+    """
+    Exposes runtime commands of the running instance (e.g. queue statistics) over UNIX domain socket so they
+    might be called from the CLI. Protocol: client sends single JSON line {"command": "name", "args": {}},
+    server replies with single JSON line {"result": ...} or {"error": "message"} and closes connection.
+    """
+    ACCEPT_TIMEOUT = 1.0  # seconds
+    SOCKET_MODE = 0o600  # Commands are not authenticated, so only the owner of the instance may connect
+    MAX_REQUEST_SIZE = 64 * 1024
+
+    def __init__(self, path: str, commands: Dict[str, Callable]):
+        super().__init__()
+        self.path = path
+        self.__commands = commands
+        self.__socket = None  # type: socket.socket
+        self.__thread_manager = None  # type: common.core.ThreadManager
+        self.__thread = None  # type: common.core.ManagedThread
+        self.__logger = logging.getLogger('ControlServer')
+
+    def start(self, thread_manager):
+        """
+        :type thread_manager: common.core.ThreadManager
+        """
+        try:
+            mode = os.lstat(self.path).st_mode
+        except FileNotFoundError:
+            mode = None
+        if mode is not None:
+            if not stat.S_ISSOCK(mode):
+                raise ControlError("Refusing to replace {}: it exists and is not a socket".format(self.path))
+            os.unlink(self.path)  # Stale socket left by previous run
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.__socket.bind(self.path)
+            os.chmod(self.path, self.SOCKET_MODE)
+        except OSError:
+            self.stop()
+            raise
+        self.__socket.listen(1)
+        self.__socket.settimeout(self.ACCEPT_TIMEOUT)
+        self.__thread_manager = thread_manager
+        self.__thread = thread_manager.request_thread('ControlServer', self.serve_step, step_interval=0)
+        self.__logger.info("Listening for control commands on " + self.path)
+
+    def serve_step(self):
+        if self.__socket is None:
+            return
+        try:
+            conn, addr = self.__socket.accept()
+        except (socket.timeout, OSError):
+            return
+        with conn:
+            conn.settimeout(self.ACCEPT_TIMEOUT)
+            try:
+                request = json.loads(conn.makefile('r').readline(self.MAX_REQUEST_SIZE))
+                response = dict(result=self.__handle(request.get('command'), request.get('args') or {}))
+            except Exception as e:
+                response = dict(error=str(e))
+            conn.sendall((json.dumps(response) + '\n').encode('utf-8'))
+
+    def __handle(self, command: str, args: dict):
+        handler = self.__commands.get(command)
+        if handler is None:
+            raise ControlError('Unknown command: ' + str(command))
+        return handler(**args)
+
+    def stop(self):
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        if self.__thread is not None:
+            # serve_step returns immediately without socket, so thread would spin until disposed
+            self.__thread_manager.dispose_thread(self.__thread, wait=False)
+            self.__thread = None
+
+
+class ControlClient(object):
+    TIMEOUT = 10.0  # seconds
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def call(self, command: str, **kwargs):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(self.TIMEOUT)
+                s.connect(self.path)
+                s.sendall((json.dumps(dict(command=command, args=kwargs)) + '\n').encode('utf-8'))
+                response = json.loads(s.makefile('r').readline())
+        except (OSError, ValueError) as e:
+            raise ControlError("Unable to reach running instance via {}: {}".format(self.path, e), e)
+        if 'error' in response:
+            raise ControlError(response['error'])
+        return response.get('result')
@@ -15,20 +15,33 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
 import threading
 
 import time
-from queue import Queue
+from collections import OrderedDict
+from queue import Empty
 from threading import Thread
 
 from typing import Dict, Callable, List, Any
 from typing import Tuple
 
-from common import utils
+from common import utils, timers
 from common.model import CliExtension, CliExtensionsAwareComponent
+from .control import ControlServer, ControlError
+from .metrics import MetricsRegistry, Histogram, Counter
+from .metrics_server import MetricsHttpServer
+from .pool import ObjectPool
+from .profiler import SamplingProfiler
+from .recorder import FlightRecorder
+from .queues import BoundedQueue, OverflowPolicy
+from .scheduler import DeviceScheduler
+from .timers import PeriodicTimer, TimerService
+from .watchdog import Watchdog
 from .utils import int_to_hex4str
 from .errors import InvalidModuleError, InvalidDriverError, LifecycleError
-from .model import InstanceSettings, Driver, DeviceModule, InternalEvent, PipedEvent, BackgroundTask, ActionDef, Module
+from .model import InstanceSettings, Driver, DeviceModule, InternalEvent, PipedEvent, BackgroundTask, ActionDef, \
+    Module, ModelState, BG_LANE_DEFAULT, EVENT_STATE_CHANGED
 
 
 def _register_cli_extensions(application, source_class: CliExtensionsAwareComponent):
@@ -42,17 +55,78 @@ def _register_cli_extensions(application, source_class: CliExtensionsAwareCompon
             application.cli_extensions.append((namespace, extension))
 
 
+def _event_coalesce_key(event: InternalEvent):
+    sender = event.sender
+    return sender.id if sender is not None else None, event.event_id
+
+
+def _merge_coalesced_events(pending: InternalEvent, event: InternalEvent) -> InternalEvent:
+    # Newer state snapshot replaces the pending one, but fields changed by the pending commit should be reported too
+    if isinstance(event.data, ModelState) and isinstance(pending.data, ModelState) and pending.data is not event.data:
+        event.data.merge_changes(pending.data)
+    return event
+
+
+def _task_coalesce_key(task: BackgroundTask):
+    # Tasks are considered the same if they call the same function for the same target
+    c = task.callable
+    return getattr(c, '__func__', c), id(getattr(c, '__self__', None)), id(task.args[0]) if task.args else None
+
+
 class ModuleRegistry:
     def __init__(self, application_manager):
         super().__init__()
-        self.modules = {}  # type: Dict[DeviceModule]
+        self.modules = {}  # type: Dict[int, DeviceModule]
+        self.__modules_by_name = {}  # type: Dict[str, DeviceModule]
+        self.__lazy_modules = {}  # type: Dict[str, Tuple[int, Callable]]  # name -> (typeid, class loader)
+        self.__lazy_names = {}  # type: Dict[int, str]  # typeid -> name
         self.__application = application_manager  # type: ApplicationManager
 
     def find_module_by_name(self, module_name):
-        for x in self.modules.values():
-            if x.type_name() == module_name:
-                return x
-        raise InvalidModuleError('Unknown module {} '.format(module_name))
+        module_class = self.__modules_by_name.get(module_name)
+        if module_class is None:
+            module_class = self.__load_lazy(module_name)
+        if module_class is None:
+            raise InvalidModuleError('Unknown module {} '.format(module_name))
+        return module_class
+
+    def list_modules(self) -> List[Tuple[str, int]]:
+        """
+        :return: (type name, type id) of all registered modules including not loaded ones, ordered by type id
+        """
+        result = [(x.type_name(), x.typeid()) for x in self.modules.values()]
+        result.extend((name, typeid) for name, (typeid, loader) in self.__lazy_modules.items())
+        return sorted(result, key=lambda x: x[1])
+
+    def register_lazy(self, type_name: str, typeid: int, loader: Callable):
+        """
+        Declares module without importing it. Module class is loaded with loader and registered on the first lookup
+        """
+        if type_name in self.__modules_by_name or type_name in self.__lazy_modules:
+            raise InvalidModuleError('DeviceModule with name {} is already registered'.format(type_name))
+        if typeid in self.modules or typeid in self.__lazy_names:
+            raise InvalidModuleError('DeviceModule {} is already registered'.format(int_to_hex4str(typeid)))
+        self.__lazy_modules[type_name] = (typeid, loader)
+        self.__lazy_names[typeid] = type_name
+
+    def __load_lazy(self, type_name: str):
+        entry = self.__lazy_modules.get(type_name)
+        if entry is None:
+            return None
+        typeid, loader = entry
+        # Entry is kept until module is loaded, so the name still resolves and reports the error on every lookup
+        try:
+            module_class = loader()
+        except Exception as e:
+            raise InvalidModuleError("Unable to load module {}: {}".format(type_name, e), e)
+        if not issubclass(module_class, Module) or module_class.type_name() != type_name \
+                or module_class.typeid() != typeid:
+            raise InvalidModuleError("Module {} doesn't match its declaration, module catalogue might be outdated"
+                                     .format(type_name))
+        del self.__lazy_modules[type_name]
+        del self.__lazy_names[typeid]
+        self.register(module_class)
+        return module_class
 
     def register(self, module_class):
         module_class_name = module_class.__name__
@@ -63,23 +137,41 @@ class ModuleRegistry:
             typeid = module_class.typeid()
             if typeid < 0:
                 raise InvalidModuleError('Incorrect module type')
-            if typeid in self.modules.keys():
+            if typeid in self.modules.keys() or typeid in self.__lazy_names:
                 raise InvalidModuleError(
                     'DeviceModule {} is already registered'.format(int_to_hex4str(typeid), module_class.type_name()))
+            type_name = module_class.type_name()
+            if type_name in self.__modules_by_name or type_name in self.__lazy_modules:
+                raise InvalidModuleError('DeviceModule with name {} is already registered'.format(type_name))
+            if issubclass(module_class, DeviceModule):
+                metadata = module_class.metadata()
+                if len(metadata.events_by_id) != len(metadata.events) \
+                        or len(metadata.actions_by_id) != len(metadata.actions):
+                    raise InvalidModuleError('Event and action ids should be unique')
             # Process CLI Extensions if needed
             _register_cli_extensions(self.__application, module_class)
             self.modules[typeid] = module_class
+            self.__modules_by_name[type_name] = module_class
         except InvalidModuleError as e:
             raise InvalidModuleError("Can't register module " + module_class_name + ": " + e.message, e)
 
+    def unregister(self, module_class) -> bool:
+        if self.modules.get(module_class.typeid()) is not module_class:
+            return False
+        del self.modules[module_class.typeid()]
+        self.__modules_by_name.pop(module_class.type_name(), None)
+        return True
+
     def create_module_instance(self, application, typeid: int, instance_id: int, instance_name: str) -> DeviceModule:
         """
         :type application: ApplicationManager
         :return:
         """
         try:
+            if typeid not in self.modules and typeid in self.__lazy_names:
+                self.__load_lazy(self.__lazy_names[typeid])
             if typeid not in self.modules:
-                raise InvalidModuleError("Unknown module type:".format(typeid))
+                raise InvalidModuleError("Unknown module type: {}".format(int_to_hex4str(typeid)))
             cls = self.modules.get(typeid)  # type: class[Module]
             if not issubclass(cls, DeviceModule):
                 raise InvalidModuleError("DeviceModule should implement DeviceModule class")
@@ -106,70 +198,281 @@ class ModuleRegistry:
             raise InvalidModuleError("Unable to create module for device {}: {}".format(instance_id, e.message), e)
 
 
+class ManagedThread(Thread):
+    """
+    Thread running callback periodically until disposed. See ThreadManager for scheduling policies
+    """
+
+    def __init__(self, name: str, callback: Callable, context, step_interval: float, schedule: str,
+                 logger: logging.Logger):
+        super().__init__(name=name)
+        self.terminating = False
+        self.step_interval = step_interval
+        self.schedule = schedule
+        self.steps = 0
+        self.overruns = 0  # Number of ticks which weren't started on time because previous step took too long
+        self.__callback = callback
+        self.__context = context
+        self.__logger = logger
+        self.__wakeup = threading.Event()
+
+    def stop(self):
+        self.terminating = True
+        self.__wakeup.set()
+
+    def run(self):
+        next_time = utils.capture_monotonic_time()
+        while not self.terminating:
+            try:
+                self.__callback(*self.__context)
+            except Exception as e:
+                self.__logger.error('Thread execution failed: {}'.format(e))
+            self.steps += 1
+            if self.step_interval <= 0:
+                continue
+            now = utils.capture_monotonic_time()
+            next_time, overruns = timers.next_tick(self.schedule, self.step_interval, next_time, now)
+            self.overruns += overruns
+            if next_time > now:
+                self.__wakeup.wait((next_time - now) / 1000)
+
+
 class ThreadManager(object):
     DEFAULT_THREAD_INTERVAL = 200
+    DEFAULT_JOIN_TIMEOUT = 2000  # ms
+
+    SCHEDULE_FIXED_DELAY = timers.SCHEDULE_FIXED_DELAY
+    SCHEDULE_SKIP = timers.SCHEDULE_SKIP
+    SCHEDULE_CATCH_UP = timers.SCHEDULE_CATCH_UP
+
+    SUPPORTED_SCHEDULES = timers.SUPPORTED_SCHEDULES
 
     def __init__(self):
-        self.__managed_threads = {}
-        self.logger = logging.getLevelName(self.__class__.__name__)
+        self.__managed_threads = {}  # type: Dict[str, ManagedThread]
+        self.__timers = {}  # type: Dict[str, PeriodicTimer]
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.__timer_service = TimerService(self.logger)
 
     def request_thread(self, name, callback, context: [List, None] = None,
-                       step_interval=DEFAULT_THREAD_INTERVAL) -> Thread:
+                       step_interval=DEFAULT_THREAD_INTERVAL, schedule: str = SCHEDULE_SKIP) -> ManagedThread:
+        """
+        Starts thread calling callback every step_interval ms measured by monotonic clock.
+        step_interval 0 means callback is called again right after it returns
+        """
+        if schedule not in self.SUPPORTED_SCHEDULES:
+            raise LifecycleError("Unsupported schedule {}. Supported: {}".format(schedule, self.SUPPORTED_SCHEDULES))
         thread_name = 'm-' + str(name)
         if context is None:
             context = ()
-
-        def on_step():
-            while not threading.currentThread().terminating:
-                try:
-                    callback(*context)
-                    time.sleep(float(step_interval) / 1000)
-                except Exception as e:
-                    self.logger.error('Thread execution failed: {}'.format(e))
-
-        thread = Thread(target=on_step, name=thread_name)
-        thread.terminating = False
+        thread = ManagedThread(thread_name, callback, context, float(step_interval), schedule, self.logger)
         self.__managed_threads[thread_name] = thread
         thread.start()
         return thread
 
-    def dispose_thread(self, thread: [Thread, str]):
-        thread_name = thread.getName()
-        # if isinstance(thread, Thread):
-        #     thread_name = thread.getName()
-        # else:
-        #     thread_name = thread
-        #     thread = self.__managed_threads.get(thread_name)
-        if thread_name in self.__managed_threads.keys():
-            thread.terminating = True
-            self.__managed_threads.pop(thread_name)
-        else:
+    def request_timer(self, name, callback, context: [List, None] = None,
+                      step_interval=DEFAULT_THREAD_INTERVAL, schedule: str = SCHEDULE_SKIP) -> PeriodicTimer:
+        """
+        Registers periodic callback on the shared timer thread. Unlike request_thread it doesn't cost an OS thread,
+        but callback must not block since all timers are served sequentially
+        """
+        if schedule not in self.SUPPORTED_SCHEDULES:
+            raise LifecycleError("Unsupported schedule {}. Supported: {}".format(schedule, self.SUPPORTED_SCHEDULES))
+        if step_interval <= 0:
+            raise LifecycleError("Timer {} should have positive interval".format(name))
+        timer_name = 't-' + str(name)
+        if timer_name in self.__timers:
+            raise LifecycleError("Timer {} is already registered".format(timer_name))
+        timer = PeriodicTimer(timer_name, callback, () if context is None else context, float(step_interval),
+                              schedule)
+        self.__timers[timer_name] = timer
+        self.__timer_service.schedule(timer)
+        return timer
+
+    def cancel_timer(self, timer: [PeriodicTimer, str]):
+        timer_name = timer if isinstance(timer, str) else timer.name
+        timer = self.__timers.pop(timer_name, None)
+        if timer is None:
+            raise LifecycleError("Can't cancel timer {} because it is not registered".format(timer_name))
+        self.__timer_service.cancel(timer)
+
+    def __join(self, thread: ManagedThread, timeout: float) -> bool:
+        if thread is threading.current_thread():
+            return True  # Thread disposes itself, it will exit once callback returns
+        thread.join(max(timeout, 0) / 1000)
+        if thread.is_alive():
+            self.logger.warning("Thread {} hasn't stopped within {}ms".format(thread.name, int(timeout)))
+            return False
+        return True
+
+    def dispose_thread(self, thread: [Thread, str], timeout: float = DEFAULT_JOIN_TIMEOUT, wait=True) -> bool:
+        """
+        Requests thread to stop and waits for it up to timeout ms unless wait is False
+        :return: True if thread has been stopped
+        """
+        thread_name = thread if isinstance(thread, str) else thread.name
+        thread = self.__managed_threads.pop(thread_name, None)
+        if thread is None:
             raise LifecycleError("Can't dispose thread {} because it is not managed thread".format(thread_name))
+        thread.stop()
+        if not wait:
+            return not thread.is_alive()
+        return self.__join(thread, timeout)
 
-    def dispose_all(self):
+    def dispose_all(self, timeout: float = DEFAULT_JOIN_TIMEOUT) -> bool:
+        """
+        Stops all managed threads. Timeout is shared by all threads
+        :return: True if all threads have been stopped
+        """
         threads = list(self.__managed_threads.values())
+        self.__managed_threads.clear()
         for t in threads:
-            self.dispose_thread(t)
+            t.stop()
+        deadline = utils.capture_monotonic_time() + timeout
+        for timer in self.__timers.values():
+            self.__timer_service.cancel(timer)
+        self.__timers.clear()
+        stopped = self.__timer_service.stop(timeout)
+        for t in threads:
+            stopped = self.__join(t, deadline - utils.capture_monotonic_time()) and stopped
+        return stopped
+
+    def get_stats(self) -> List[dict]:
+        """
+        :return: stats of dedicated threads followed by stats of timers sharing timer thread
+        """
+        stats = [dict(name=t.name, schedule=t.schedule, interval=t.step_interval, steps=t.steps, overruns=t.overruns,
+                      alive=t.is_alive())
+                 for t in sorted(self.__managed_threads.values(), key=lambda x: x.name)]
+        timer_thread = self.__timer_service.thread
+        stats.extend(dict(name=t.name, schedule=t.schedule, interval=t.interval, steps=t.steps, overruns=t.overruns,
+                          alive=timer_thread is not None and timer_thread.is_alive())
+                     for t in sorted(self.__timers.values(), key=lambda x: x.name))
+        return stats
+
+
+class BackgroundWorkerPool(object):
+    """
+    Bounded set of worker threads running background tasks. Workers are grouped into lanes, every lane has its own
+    queue so slow tasks submitted to one lane (e.g. blocking sensor reads) can't delay tasks in another one.
+    Tasks submitted to the lane which is not configured are handled by the default lane.
+    on_evicted is called for every queued task discarded because of drop_oldest overflow policy.
+    """
+
+    def __init__(self, on_evicted: Callable[[BackgroundTask], None] = None):
+        super().__init__()
+        self.__on_evicted = on_evicted
+        self.__lanes = {BG_LANE_DEFAULT: 1}  # type: Dict[str, int]
+        self.__queues = {BG_LANE_DEFAULT: self.__new_queue(BG_LANE_DEFAULT)}  # type: Dict[str, BoundedQueue]
+
+    def __new_queue(self, lane: str, capacity: int = 0, overflow: str = OverflowPolicy.BLOCK):
+        return BoundedQueue('tasks:' + lane, capacity, overflow, key_func=_task_coalesce_key,
+                            on_evicted=self.__on_evicted)
+
+    @property
+    def lanes(self) -> Dict[str, int]:
+        return dict(self.__lanes)
+
+    def configure(self, default_lane_size: int, lanes: Dict[str, int] = None, queue_capacity: int = 0,
+                  queue_overflow: str = OverflowPolicy.BLOCK):
+        if any(not q.empty() for q in self.__queues.values()):
+            raise LifecycleError("Worker pool can't be reconfigured after tasks have been submitted")
+        lanes = dict(lanes or {})
+        lanes[BG_LANE_DEFAULT] = default_lane_size
+        for lane, size in lanes.items():
+            if not isinstance(size, int) or size < 1:
+                raise ValueError('Lane {} should have at least one worker'.format(lane))
+        self.__lanes = lanes
+        self.__queues = {lane: self.__new_queue(lane, queue_capacity, queue_overflow) for lane in lanes}
+
+    @property
+    def size(self) -> int:
+        return sum(self.__lanes.values())
+
+    def submit(self, task: BackgroundTask) -> bool:
+        queue = self.__queues.get(task.lane)
+        if queue is None:
+            queue = self.__queues[BG_LANE_DEFAULT]
+        return queue.put(task)
+
+    def get_queue(self, lane: str) -> BoundedQueue:
+        return self.__queues[lane]
+
+    def stats(self) -> List[dict]:
+        return [q.stats() for q in self.__queues.values()]
+
+    def interrupt(self):
+        """
+        Releases workers waiting for tasks, so they could start polling their queues
+        """
+        for queue in self.__queues.values():
+            queue.interrupt()
+
+    def stop(self, stop_signal):
+        """
+        Releases all workers waiting for tasks. Each worker is expected to exit once it gets stop_signal
+        """
+        for lane, size in self.__lanes.items():
+            queue = self.__queues[lane]
+            queue.close()
+            for i in range(size):
+                queue.force_put(stop_signal)
 
 
 class ApplicationManager:
-    EVENT_HANDLING_LOOP_INTERVAL = 50
-    BG_TASK_HANDLING_LOOP_INTERVAL = 50
+    EVENT_HANDLING_LOOP_INTERVAL = 50  # Used only if event dispatch mode is "polling"
+    BG_TASK_HANDLING_LOOP_INTERVAL = 50  # Delay before restarting a background worker
     MAIN_LOOP_INTERVAL = 50
+    DRAIN_POLL_INTERVAL = 10
+    DISPATCH_WORK_LABEL = 'dispatch'
 
     def __init__(self):
         self.__instance_settings = InstanceSettings()
         self.drivers = {}  # type: Dict[int, Driver]
         self.devices = {}  # type: Dict[int, DeviceModule]
+        self.__devices_by_name = {}  # type: Dict[str, DeviceModule]
         self.cli_extensions = []  # type: List[Tuple[str, CliExtension]]
         self.thread_manager = ThreadManager()
         self.__logger = logging.getLogger('ApplicationManager')
-        self.__main_loop = []
+        self.__scheduler = DeviceScheduler()
         self.__module_registry = ModuleRegistry(self)
         self.__terminating = False
-        self.__event_queue = Queue()
-        self.__bg_tasks_queue = Queue()
-        self.__event_map = {}  # type: Dict[int, List[PipedEvent]]
+        self.__draining = False
+        self.__rejected = {}  # type: Dict[str, int]  # queue name -> external submissions rejected while draining
+        self.__event_queue = BoundedQueue('events', key_func=_event_coalesce_key, merge_func=_merge_coalesced_events)
+        self.__stop_signal = object()  # Put into the queue on shutdown to release blocked consumers
+        self.__event_pool = ObjectPool(InternalEvent)
+        self.__task_pool = ObjectPool(BackgroundTask.create)
+        self.__worker_pool = BackgroundWorkerPool(on_evicted=self.__on_task_evicted)
+        self.__control_server = None  # type: ControlServer
+        self.__event_notifier = None  # type: Callable
+        self.__event_dispatcher = None  # type: int  # Ident of the thread which has registered event notifier
+        self.__metrics_server = None  # type: MetricsHttpServer
+        self.metrics = MetricsRegistry()
+        self.__dispatched_events = {}  # type: Dict[int, Counter]  # event id -> counter
+        self.__pipe_metrics = {}  # type: Dict[int, Tuple[Counter, Counter]]  # id(pipe) -> (invocations, errors)
+        self.__device_metrics = {}  # type: Dict[int, Tuple[Histogram, Histogram]]  # device id -> (duration, lag)
+        self.__loop_jitter = self.metrics.histogram(
+            'main_loop_jitter_ms', 'Delay between the scheduled and the actual main loop wake up')
+        self.__event_queue_wait = self.metrics.histogram(
+            'event_queue_wait_ms', 'Time spent by event in the queue before dispatching')
+        # thread ident -> (label of the work being done, device or None, monotonic start time)
+        self.__active_work = {}  # type: Dict[int, Tuple[str, DeviceModule, float]]
+        self.__heartbeats = {}  # type: Dict[int, Tuple[str, float]]  # thread ident -> (loop name, last heartbeat)
+        self.__replaced_workers = 0
+        self.watchdog = None  # type: Watchdog
+        self.profiler = SamplingProfiler(self.thread_manager, self.get_active_work)
+        self.recorder = FlightRecorder(self.__instance_settings.flight_recorder_size)
+        self.control_commands = {
+            'queues:stats': self.get_queue_stats,
+            'threads:stats': self.thread_manager.get_stats,
+            'watchdog:stats': self.get_watchdog_stats,
+            'devices:release': self.release_device,
+            'metrics:stats': self.metrics.snapshot,
+            'profiler:start': self.start_profiler,
+            'profiler:stop': self.stop_profiler,
+            'recorder:dump': self.dump_flight_recorder,
+        }  # type: Dict[str, Callable]
+        self.__routes = {}  # type: Dict[Tuple[int, int], List[PipedEvent]]  # (sender id, event id) -> pipes
 
     def get_instance_settings(self) -> InstanceSettings:
         return self.__instance_settings
@@ -177,14 +480,216 @@ class ApplicationManager:
     def get_module_registry(self) -> ModuleRegistry:
         return self.__module_registry
 
+    def get_worker_pool(self) -> BackgroundWorkerPool:
+        return self.__worker_pool
+
+    def apply_instance_settings(self):
+        """
+        Configures runtime components (queues, worker pool) according to instance settings.
+        Should be called before devices are instantiated
+        """
+        settings = self.__instance_settings
+        if not self.__event_queue.empty():
+            raise LifecycleError("Event queue can't be reconfigured after events have been emitted")
+        self.__event_queue = BoundedQueue('events', settings.event_queue_capacity, settings.event_queue_overflow,
+                                          key_func=_event_coalesce_key, merge_func=_merge_coalesced_events)
+        self.recorder = FlightRecorder(settings.flight_recorder_size)
+        self.__event_pool.capacity = settings.message_pool_size
+        self.__task_pool.capacity = settings.message_pool_size
+        if settings.message_pool_size > 0:
+            for name, pool in (('events', self.__event_pool), ('tasks', self.__task_pool)):
+                self.metrics.counter('message_pool_reused', 'Messages taken from the pool instead of allocation',
+                                     callback=lambda pool=pool: pool.reused, pool=name)
+        self.__worker_pool.configure(settings.background_workers, settings.background_lanes,
+                                     settings.task_queue_capacity, settings.task_queue_overflow)
+        self.__register_queue_metrics('events', lambda: self.__event_queue)
+        for lane in self.__worker_pool.lanes.keys():
+            self.__register_queue_metrics('tasks:' + lane, lambda lane=lane: self.__worker_pool.get_queue(lane))
+
+    def __register_queue_metrics(self, name: str, queue_getter: Callable[[], BoundedQueue]):
+        self.metrics.gauge('queue_depth', lambda: queue_getter().qsize(), 'Number of pending items', queue=name)
+        self.metrics.gauge('queue_high_water_mark', lambda: queue_getter().high_water_mark,
+                           'Max number of pending items observed', queue=name)
+        self.metrics.counter('queue_dropped', 'Items dropped because of overflow',
+                             callback=lambda: queue_getter().dropped, queue=name)
+        self.metrics.counter('queue_coalesced', 'Items merged into pending ones',
+                             callback=lambda: queue_getter().coalesced, queue=name)
+
+    def get_queue_stats(self) -> List[dict]:
+        return [self.__event_queue.stats()] + self.__worker_pool.stats()
+
+    def start_control_server(self):
+        path = self.__instance_settings.control_socket
+        if path is None:
+            return
+        try:
+            self.__control_server = ControlServer(path, self.control_commands)
+            self.__control_server.start(self.thread_manager)
+        except (OSError, ControlError) as e:
+            self.__control_server = None
+            self.__logger.error("Unable to start control server on {}: {}".format(path, e))
+
+    def start_metrics_endpoint(self):
+        endpoint = self.__instance_settings.metrics_endpoint
+        if endpoint is None:
+            return
+        try:
+            self.__metrics_server = MetricsHttpServer(self.metrics, *endpoint)
+            self.__metrics_server.start(self.thread_manager)
+        except OSError as e:
+            self.__metrics_server = None
+            self.__logger.error("Unable to start metrics endpoint on {}:{}: {}".format(endpoint[0], endpoint[1], e))
+
+    def get_metrics_server(self) -> [MetricsHttpServer, None]:
+        return self.__metrics_server
+
+    def get_active_work(self) -> Dict[int, str]:
+        """
+        :return: mapping thread ident -> label of the work the thread is busy with, e.g. device:lamp
+        """
+        return {ident: work[0] for ident, work in list(self.__active_work.items())}
+
+    def get_active_work_details(self) -> Dict[int, Tuple[str, DeviceModule, float]]:
+        return dict(self.__active_work)
+
+    def get_heartbeats(self) -> Dict[int, Tuple[str, float]]:
+        return dict(self.__heartbeats)
+
+    def __begin_work(self, label: str, device: DeviceModule = None):
+        ident = threading.get_ident()
+        previous = self.__active_work.get(ident)
+        self.__active_work[ident] = (label, device, utils.capture_monotonic_time())
+        return ident, previous
+
+    def __end_work(self, token):
+        ident, previous = token
+        if previous is None:
+            self.__active_work.pop(ident, None)
+        else:
+            self.__active_work[ident] = previous
+
+    def __heartbeat(self, loop: str):
+        self.__heartbeats[threading.get_ident()] = (loop, utils.capture_monotonic_time())
+
+    def start_watchdog(self):
+        settings = self.__instance_settings
+        if settings.watchdog_threshold <= 0:
+            return
+        self.watchdog = Watchdog(self.get_active_work_details, self.get_heartbeats, self.handle_stall,
+                                 settings.watchdog_threshold)
+        self.watchdog.start(self.thread_manager)
+
+    def get_watchdog_stats(self) -> dict:
+        stats = self.watchdog.stats() if self.watchdog is not None else dict(threshold=0, stalls=0, loops=[],
+                                                                            stalled=[])
+        stats['quarantined'] = [x.name for x in self.devices.values() if x.quarantined]
+        return stats
+
+    def handle_stall(self, ident: int, label: str, device: [DeviceModule, None]):
+        """
+        Invoked by watchdog once unit of work exceeds the threshold. Quarantines the device if enabled and
+        replaces stalled event loop or background worker so the rest of devices keep being served.
+        Stalled main loop can't be replaced, but quarantined device will not be stepped again
+        """
+        if self.__terminating:
+            return
+        if device is not None and self.__instance_settings.watchdog_quarantine:
+            self.quarantine_device(device)
+        loop = self.__heartbeats.get(ident, (None, None))[0]
+        thread = next((t for t in threading.enumerate() if t.ident == ident), None)
+        if loop is None or loop == 'main' or not isinstance(thread, ManagedThread):
+            return
+        # Stalled thread exits as soon as current work is done
+        self.thread_manager.dispose_thread(thread, wait=False)
+        self.__heartbeats.pop(ident, None)
+        self.__replaced_workers += 1
+        if loop == 'events':
+            self.thread_manager.request_thread('EventLoop-r{}'.format(self.__replaced_workers), self.event_loop,
+                                               step_interval=self.EVENT_HANDLING_LOOP_INTERVAL)
+        else:
+            lane = loop.split(':', 1)[1]
+            self.thread_manager.request_thread('BgLoop-{}-r{}'.format(lane, self.__replaced_workers),
+                                               self.background_tasks_loop, [lane],
+                                               step_interval=self.BG_TASK_HANDLING_LOOP_INTERVAL)
+        self.__logger.warning("Stalled thread {} has been replaced".format(thread.name))
+
+    def quarantine_device(self, device: DeviceModule):
+        """
+        Excludes device from the main loop, pipe targets and async actions until it is released
+        """
+        if device.quarantined:
+            return
+        device.quarantined = True
+        self.__scheduler.remove(device)
+        self.__logger.warning("Device {} has been quarantined".format(device.name))
+
+    def release_device(self, name: str) -> bool:
+        device = self.get_device_by_name(name)
+        if device is None or not device.quarantined:
+            return False
+        device.quarantined = False
+        if device.IN_LOOP:
+            self.__scheduler.add(device)
+        self.__logger.info("Device {} has been released from quarantine".format(device.name))
+        return True
+
+    def start_profiler(self, interval: int = SamplingProfiler.DEFAULT_INTERVAL) -> dict:
+        self.profiler.start(interval)
+        return dict(running=True)
+
+    def __resolve_dump_path(self, output: [str, None], default_name: str) -> str:
+        """
+        Diagnostic dumps are requested via control socket so they are never written outside of dump_dir
+        :param output: file name relative to dump_dir. New file is created if None
+        """
+        dump_dir = os.path.realpath(self.__instance_settings.dump_dir)
+        if output is None:
+            output = default_name.format(time.strftime('%Y%m%d-%H%M%S'))
+        path = os.path.realpath(os.path.join(dump_dir, output))
+        if os.path.dirname(path) != dump_dir:
+            raise ValueError("Dump file should be located directly in dump_dir ({})".format(dump_dir))
+        return path
+
+    def stop_profiler(self, output: str = None) -> dict:
+        """
+        Stops profiler and writes collapsed stacks into the output file (new file in dump_dir by default)
+        :param output: file name relative to dump_dir
+        """
+        if not self.profiler.running:
+            return dict(running=False)
+        output = self.__resolve_dump_path(output, 'jointbox-profile-{}.collapsed')
+        self.profiler.stop()
+        self.profiler.write(output)
+        return dict(running=False, output=output, samples=self.profiler.samples,
+                    breakdown=self.profiler.work_breakdown())
+
+    def toggle_profiler(self) -> dict:
+        if self.profiler.running:
+            result = self.stop_profiler()
+            self.__logger.info("Profile has been written to " + result['output'])
+            return result
+        return self.start_profiler()
+
+    def dump_flight_recorder(self, output: str = None) -> dict:
+        """
+        Writes content of the flight recorder into the output file (new file in dump_dir by default)
+        :param output: file name relative to dump_dir
+        """
+        if not self.recorder.enabled:
+            return dict(output=None, records=0)
+        output = self.__resolve_dump_path(output, 'jointbox-flight-{}.jsonl')
+        records = self.recorder.dump(output)
+        self.__logger.info("Flight recorder has been dumped to {} ({} records)".format(output, records))
+        return dict(output=output, records=records)
+
     def get_driver_by_name(self, name: str) -> Driver:
         raise NotImplementedError()
 
     def get_device_by_name(self, name: str) -> [DeviceModule, None]:
-        for x in self.devices.values():
-            if x.name == name:
-                return x
-        return None
+        return self.__devices_by_name.get(name)
+
+    def get_device(self, device_id: int) -> [DeviceModule, None]:
+        return self.devices.get(device_id)
 
     def get_driver(self, driver_type: int) -> Driver:
         driver_impl = self.drivers.get(driver_type, None)  # type: Driver
@@ -229,77 +734,422 @@ class ApplicationManager:
             raise InvalidDriverError('Unable to register driver {}: '.format(driver_class_name) + e.message, e)
 
     def register_device(self, device: DeviceModule):
+        if device.id in self.devices:
+            raise InvalidModuleError('Device with id {} is already registered'.format(int_to_hex4str(device.id)))
+        if device.name in self.__devices_by_name:
+            raise InvalidModuleError('Device with name {} is already registered'.format(device.name))
         self.devices[device.id] = device
+        self.__devices_by_name[device.name] = device
         if device.IN_LOOP:
-            self.__main_loop.append(device)
+            self.__device_metrics[device.id] = (
+                self.metrics.histogram('device_step_duration_ms', 'Duration of device step', device=device.name),
+                self.metrics.histogram('device_step_lag_ms', 'Delay between the scheduled and the actual step start',
+                                       device=device.name),
+            )
+            if device.IN_BACKGROUND:
+                self.metrics.gauge('device_skipped_steps', lambda: device.skipped_steps,
+                                   'Background steps skipped because previous one was still in flight',
+                                   device=device.name)
+            self.__scheduler.add(device)
+
+    def unregister_device(self, device: DeviceModule) -> bool:
+        """
+        Removes device from registry, scheduler and drops all pipes where device is either source or target
+        """
+        if self.devices.get(device.id) is not device:
+            return False
+        del self.devices[device.id]
+        self.__devices_by_name.pop(device.name, None)
+        self.__device_metrics.pop(device.id, None)
+        self.__scheduler.remove(device)
+        for route, pipes in list(self.__routes.items()):
+            remaining = []
+            for pipe in pipes:
+                if pipe.declared_in is device or pipe.target is device:
+                    self.__pipe_metrics.pop(id(pipe), None)
+                else:
+                    remaining.append(pipe)
+            if remaining:
+                self.__routes[route] = remaining
+            else:
+                del self.__routes[route]
+        return True
 
     def register_pipe(self, piped_event: PipedEvent):
-        event_list = self.__event_map.get(piped_event.event.id, None)
-        if event_list is None:
-            event_list = []
-            self.__event_map[piped_event.event.id] = event_list
-        event_list.append(piped_event)
+        route = (piped_event.declared_in.id, piped_event.event.id)
+        pipes = self.__routes.get(route, None)
+        if pipes is None:
+            pipes = []
+            self.__routes[route] = pipes
+        pipes.append(piped_event)
+        labels = dict(source=piped_event.declared_in.name, event=piped_event.event.name,
+                      target=piped_event.target.name, action=piped_event.action.name)
+        self.__pipe_metrics[id(piped_event)] = (
+            self.metrics.counter('pipe_invocations', 'Number of piped action invocations', **labels),
+            self.metrics.counter('pipe_errors', 'Number of piped action invocations failed with error', **labels),
+        )
+
+    def get_pipes(self, sender: DeviceModule, event_id: int) -> List[PipedEvent]:
+        return self.__routes.get((sender.id if sender is not None else None, event_id), [])
 
-    def run_async_action(self, device: DeviceModule, action: ActionDef, data=None, sender=None):
-        self.__bg_tasks_queue.put(BackgroundTask(action.callable, device, data, **dict(sender=sender)))
+    def get_loop_devices(self) -> List[DeviceModule]:
+        return [x for x in self.devices.values() if x.IN_LOOP]
+
+    @property
+    def terminating(self) -> bool:
+        return self.__terminating
+
+    @property
+    def draining(self) -> bool:
+        """
+        Shutdown has been requested. Devices are not stepped anymore, pending events and tasks are being flushed,
+        only follow-up work is accepted
+        """
+        return self.__draining
+
+    def set_event_notifier(self, notifier: [Callable, None]):
+        """
+        Notifier is called (from the emitting thread) every time new event is enqueued and once shutdown is requested.
+        Used by alternative runtimes which dispatch events on their own instead of event_loop. Should be called from
+        the thread which dispatches events and reset to None once it has stopped dispatching
+        """
+        if notifier is None:
+            self.__event_notifier = None
+            self.__event_dispatcher = None
+        else:
+            self.__event_dispatcher = threading.get_ident()
+            self.__event_notifier = notifier
+
+    def __accepts_work(self, queue_name: str) -> bool:
+        """
+        While draining only follow-up work is accepted: submitted by event handlers or background tasks which are
+        being drained. New work coming from outside (driver callbacks, RPC, timers) is rejected and counted as dropped
+        """
+        if not self.__draining or threading.get_ident() in self.__active_work:
+            return True
+        self.__rejected[queue_name] = self.__rejected.get(queue_name, 0) + 1  # Approximate, not synchronized
+        return False
+
+    def __lane_queue_name(self, lane: str) -> str:
+        return 'tasks:' + (lane if lane in self.__worker_pool.lanes else BG_LANE_DEFAULT)
+
+    def run_async_action(self, device: DeviceModule, action: ActionDef, data=None, sender=None) -> bool:
+        if device.quarantined or not self.__accepts_work('tasks:' + BG_LANE_DEFAULT):
+            return False
+        return self.__worker_pool.submit(self.__task_pool.acquire(action.callable, False, (device, data),
+                                                                  dict(sender=sender), BG_LANE_DEFAULT))
 
     def emit_event(self, sender: DeviceModule, event_id: int, data: dict = None):
-        self.__event_queue.put(InternalEvent(sender, event_id, data))
+        if not self.__accepts_work('events'):
+            return
+        event = self.__event_pool.acquire(sender, event_id, data)
+        if event_id == EVENT_STATE_CHANGED and self.__instance_settings.coalesce_state_events:
+            self.__event_queue.put_coalesced(event)
+        else:
+            self.__event_queue.put(event)
+        if self.__event_notifier is not None:
+            self.__event_notifier()
+
+    def next_pending_event(self) -> [InternalEvent, None]:
+        """
+        Returns the next pending event without blocking or None if there is no events to dispatch
+        """
+        try:
+            event_task = self.__event_queue.get_nowait()
+        except Empty:
+            return None
+        return None if event_task is self.__stop_signal else event_task
 
-    def run_async(self, callable, ignore_errors=False, *args, **kwargs):
-        self.__bg_tasks_queue.put(BackgroundTask(callable, ignore_errors=ignore_errors, *args, **kwargs))
+    def run_async(self, callable, ignore_errors=False, *args, lane: str = BG_LANE_DEFAULT, **kwargs) -> bool:
+        """
+        :return: False if task has been rejected because of queue overflow or shutdown
+        """
+        if self.__draining and not self.__accepts_work(self.__lane_queue_name(lane)):
+            return False
+        return self.__worker_pool.submit(self.__task_pool.acquire(callable, ignore_errors, args, kwargs, lane))
 
     def main_loop(self):
-        while not self.__terminating:
+        scheduler = self.__scheduler
+        loop_jitter = self.__loop_jitter
+        while not self.__terminating and not self.__draining:
+            now = utils.capture_monotonic_time()
+            self.__heartbeats[threading.get_ident()] = ('main', now)
+            for device, deadline in scheduler.pop_due(now):
+                self.run_device_iteration(device, deadline)
+                if not device.quarantined:
+                    scheduler.reschedule(device, utils.capture_monotonic_time())
+            expected_wakeup = scheduler.wait(utils.capture_monotonic_time())
+            if expected_wakeup is not None:
+                now = utils.capture_monotonic_time()
+                if now >= expected_wakeup:
+                    loop_jitter.observe(now - expected_wakeup)
 
-            for device in self.__main_loop:
-                if device.last_step > 0 and utils.delta_time(device.last_step) < device.MINIMAL_ITERATION_INTERVAL:
-                    continue
-                try:
-                    start_time = utils.capture_time()
-                    if device.IN_BACKGROUND:
-                        self.run_async(device.step)
-                    else:
-                        device.step()
-                    delta = utils.capture_time() - start_time
-                    if delta > 100:
-                        self.__logger.warning(
-                            "Device {} might cause performance issues. It has occupied main thread for {}ms".format(
-                                device.name, delta))
-                except Exception as e:
-                    self.__logger.error("Error in during main loop execution: " + str(e))
-                finally:
-                    # TODO: For BG task we should update time after actual execution
-                    device.last_step = utils.capture_time()
-            time.sleep(0.001)
+    def run_device_iteration(self, device: DeviceModule, scheduled_time: float = None):
+        """
+        Runs device step in the calling thread or submits it to worker pool if device is IN_BACKGROUND
+        :param scheduled_time: monotonic time in milliseconds the step has been scheduled at. Used for lag metrics
+        """
+        if device.quarantined:
+            return
+        if device.IN_BACKGROUND:
+            self.__submit_background_step(device, scheduled_time)
+        else:
+            self.__run_step(device, scheduled_time)
+
+    def __observe_step(self, device: DeviceModule, scheduled_time: [float, None], start_time: float, end_time: float):
+        metrics = self.__device_metrics.get(device.id)
+        if metrics is not None:
+            duration, lag = metrics
+            duration.observe(end_time - start_time)
+            if scheduled_time is not None:
+                lag.observe(max(start_time - scheduled_time, 0))
+
+    def __run_step(self, device: DeviceModule, scheduled_time: float = None):
+        work = self.__begin_work('device:' + device.name, device)
+        start_time = utils.capture_monotonic_time()
+        try:
+            device.step()
+        except Exception as e:
+            self.__logger.error("Error in during main loop execution: " + str(e))
+        finally:
+            self.__end_work(work)
+            end_time = utils.capture_monotonic_time()
+            device.last_step = utils.capture_time()
+            self.__observe_step(device, scheduled_time, start_time, end_time)
+        if end_time - start_time > 100:
+            self.__logger.warning(
+                "Device {} might cause performance issues. It has occupied main thread for {}ms".format(
+                    device.name, int(end_time - start_time)))
+
+    def __submit_background_step(self, device: DeviceModule, scheduled_time: float = None):
+        # Single-flight: do not queue another step until the previous one is completed
+        if device.step_in_flight or device.quarantined:
+            device.skipped_steps += 1
+            return
+        device.step_in_flight = True
+        accepted = False
+        try:
+            accepted = self.run_async(self.__run_background_step, False, device, scheduled_time,
+                                      lane=device.BACKGROUND_LANE)
+        finally:
+            if not accepted:
+                device.step_in_flight = False
+
+    def __on_task_evicted(self, task: BackgroundTask):
+        # Evicted step will never run so it can't clear single-flight flag itself
+        if task.callable == self.__run_background_step:
+            task.args[0].step_in_flight = False
+        self.__task_pool.release(task)
+
+    def __run_background_step(self, device: DeviceModule, scheduled_time: float = None):
+        work = self.__begin_work('device:' + device.name, device)
+        start_time = utils.capture_monotonic_time()
+        try:
+            device.step()
+        finally:
+            self.__end_work(work)
+            device.last_step = utils.capture_time()
+            device.step_in_flight = False
+            self.__observe_step(device, scheduled_time, start_time, utils.capture_monotonic_time())
 
     def event_loop(self):
-        while not self.__terminating and not self.__event_queue.empty():
+        """
+        In blocking mode waits for new events and dispatches them until shutdown is requested.
+        In polling mode dispatches pending events and returns once the queue is empty.
+        """
+        blocking = self.__instance_settings.event_dispatch_mode == InstanceSettings.EVENT_DISPATCH_BLOCKING
+        thread = threading.current_thread()
+        # Thread is marked as terminating when watchdog replaces it
+        while not self.__terminating and not getattr(thread, 'terminating', False):
+            self.__heartbeat('events')
+            if not blocking and self.__event_queue.empty():
+                return
             try:
                 event_task = self.__event_queue.get()  # type: InternalEvent
-                pipes = self.__event_map.get(event_task.event_id, [])
+                if event_task is self.__stop_signal:
+                    self.__event_queue.force_put(self.__stop_signal)  # Release other consumers if any
+                    return
+                self.dispatch_event(event_task)
+            except Exception as e:
+                self.__logger.error("Error in during event loop execution: " + str(e))
+
+    def dispatch_event(self, event_task: InternalEvent):
+        start_time = utils.capture_monotonic_time()
+        queue_wait = start_time - event_task.created_at
+        self.__event_queue_wait.observe(queue_wait)
+        event_id = event_task.event_id
+        dispatched = self.__dispatched_events.get(event_id)
+        if dispatched is None:
+            dispatched = self.metrics.counter('events_dispatched', 'Number of dispatched events',
+                                              event_id=int_to_hex4str(event_id))
+            self.__dispatched_events[event_id] = dispatched
+        dispatched.inc()
+        sender = event_task.sender
+        pipes = self.__routes.get((sender.id if sender is not None else None, event_id), ())
+        if pipes:
+            # Dispatch is marked as in-flight work once per event. Per pipe labels are only needed to attribute
+            # stalls (watchdog) and samples (profiler) to the target device
+            ident = threading.get_ident()
+            active_work = self.__active_work
+            work = (ident, active_work.get(ident))
+            active_work[ident] = (self.DISPATCH_WORK_LABEL, None, start_time)
+            per_pipe = self.watchdog is not None or self.profiler.running
+            pipe_metrics = self.__pipe_metrics
+            data = event_task.data
+            try:
                 for pipe in pipes:
+                    if pipe.target.quarantined:
+                        continue
+                    invocations, errors = pipe_metrics[id(pipe)]
+                    invocations.inc()
+                    if per_pipe:
+                        active_work[ident] = (pipe.work_label, pipe.target, utils.capture_monotonic_time())
                     try:
-                        pipe.action.callable(pipe.target, event_task.data,
-                                             **dict(event=pipe.event, sender=event_task.sender))
+                        pipe.invoke(data, sender)
                     except Exception as e:
+                        errors.inc()
                         self.__logger.error("Unhandled error in ${}.{}: {}".format(pipe.target, pipe.action.name, e))
-            except Exception as e:
-                self.__logger.error("Error in during event loop execution: " + str(e))
+            finally:
+                self.__end_work(work)
+        recorder = self.recorder
+        if recorder.enabled:
+            recorder.record(FlightRecorder.KIND_EVENT, start_time, sender, event_id, pipes, queue_wait,
+                            utils.capture_monotonic_time() - start_time)
+        self.__event_pool.release(event_task)
+
+    def start_background_workers(self):
+        for lane, size in self.__worker_pool.lanes.items():
+            for i in range(size):
+                self.thread_manager.request_thread('BgLoop-{}-{}'.format(lane, i), self.background_tasks_loop, [lane],
+                                                   step_interval=self.BG_TASK_HANDLING_LOOP_INTERVAL)
 
-    def background_tasks_loop(self):
-        while not self.__terminating and not self.__bg_tasks_queue.empty():
-            task = self.__bg_tasks_queue.get()  # type: BackgroundTask
+    def background_tasks_loop(self, lane: str = BG_LANE_DEFAULT):
+        """
+        Worker routine. Waits for tasks submitted to the given lane and runs them until shutdown is requested
+        """
+        queue = self.__worker_pool.get_queue(lane)
+        queue_wait = self.metrics.histogram('task_queue_wait_ms', 'Time spent by background task in the queue',
+                                            lane=lane)
+        loop_name = 'tasks:' + lane
+        thread = threading.current_thread()
+        # Thread is marked as terminating when watchdog replaces it
+        while not self.__terminating and not getattr(thread, 'terminating', False):
+            self.__heartbeat(loop_name)
+            if self.__draining and self.__drain_deferred(lane, queue):
+                time.sleep(self.DRAIN_POLL_INTERVAL / 1000)
+                continue
+            try:
+                task = queue.get()  # type: BackgroundTask
+            except Empty:  # Queue is interrupted while draining
+                time.sleep(self.DRAIN_POLL_INTERVAL / 1000)
+                continue
+            if task is self.__stop_signal:
+                return
+            start_time = utils.capture_monotonic_time()
+            wait_time = start_time - task.created_at
+            queue_wait.observe(wait_time)
+            c = task.callable
+            device = task.args[0] if len(task.args) > 0 and isinstance(task.args[0], DeviceModule) else None
+            work = self.__begin_work('device:' + device.name if device is not None
+                                     else 'task:' + getattr(c, '__qualname__', repr(c)), device)
             try:
-                c = task.callable
-                c(*task.args, **task.kwargs)
+                task.run()
             except Exception as e:
                 if not task.ignore_errors:
                     self.__logger.error("Unhandled error during background task execution: {}".format(e))
+            finally:
+                self.__end_work(work)
+            self.recorder.record(FlightRecorder.KIND_TASK, start_time, c, None, task.args, wait_time,
+                                 utils.capture_monotonic_time() - start_time)
+            self.__task_pool.release(task)
 
-    def shutdown(self):
+    def __pending_work(self, exclude_ident: int) -> Dict[str, int]:
+        """
+        :return: number of queued items per queue and number of units of work in progress (except given thread).
+        Queues are listed in priority order: events produce tasks, default lane carries actions and publishes,
+        the rest of lanes carry sensor reads
+        """
+        pending = OrderedDict()
+        pending['events'] = self.__event_queue.qsize()
+        for lane in sorted(self.__worker_pool.lanes.keys(), key=lambda x: (x != BG_LANE_DEFAULT, x)):
+            pending['tasks:' + lane] = self.__worker_pool.get_queue(lane).qsize()
+        pending['in_flight'] = len([x for x in list(self.__active_work.keys()) if x != exclude_ident])
+        return pending
+
+    def __drain_deferred(self, lane: str, queue: BoundedQueue) -> bool:
+        """
+        Queues are flushed in priority order (see __pending_work): worker holds off while queues of higher priority
+        are not empty, unless its own queue is full and producers might be blocked by it
+        """
+        if queue.full():
+            return False
+        if not self.__event_queue.empty():
+            return True
+        return lane != BG_LANE_DEFAULT and not self.__worker_pool.get_queue(BG_LANE_DEFAULT).empty()
+
+    def __drain(self, timeout: float) -> Dict[str, int]:
+        """
+        Waits until event loop and workers handle pending events and tasks and in-flight work is completed.
+        Follow-up work produced while draining (e.g. push_state after relay toggle) is accepted and drained as well,
+        new work from outside is rejected.
+        :return: work left once queues are drained or timeout is reached
+        """
+        deadline = utils.capture_monotonic_time() + timeout
+        current = threading.get_ident()
+        asyncio_runtime = self.__instance_settings.runtime == InstanceSettings.RUNTIME_ASYNCIO
+        while True:
+            # In asyncio runtime events are dispatched inline if shutdown is called from the loop thread (it is blocked
+            # by this call) or the loop is not running. Otherwise the loop keeps dispatching them itself
+            if asyncio_runtime and (self.__event_notifier is None or self.__event_dispatcher == current):
+                event_task = self.next_pending_event()
+                while event_task is not None and utils.capture_monotonic_time() < deadline:
+                    self.dispatch_event(event_task)
+                    event_task = self.next_pending_event()
+            pending = self.__pending_work(current)
+            if all(x == 0 for x in pending.values()) or utils.capture_monotonic_time() >= deadline:
+                return pending
+            time.sleep(self.DRAIN_POLL_INTERVAL / 1000)
+
+    def shutdown(self) -> [Dict[str, int], None]:
+        """
+        Stops device iterations, drains queues within instance shutdown_timeout and destroys devices and drivers.
+        :return: number of events, tasks and in-flight units of work which were dropped
+        """
+        if self.__draining or self.__terminating:
+            return None
         self.__logger.info("Initiating shutdown process")
+        self.__draining = True
+        self.__scheduler.wakeup()
+        self.__worker_pool.interrupt()
+        start_time = utils.capture_monotonic_time()
+        dropped = self.__drain(self.__instance_settings.shutdown_timeout)
+        drain_time = utils.capture_monotonic_time() - start_time
+        drained = all(x == 0 for x in dropped.values())
+        for queue_name, count in list(self.__rejected.items()):
+            dropped[queue_name] = dropped.get(queue_name, 0) + count
+        details = ', '.join('{}={}'.format(k, v) for k, v in dropped.items() if v > 0)
+        if not drained:
+            self.__logger.warning("Queues haven't been drained within {}ms. Dropped: {}".format(
+                self.__instance_settings.shutdown_timeout, details))
+        elif details:
+            self.__logger.warning("Queues have been drained in {:.0f}ms. Dropped (submitted while draining): {}".format(
+                drain_time, details))
+        else:
+            self.__logger.info("Queues have been drained in {:.0f}ms".format(drain_time))
         self.__terminating = True
+        self.profiler.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop(self.thread_manager)
+        self.__scheduler.wakeup()
+        self.__event_queue.close()
+        self.__event_queue.force_put(self.__stop_signal)
+        if self.__event_notifier is not None:
+            self.__event_notifier()
+        self.__worker_pool.stop(self.__stop_signal)
+        if self.__control_server is not None:
+            self.__control_server.stop()
+        if self.__metrics_server is not None:
+            self.__metrics_server.stop()
         for device in self.devices.values():
             try:
                 device.on_before_destroyed()
@@ -317,3 +1167,4 @@ class ApplicationManager:
         self.__logger.info("Unloaded drivers")
         self.thread_manager.dispose_all()
         self.__logger.info("Disposed supplementary threads")
+        return dropped
@@ -58,6 +58,12 @@ class DataChannelDriver(Driver):
         def send(self, destination: str, data):
             pass
 
+        def send_state(self, destination: str, state):
+            """
+            :type state: common.model.ModelState
+            """
+            self.send(destination, state.as_dict())
+
         def subscribe(self, topic: str):
             pass
 
@@ -0,0 +1,210 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from typing import Tuple, Callable, List
+
+# Bucket upper bounds in milliseconds
+DEFAULT_TIME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self) -> dict:
+        return dict(value=self.value)
+
+
+class Gauge(object):
+    """
+    Value is captured from the callback at collection time
+    """
+    __slots__ = ('callback',)
+
+    def __init__(self, callback: Callable[[], float]):
+        self.callback = callback
+
+    @property
+    def value(self):
+        return self.callback()
+
+    def snapshot(self) -> dict:
+        return dict(value=self.value)
+
+
+class Histogram(object):
+    """
+    Histogram with fixed buckets. Bucket counters are preallocated so observe() doesn't allocate containers and
+    is cheap enough to be left enabled in production.
+    The last bucket holds values above the highest bound.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_TIME_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        """
+        Returns upper bound of the bucket containing given percentile (0..1) capped by the observed maximum
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c > 0:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return dict(count=self.count, sum=self.sum, max=self.max, p50=self.percentile(0.5),
+                    p99=self.percentile(0.99), buckets=list(zip(self.bounds, self.counts)) + [('+Inf', self.counts[-1])])
+
+
+class MetricsRegistry(object):
+    """
+    Keeps named metrics. Metric is identified by name and set of labels, e.g. ('device_step_duration_ms',
+    device='lamp'). Metrics should be created once (e.g. on device registration) and then updated directly.
+    Counter names should not contain _total suffix, it is added on exposition.
+    """
+    TYPE_COUNTER = 'counter'
+    TYPE_GAUGE = 'gauge'
+    TYPE_HISTOGRAM = 'histogram'
+
+    def __init__(self):
+        super().__init__()
+        self.__metrics = OrderedDict()  # (name, labels) -> metric
+        self.__types = OrderedDict()  # name -> (type, help)
+        self.__lock = threading.Lock()
+
+    def __get_or_create(self, metric_type: str, name: str, help: str, labels: dict, factory):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.__metrics.get(key)
+        if metric is not None:
+            return metric
+        with self.__lock:
+            registered_type = self.__types.setdefault(name, (metric_type, help))[0]
+            if registered_type != metric_type:
+                raise ValueError('Metric {} is already registered as {}'.format(name, registered_type))
+            return self.__metrics.setdefault(key, factory())
+
+    def counter(self, name: str, help: str = '', callback: Callable[[], float] = None, **labels) -> Counter:
+        """
+        :param callback: if set counter value will be captured from the callback at collection time. Useful for
+            exposing counters maintained by other components
+        """
+        factory = Counter if callback is None else lambda: Gauge(callback)
+        return self.__get_or_create(self.TYPE_COUNTER, name, help, labels, factory)
+
+    def gauge(self, name: str, callback: Callable[[], float], help: str = '', **labels) -> Gauge:
+        return self.__get_or_create(self.TYPE_GAUGE, name, help, labels, lambda: Gauge(callback))
+
+    def histogram(self, name: str, help: str = '', bounds: Tuple[float, ...] = DEFAULT_TIME_BUCKETS,
+                  **labels) -> Histogram:
+        return self.__get_or_create(self.TYPE_HISTOGRAM, name, help, labels, lambda: Histogram(bounds))
+
+    def collect(self) -> List[Tuple[str, str, str, List[Tuple[dict, object]]]]:
+        """
+        :return: list of (name, type, help, [(labels, metric), ...]) grouped by metric name
+        """
+        with self.__lock:
+            items = list(self.__metrics.items())
+            types = OrderedDict(self.__types)
+        grouped = OrderedDict((name, []) for name in types.keys())
+        for (name, labels), metric in items:
+            grouped[name].append((dict(labels), metric))
+        return [(name, types[name][0], types[name][1], series) for name, series in grouped.items()]
+
+    def snapshot(self) -> List[dict]:
+        result = []
+        for name, metric_type, help, series in self.collect():
+            for labels, metric in series:
+                result.append(dict(name=name, type=metric_type, labels=labels, **metric.snapshot()))
+        return result
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict, extra: Tuple[str, str] = None) -> str:
+    pairs = ['{}="{}"'.format(k, _escape_label_value(v)) for k, v in sorted(labels.items())]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(extra[0], extra[1]))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value) -> str:
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_openmetrics(registry: MetricsRegistry, prefix: str = 'jointbox_') -> str:
+    """
+    Renders all metrics of the registry in OpenMetrics text format
+    """
+    lines = []
+    for name, metric_type, help, series in registry.collect():
+        full_name = prefix + name
+        lines.append('# TYPE {} {}'.format(full_name, metric_type))
+        if help:
+            lines.append('# HELP {} {}'.format(full_name, help.replace('\\', '\\\\').replace('\n', '\\n')))
+        for labels, metric in series:
+            if metric_type == MetricsRegistry.TYPE_HISTOGRAM:
+                # observe() is lock free, so buckets, +Inf and count are all derived from a single copy of bucket
+                # counters (list copy is atomic in CPython), otherwise count might be lower than cumulative bucket
+                counts = list(metric.counts)
+                cumulative = 0
+                for bound, count in zip(metric.bounds, counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(full_name, _format_labels(labels, ('le', repr(float(bound)))),
+                                                         cumulative))
+                total = cumulative + counts[-1]
+                lines.append('{}_bucket{} {}'.format(full_name, _format_labels(labels, ('le', '+Inf')), total))
+                lines.append('{}_count{} {}'.format(full_name, _format_labels(labels), total))
+                lines.append('{}_sum{} {}'.format(full_name, _format_labels(labels), _format_number(metric.sum)))
+            else:
+                try:
+                    value = metric.value
+                except Exception:
+                    continue  # Callback of the disposed component, just skip it
+                suffix = '_total' if metric_type == MetricsRegistry.TYPE_COUNTER else ''
+                lines.append('{}{}{} {}'.format(full_name, suffix, _format_labels(labels), _format_number(value)))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,99 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from .metrics import MetricsRegistry, render_openmetrics
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+class MetricsHttpServer(object):
+    """
+    Serves metrics in OpenMetrics text format on /metrics. Requests are handled in dedicated managed thread,
+    rendering only reads metric values so it never blocks the main loop.
+    """
+    REQUEST_TIMEOUT = 1.0  # seconds
+
+    def __init__(self, registry: MetricsRegistry, bind_address: str = '127.0.0.1', port: int = 9464):
+        super().__init__()
+        self.registry = registry
+        self.bind_address = bind_address
+        self.port = port
+        self.__server = None  # type: HTTPServer
+        self.__thread_manager = None  # type: common.core.ThreadManager
+        self.__thread = None  # type: common.core.ManagedThread
+        self.__logger = logging.getLogger('MetricsHttpServer')
+
+    @property
+    def server_address(self):
+        """
+        Actual address the server is listening on. Useful when server is started on port 0
+        """
+        return self.__server.server_address if self.__server is not None else None
+
+    def __create_handler_class(self):
+        registry = self.registry
+        logger = self.__logger
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render_openmetrics(registry).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return MetricsRequestHandler
+
+    def start(self, thread_manager):
+        """
+        :type thread_manager: common.core.ThreadManager
+        """
+        self.__server = HTTPServer((self.bind_address, self.port), self.__create_handler_class())
+        self.__server.timeout = self.REQUEST_TIMEOUT
+        self.__thread_manager = thread_manager
+        self.__thread = thread_manager.request_thread('MetricsHttpServer', self.serve_step, step_interval=0)
+        self.__logger.info("Serving metrics on http://{}:{}/metrics".format(*self.server_address))
+
+    def serve_step(self):
+        server = self.__server
+        if server is None:
+            return
+        try:
+            server.handle_request()
+        except (OSError, ValueError):
+            if self.__server is not None:
+                raise  # Otherwise server has been closed while waiting for request
+
+    def stop(self):
+        server = self.__server
+        if server is not None:
+            self.__server = None
+            server.server_close()
+        if self.__thread is not None:
+            # serve_step returns immediately without server, so thread would spin until disposed
+            self.__thread_manager.dispose_thread(self.__thread, wait=False)
+            self.__thread = None
@@ -14,24 +14,74 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
-
 import logging
+import os
+import re
+import tempfile
 from argparse import ArgumentParser
+from collections import OrderedDict
 
-from typing import List, Dict, Callable, Any
+from typing import List, Dict, Callable, Any, Tuple
 
-from common.utils import int_to_hex4str
-from .errors import InvalidDriverError
+from common.utils import int_to_hex4str, capture_monotonic_time
+from .errors import InvalidDriverError, InvalidModuleError
+from .serializers import Serializer, JsonSerializer, get_serializer
 
 EVENT_STATE_CHANGED = 0x91
 
+BG_LANE_DEFAULT = 'default'
+BG_LANE_SENSORS = 'sensors'  # Blocking sensor reads
+
 
 class InstanceSettings:
+    RUNTIME_THREADED = 'threaded'  # Main loop, event loop and workers are running in dedicated threads
+    RUNTIME_ASYNCIO = 'asyncio'  # Device steps and event dispatching are driven by single asyncio event loop
+
+    SUPPORTED_RUNTIMES = (RUNTIME_THREADED, RUNTIME_ASYNCIO)
+
+    EVENT_DISPATCH_BLOCKING = 'blocking'  # Event loop sleeps on the queue and wakes up as soon as event is emitted
+    EVENT_DISPATCH_POLLING = 'polling'  # Event loop handles pending events every EVENT_HANDLING_LOOP_INTERVAL ms
+
+    SUPPORTED_EVENT_DISPATCH_MODES = (EVENT_DISPATCH_BLOCKING, EVENT_DISPATCH_POLLING)
+
     def __init__(self):
         self.id = None
         self.enable_cli = False
         self.context_path = []
+        self.runtime = InstanceSettings.RUNTIME_THREADED
+        self.event_dispatch_mode = InstanceSettings.EVENT_DISPATCH_BLOCKING
+        self.background_workers = 1  # Number of workers serving default lane
+        self.background_lanes = {BG_LANE_SENSORS: 1}  # type: Dict[str, int]
+        # Queue limits. Capacity 0 means unlimited queue. See common.queues.OverflowPolicy for supported policies.
+        # Event queue can't use blocking policy: event handlers emit events from the event loop thread
+        self.event_queue_capacity = 4096
+        self.event_queue_overflow = 'drop_oldest'
+        self.task_queue_capacity = 1024  # Per lane
+        self.task_queue_overflow = 'drop_newest'
+        # If enabled there will be at most one pending state_changed event per device, newer one replaces pending
+        self.coalesce_state_events = False
+        # (bind_address, port) of HTTP endpoint exposing metrics in OpenMetrics format. None disables it
+        self.metrics_endpoint = None  # type: Tuple[str, int]
+        # Max time in ms shutdown waits for pending events, tasks and in-flight steps to complete
+        self.shutdown_timeout = 5000
+        # Max duration of device step or pipe action in ms before watchdog reports a stall. 0 disables watchdog
+        self.watchdog_threshold = 10000
+        # If enabled stalled device is excluded from the main loop and pipes until released via control socket
+        self.watchdog_quarantine = False
+        # Number of recent events and background tasks kept by flight recorder. 0 disables recorder
+        self.flight_recorder_size = 4096
+        # Number of spare event and background task objects kept for reuse (per message type). 0 disables pooling
+        self.message_pool_size = 0
+        # Directory for diagnostic dumps (profiler output, flight recorder etc.)
+        self.dump_dir = tempfile.gettempdir()
+        # Cache of the module catalogue used by lazy module discovery. None disables cache.
+        # Catalogue refers to the classes which will be imported, so it's kept in per-user cache directory
+        cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        self.module_catalogue = os.path.join(cache_dir, 'jointbox', 'modules.json')
+        # UNIX socket used by CLI to communicate with running instance. None disables it.
+        # Enabled by default only if there is private per-user runtime directory
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        self.control_socket = os.path.join(runtime_dir, 'jointbox.sock') if runtime_dir else None
 
 
 class IdentifiableComponent(object):
@@ -118,57 +168,159 @@ class ParameterDef:
                 raise ValueError('Parameter {} is invalid'.format(self.name))
 
 
-class Serializer(object):
-    def serialize(self, obj):
-        raise NotImplementedError("This method needs to be implemented in child class")
+def _state_field(index: int) -> property:
+    def getter(self):
+        return self._values[index]
 
-    def deserialize(self, data):
-        raise NotImplementedError("This method needs to be implemented in child class")
+    def setter(self, value):
+        values = self._values
+        current = values[index]
+        if current is not value and current != value:
+            values[index] = value
+            self._dirty |= 1 << index
+            self._encoded = None
 
-
-class JsonSerializer(Serializer):
-    def serialize(self, obj: object):
-        json.dumps(obj)
-
-    def deserialize(self, data: str):
-        return json.loads(data)
+    return property(getter, setter)
 
 
 class ModelState(object):
+    """
+    Device state. ModelState(fields) creates instance of the class generated once per fields schema: field values
+    are kept in a list and accessed through per-field properties, no per-instance dict is allocated.
+    Assignments changing field value are tracked, see commit() and changes().
+    Encoded state is cached per serializer until the next change, see encode()
+    """
     __DEFAULT_FILED_NAME = '$default'
+    __schemas = {}  # type: Dict[Tuple[str, ...], type]
+
+    __slots__ = ('_values', '_dirty', '_encoded', 'serializer', 'last_changed')
 
-    def __init__(self, fields: List[str] = None, serializer: Serializer = JsonSerializer()):
-        self.fields = fields
-        self.__data = {}
+    fields = ()  # type: Tuple[str, ...]
+    _index = {}  # type: Dict[str, int]
+
+    def __new__(cls, fields: List[str] = None, serializer: Serializer = None):
+        if cls is ModelState:
+            cls = ModelState.schema(fields)
+        return object.__new__(cls)
+
+    def __init__(self, fields: List[str] = None, serializer: Serializer = get_serializer(JsonSerializer.NAME)):
+        self._values = [None] * len(self.fields)
+        self._dirty = 0  # Bit mask of the fields changed since the last commit
+        self._encoded = None  # type: Dict[Serializer, Any]
         self.serializer = serializer
-        if self.fields is None:
-            self.fields = [self.__DEFAULT_FILED_NAME]
+        self.last_changed = ()  # type: Tuple[str, ...]
+
+    @staticmethod
+    def schema(fields: [List[str], None]) -> type:
+        """
+        :return: ModelState subclass for the given list of fields. Classes are cached, so every device with the same
+        STATE_FIELDS shares the same class
+        """
+        key = tuple(fields) if fields is not None else (ModelState.__DEFAULT_FILED_NAME,)
+        state_class = ModelState.__schemas.get(key)
+        if state_class is None:
+            namespace = dict(__slots__=(), fields=key, _index={name: i for i, name in enumerate(key)})
+            for i, name in enumerate(key):
+                if hasattr(ModelState, name):
+                    raise InvalidModuleError("State field name {} is reserved".format(name))
+                namespace[name] = _state_field(i)
+            state_class = type('ModelState', (ModelState,), namespace)
+            ModelState.__schemas[key] = state_class
+        return state_class
+
+    def get(self, name: str):
+        return self._values[self._index[name]]
+
+    def set(self, name: str, value):
+        setattr(self, name, value)
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty != 0
+
+    def changed_fields(self) -> Tuple[str, ...]:
+        """
+        :return: fields changed since the last commit
+        """
+        dirty = self._dirty
+        return tuple(name for i, name in enumerate(self.fields) if dirty & (1 << i))
+
+    def commit(self) -> Tuple[str, ...]:
+        """
+        Resets change tracking
+        :return: fields changed since the previous commit. Also available as last_changed until the next commit
+        """
+        changed = self.changed_fields() if self._dirty else ()
+        self._dirty = 0
+        self.last_changed = changed
+        return changed
+
+    def changes(self) -> dict:
+        """
+        :return: fields changed by the last commit with their current values
+        """
+        values = self._values
+        index = self._index
+        return {name: values[index[name]] for name in self.last_changed}
+
+    def snapshot(self) -> 'ModelState':
+        """
+        :return: detached copy of the current values and the last commit. Events carry snapshots because they are
+        dispatched later, when the state itself might have been changed and committed again
+        """
+        copy = object.__new__(type(self))
+        copy._values = list(self._values)
+        copy._dirty = 0
+        copy._encoded = None
+        copy.serializer = self.serializer
+        copy.last_changed = self.last_changed
+        return copy
+
+    def merge_changes(self, older: 'ModelState'):
+        """
+        Adds fields changed by the older commit to last_changed. Used when event carrying older snapshot is coalesced
+        with the newer one, so consumers of changes() still see every changed field
+        """
+        if older.last_changed:
+            changed = set(self.last_changed).union(older.last_changed)
+            self.last_changed = tuple(name for name in self.fields if name in changed)
 
     def read_state(self, data: str):
-        self.__data = self.serializer.deserialize(data)
+        for name, value in self.serializer.deserialize(data).items():
+            if name in self._index:
+                setattr(self, name, value)
+
+    def encode(self, serializer: Serializer = None):
+        """
+        Returns state encoded with the given serializer (state serializer by default). Result is computed once per
+        change and shared by all consumers (MQTT, snapshots etc.)
+        """
+        if serializer is None:
+            serializer = self.serializer
+        cache = self._encoded
+        if cache is None:
+            cache = {}
+            self._encoded = cache
+        encoded = cache.get(serializer)
+        if encoded is None:
+            encoded = serializer.serialize_fields(self.fields, self._values)
+            cache[serializer] = encoded
+        return encoded
 
     def serialize_state(self):
-        self.serializer.serialize(self.__data)
+        return self.encode()
 
     def as_dict(self):
-        return dict(self.__data)
-
-    def __getattr__(self, item):
-        if item == 'fields':
-            return object.__getattribute__(self, item)
-        if item in self.fields:
-            return self.__data.get(item, None)
-        else:
-            return self.__getattribute__(item)
+        """
+        :return: fields which have value
+        """
+        values = self._values
+        if None not in values:
+            return dict(zip(self.fields, values))
+        return {name: value for name, value in zip(self.fields, values) if value is not None}
 
-    def __setattr__(self, name, value):
-        if name != 'fields':
-            if name in self.fields:
-                self.__data[name] = value
-            else:
-                return object.__setattr__(self, name, value)
-        else:
-            return object.__setattr__(self, name, value)
+    def __repr__(self):
+        return 'ModelState({})'.format(self.as_dict())
 
 
 class CliExtension(object):
@@ -228,6 +380,33 @@ class ExternalRefHandler:
         pass
 
 
+class ModuleMetadata(object):
+    """
+    Events, actions and parameters of the module class merged along MRO. Definition declared in subclass overrides
+    the one with the same name declared in base class. Computed once per class, see DeviceModule.metadata()
+    """
+    __slots__ = ('events', 'actions', 'params', 'events_by_name', 'events_by_id', 'actions_by_name', 'actions_by_id',
+                 'params_by_name')
+
+    def __init__(self, module_class):
+        self.events = self.__merge(module_class, 'EVENTS')  # type: Tuple[EventDef, ...]
+        self.actions = self.__merge(module_class, 'ACTIONS')  # type: Tuple[ActionDef, ...]
+        self.params = self.__merge(module_class, 'PARAMS')  # type: Tuple[ParameterDef, ...]
+        self.events_by_name = {x.name: x for x in self.events}  # type: Dict[str, EventDef]
+        self.events_by_id = {x.id: x for x in self.events}  # type: Dict[int, EventDef]
+        self.actions_by_name = {x.name: x for x in self.actions}  # type: Dict[str, ActionDef]
+        self.actions_by_id = {x.id: x for x in self.actions}  # type: Dict[int, ActionDef]
+        self.params_by_name = {x.name: x for x in self.params}  # type: Dict[str, ParameterDef]
+
+    @staticmethod
+    def __merge(module_class, attr: str) -> tuple:
+        merged = OrderedDict()
+        for cls in reversed(module_class.__mro__):
+            for definition in cls.__dict__.get(attr, None) or ():
+                merged[definition.name] = definition
+        return tuple(merged.values())
+
+
 class DeviceModule(Module):
     EVENTS = []
     ACTIONS = []  # type: List[ActionDef]
@@ -235,6 +414,7 @@ class DeviceModule(Module):
     REQUIRED_DRIVERS = []
     IN_LOOP = True  # Indicates that instance of of this module will be queried (step method) in main application loop
     IN_BACKGROUND = False
+    BACKGROUND_LANE = BG_LANE_DEFAULT  # Worker pool lane used for running step in background
     MINIMAL_ITERATION_INTERVAL = 0  # Minimum interval between iterations in milliseconds
 
     def __init__(self, application, drivers: Dict[int, Driver]):
@@ -242,7 +422,10 @@ class DeviceModule(Module):
         :type application: common.core.ApplicationManager
         """
         super().__init__(application, drivers)
-        self.last_step = 0
+        self.last_step = 0  # Time when the last step was completed
+        self.step_in_flight = False  # Indicates that background step is queued or running
+        self.skipped_steps = 0  # Number of background steps skipped because previous one was still in flight
+        self.quarantined = False  # Quarantined device is neither stepped nor used as pipe target
         self.piped_events = {}  # type: Dict[int, ]
 
     def emit(self, event_id, data=None):
@@ -251,19 +434,32 @@ class DeviceModule(Module):
     def step(self):
         pass
 
+    @classmethod
+    def metadata(cls) -> ModuleMetadata:
+        """
+        Returns merged definitions of the class. Computed on module registration or on the first call
+        """
+        metadata = cls.__dict__.get('_metadata')
+        if metadata is None:
+            metadata = ModuleMetadata(cls)
+            cls._metadata = metadata
+        return metadata
+
     @classmethod
     def get_event_by_name(cls, event_name: str) -> [EventDef, None]:
-        for x in cls.EVENTS:
-            if x.name == event_name:
-                return x
-        return None
+        return cls.metadata().events_by_name.get(event_name)
+
+    @classmethod
+    def get_event_by_id(cls, event_id: int) -> [EventDef, None]:
+        return cls.metadata().events_by_id.get(event_id)
 
     @classmethod
     def get_action_by_name(cls, action_name: str) -> [ActionDef, None]:
-        for x in cls.ACTIONS:
-            if x.name == action_name:
-                return x
-        return None
+        return cls.metadata().actions_by_name.get(action_name)
+
+    @classmethod
+    def get_action_by_id(cls, action_id: int) -> [ActionDef, None]:
+        return cls.metadata().actions_by_id.get(action_id)
 
     def __str__(self, *args, **kwargs):
         return '{}({})'.format(self.type_name(), int_to_hex4str(self.typeid()))
@@ -274,11 +470,19 @@ class StateAwareModule(DeviceModule):
 
     def __init__(self, application, drivers: Dict[int, Driver]):
         super().__init__(application, drivers)
-        self.EVENTS += StateAwareModule.EVENTS
         self.state = ModelState(self.STATE_FIELDS)
 
-    def commit_state(self):
-        self.emit(EVENT_STATE_CHANGED, self.state)
+    def commit_state(self) -> bool:
+        """
+        Emits state_changed event if any state field has been changed since the previous commit.
+        Event carries snapshot of the state, consumers could get changed fields with data.changes()
+        :return: True if event has been emitted
+        """
+        if not self.state.dirty:
+            return False
+        self.state.commit()
+        self.emit(EVENT_STATE_CHANGED, self.state.snapshot())
+        return True
 
     EVENTS = [
         EventDef(EVENT_STATE_CHANGED, 'state_changed')
@@ -286,6 +490,12 @@ class StateAwareModule(DeviceModule):
 
 
 class PipedEvent(object):
+    """
+    Link between event of the source device and action of the target one. Invocation is pre-bound: target, event
+    and work label are resolved once on pipe creation so dispatching doesn't allocate anything per call
+    """
+    __slots__ = ('declared_in', 'event', 'target', 'args', 'action', 'work_label')
+
     def __init__(self, declared_in: DeviceModule = None, target: DeviceModule = None, event: EventDef = None,
                  action: ActionDef = None,
                  args: dict = None):
@@ -294,21 +504,55 @@ class PipedEvent(object):
         self.target = target
         self.args = args
         self.action = action
+        self.work_label = 'device:' + target.name if target is not None else None
+
+    def invoke(self, data, sender: DeviceModule):
+        self.action.callable(self.target, data, event=self.event, sender=sender)
 
 
 class InternalEvent(object):
+    __slots__ = ('sender', 'event_id', 'data', 'created_at')
+
     def __init__(self, sender: DeviceModule = None, event_id: int = None, data: dict = None):
+        self.reset(sender, event_id, data)
+
+    def reset(self, sender: DeviceModule = None, event_id: int = None, data: dict = None) -> 'InternalEvent':
         self.sender = sender
         self.event_id = event_id
         self.data = data
+        self.created_at = capture_monotonic_time()
+        return self
 
 
 class BackgroundTask(object):
-    def __init__(self, callable: Callable, ignore_errors=False, *args, **kwargs):
+    __slots__ = ('callable', 'args', 'kwargs', 'ignore_errors', 'lane', 'created_at')
+
+    def __init__(self, callable: Callable, ignore_errors=False, *args, lane: str = BG_LANE_DEFAULT, **kwargs):
+        self.reset(callable, ignore_errors, args, kwargs, lane)
+
+    @classmethod
+    def create(cls, callable: Callable, ignore_errors=False, args: tuple = (), kwargs: dict = None,
+               lane: str = BG_LANE_DEFAULT) -> 'BackgroundTask':
+        """
+        Same as constructor but takes args and kwargs as is, without packing them into the new tuple and dict
+        """
+        return cls.__new__(cls).reset(callable, ignore_errors, args, kwargs, lane)
+
+    def reset(self, callable: Callable = None, ignore_errors=False, args: tuple = (), kwargs: dict = None,
+              lane: str = BG_LANE_DEFAULT) -> 'BackgroundTask':
         self.callable = callable
-        self.kwargs = kwargs
         self.args = args
+        self.kwargs = kwargs  # None or empty dict means no keyword args
         self.ignore_errors = ignore_errors
+        self.lane = lane
+        self.created_at = capture_monotonic_time()
+        return self
+
+    def run(self):
+        if self.kwargs:
+            self.callable(*self.args, **self.kwargs)
+        else:
+            self.callable(*self.args)
 
 
 class ACL(object):
@@ -342,10 +586,56 @@ class ACL(object):
                 raise ValueError("ACL.Entry.target type should be one of: " + str(ACL.SUPPORTED_TARGET_TYPES))
             self.__target_type = val
 
+    class RuleSet(object):
+        """
+        Compiled set of ACL entries. Exact entries are kept in hash set, entries with wildcards (* and ?) in device or
+        target name are combined into single regular expression per target type
+        """
+        WILDCARD_CHARS = ('*', '?')
+
+        def __init__(self):
+            super().__init__()
+            self.__exact = set()  # type: set
+            self.__patterns = {}  # type: Dict[str, List[str]]  # target type -> list of regex sources
+            self.__compiled = {}  # type: Dict[str, Any]  # target type -> compiled regex
+
+        @staticmethod
+        def __translate(pattern: str) -> str:
+            return ''.join('[^\x00]*' if c == '*' else '[^\x00]' if c == '?' else re.escape(c) for c in pattern)
+
+        @classmethod
+        def is_pattern(cls, name: str) -> bool:
+            return name is not None and any(c in name for c in cls.WILDCARD_CHARS)
+
+        def add(self, entry):
+            """
+            :type entry: ACL.Entry
+            """
+            if self.is_pattern(entry.device_name) or self.is_pattern(entry.target_name):
+                source = self.__translate(entry.device_name or '') + '\x00' + self.__translate(entry.target_name or '')
+                patterns = self.__patterns.setdefault(entry.target_type, [])
+                patterns.append(source)
+                self.__compiled[entry.target_type] = re.compile('(?:' + '|'.join(patterns) + ')\\Z')
+            else:
+                self.__exact.add((entry.device_name, entry.target_name, entry.target_type))
+
+        def matches(self, device_name: str, target_name: str, target_type: str) -> bool:
+            if (device_name, target_name, target_type) in self.__exact:
+                return True
+            compiled = self.__compiled.get(target_type)
+            if compiled is None or device_name is None or target_name is None:
+                return False
+            return compiled.match(device_name + '\x00' + target_name) is not None
+
+    MAX_CACHED_DECISIONS = 4096
+
     def __init__(self):
         super().__init__()
         self.__allowed = []
         self.__denied = []
+        self.__allowed_rules = ACL.RuleSet()
+        self.__denied_rules = ACL.RuleSet()
+        self.__decisions = {}  # type: Dict[Tuple[str, str, str], bool]
         self.__mode = ACL.MODE_RESTRICTIVE
 
     @property
@@ -365,25 +655,41 @@ class ACL(object):
         if val not in ACL.SUPPORTED_MODES:
             raise ValueError("ACL mode should be one of: " + str(ACL.SUPPORTED_MODES))
         self.__mode = val
+        self.__decisions = {}
 
     def allow(self, device_name: str, target_name: str, target_type: str):
-        self.__allowed.append(ACL.Entry(device_name, target_type, target_name))
+        """
+        Device and target names may contain wildcards: * matches any sequence of characters, ? matches one character
+        """
+        entry = ACL.Entry(device_name, target_type, target_name)
+        self.__allowed.append(entry)
+        self.__allowed_rules.add(entry)
+        self.__decisions = {}
 
     def deny(self, device_name: str, target_name: str, target_type: str):
-        self.__denied.append(ACL.Entry(device_name, target_type, target_name))
+        entry = ACL.Entry(device_name, target_type, target_name)
+        self.__denied.append(entry)
+        self.__denied_rules.add(entry)
+        self.__decisions = {}
 
-    def __has_entry(self, collection: List[Entry], device_name: str, target_name: str, target_type: str):
-        for entry in collection:
-            if entry.device_name == device_name and entry.target_name == target_name and entry.target_type == target_type:
-                return True
-        return False
-
-    def validate_operation(self, device_name: str, target_name: str, target_type: str = TARGET_TYPE_ACTION):
+    def __decide(self, device_name: str, target_name: str, target_type: str) -> bool:
         if self.mode == self.MODE_RESTRICTIVE:
-            if self.__has_entry(self.denied, device_name, target_name, target_type):
+            if self.__denied_rules.matches(device_name, target_name, target_type):
                 return False
-            return self.__has_entry(self.allowed, device_name, target_name, target_type)
+            return self.__allowed_rules.matches(device_name, target_name, target_type)
         elif self.mode == self.MODE_PERMISSIVE:
-            return not self.__has_entry(self.denied, device_name, target_name, target_type)
+            return not self.__denied_rules.matches(device_name, target_name, target_type)
         else:
             return False
+
+    def validate_operation(self, device_name: str, target_name: str, target_type: str = TARGET_TYPE_ACTION):
+        key = (device_name, target_name, target_type)
+        decisions = self.__decisions
+        decision = decisions.get(key)
+        if decision is None:
+            decision = self.__decide(device_name, target_name, target_type)
+            # Names come from the network, so cache is bounded
+            if len(decisions) >= self.MAX_CACHED_DECISIONS:
+                decisions.clear()
+            decisions[key] = decision
+        return decision
@@ -0,0 +1,58 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Callable, Any
+
+
+class ObjectPool(object):
+    """
+    Free list of reusable message objects (events, background tasks). Pooled object should implement
+    reset(*args) which (re)initializes all the fields and returns the object itself, released objects are reset with
+    no arguments so they don't keep references to payload.
+    Acquire and release are single list operations, atomic in CPython, so pool is shared between threads without
+    locking. Pool with capacity 0 is disabled: objects are always created by factory and never kept.
+    """
+
+    def __init__(self, factory: Callable[..., Any], capacity: int = 0):
+        super().__init__()
+        self.__factory = factory
+        self.__free = []
+        self.capacity = capacity
+        self.reused = 0  # Approximate, not synchronized between threads
+
+    def acquire(self, *args):
+        if self.capacity > 0:
+            try:
+                obj = self.__free.pop()
+            except IndexError:
+                pass
+            else:
+                self.reused += 1
+                return obj.reset(*args)
+        return self.__factory(*args)
+
+    def release(self, obj):
+        """
+        Returns object to the pool. Caller should not keep any references to it after release
+        """
+        if len(self.__free) < self.capacity:
+            obj.reset()
+            self.__free.append(obj)
+
+    @property
+    def free(self) -> int:
+        return len(self.__free)
@@ -0,0 +1,125 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+
+from typing import Callable, Dict
+
+
+class SamplingProfiler(object):
+    """
+    Low overhead statistical profiler. Periodically captures stacks of all application threads and aggregates them
+    into collapsed stacks (one line per unique stack: "frame;frame;frame count") which could be converted into
+    flamegraph with flamegraph.pl or loaded into speedscope.
+    Each stack starts with the thread name followed by the current work marker (e.g. device:lamp) if the thread
+    is busy with a device at the moment of sampling, which gives per-device breakdown.
+    """
+    DEFAULT_INTERVAL = 10  # milliseconds
+    MAX_DEPTH = 128
+
+    def __init__(self, thread_manager, work_markers: Callable[[], Dict[int, str]] = None):
+        """
+        :type thread_manager: common.core.ThreadManager
+        :param work_markers: returns mapping thread ident -> label of the work being done by the thread
+        """
+        super().__init__()
+        self.__thread_manager = thread_manager
+        self.__work_markers = work_markers
+        self.__stacks = Counter()
+        self.__work_samples = Counter()
+        self.__samples = 0
+        self.__thread = None  # type: common.core.ManagedThread
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger('SamplingProfiler')
+
+    @property
+    def running(self) -> bool:
+        return self.__thread is not None
+
+    @property
+    def samples(self) -> int:
+        return self.__samples
+
+    def start(self, interval: int = DEFAULT_INTERVAL):
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__stacks.clear()
+            self.__work_samples.clear()
+            self.__samples = 0
+            # Dedicated thread: shared timer thread runs MQTT and RPC handlers which should be sampled as well
+            self.__thread = self.__thread_manager.request_thread('Profiler', self.sample, step_interval=interval)
+        self.__logger.info("Profiler started. Sampling interval: {}ms".format(interval))
+
+    def stop(self):
+        with self.__lock:
+            if self.__thread is None:
+                return
+            self.__thread_manager.dispose_thread(self.__thread, wait=False)
+            self.__thread = None
+        self.__logger.info("Profiler stopped. Collected {} samples".format(self.__samples))
+
+    @staticmethod
+    def __format_frame(frame) -> str:
+        code = frame.f_code
+        return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def sample(self):
+        own_ident = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        markers = self.__work_markers() if self.__work_markers is not None else {}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.MAX_DEPTH:
+                stack.append(self.__format_frame(frame))
+                frame = frame.f_back
+            stack.reverse()
+            marker = markers.get(ident)
+            if marker is not None:
+                stack.insert(0, marker)
+            stack.insert(0, names.get(ident, str(ident)))
+            stacks.append((marker, ';'.join(stack)))
+        with self.__lock:
+            if self.__thread is None:
+                return  # Profiler has been stopped while sample was being taken
+            for marker, stack in stacks:
+                if marker is not None:
+                    self.__work_samples[marker] += 1
+                self.__stacks[stack] += 1
+            self.__samples += 1
+
+    def work_breakdown(self) -> Dict[str, int]:
+        """
+        :return: number of samples per work marker e.g. {'device:lamp': 10}
+        """
+        return dict(self.__work_samples)
+
+    def write(self, path: str):
+        """
+        Writes collected data in collapsed stack format
+        """
+        stacks = list(self.__stacks.items())
+        with open(path, 'w') as f:
+            for stack, count in sorted(stacks):
+                f.write('{} {}\n'.format(stack, count))
@@ -0,0 +1,224 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+from collections import deque
+from queue import Empty
+
+from typing import Callable, Any, Tuple
+
+
+class OverflowPolicy(object):
+    BLOCK = 'block'  # Producer waits until there is free space in the queue
+    DROP_NEWEST = 'drop_newest'  # Item being enqueued is discarded
+    DROP_OLDEST = 'drop_oldest'  # The oldest pending item is discarded to free space for the new one
+    COALESCE = 'coalesce'  # Pending item with the same key is replaced by the new one. Otherwise new item is discarded
+
+    SUPPORTED_POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST, COALESCE)
+
+
+class BoundedQueue(object):
+    """
+    FIFO queue with optional capacity limit and explicit overflow policy. Keeps counters which might be used
+    for monitoring: number of dropped and coalesced items and the high-water mark.
+    Capacity 0 means unlimited queue.
+    on_evicted is called (outside of the queue lock) for every accepted item which has been discarded later to free
+    space for the new one (drop_oldest), so the owner could release resources associated with it.
+    merge_func(pending, item) is called (under the queue lock) when item is coalesced with the pending one and returns
+    the item to keep, so information carried by the pending item is not lost. By default item simply replaces it.
+    """
+
+    def __init__(self, name: str, capacity: int = 0, overflow: str = OverflowPolicy.BLOCK,
+                 key_func: Callable[[Any], Any] = None, on_evicted: Callable[[Any], None] = None,
+                 merge_func: Callable[[Any, Any], Any] = None):
+        super().__init__()
+        if overflow not in OverflowPolicy.SUPPORTED_POLICIES:
+            raise ValueError("Overflow policy should be one of: " + str(OverflowPolicy.SUPPORTED_POLICIES))
+        if overflow == OverflowPolicy.COALESCE and key_func is None:
+            raise ValueError("Coalesce overflow policy requires key function")
+        self.name = name
+        self.capacity = capacity
+        self.overflow = overflow
+        self.__key_func = key_func
+        self.__on_evicted = on_evicted
+        self.__merge_func = merge_func
+        self.__items = deque()  # Contains cells: [key, item]
+        self.__index = {}  # key -> the most recent pending cell with this key
+        self.__lock = threading.Lock()
+        self.__not_empty = threading.Condition(self.__lock)
+        self.__not_full = threading.Condition(self.__lock)
+        self.__closed = False
+        self.__interrupted = False
+        # Counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.high_water_mark = 0
+
+    def __len__(self):
+        return len(self.__items)
+
+    def qsize(self) -> int:
+        return len(self.__items)
+
+    def empty(self) -> bool:
+        return not self.__items
+
+    def full(self) -> bool:
+        return self.__is_full()
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    def __is_full(self):
+        return 0 < self.capacity <= len(self.__items)
+
+    def __append(self, item, key=None):
+        cell = [key, item]
+        self.__items.append(cell)
+        if key is not None:
+            self.__index[key] = cell
+        self.enqueued += 1
+        if len(self.__items) > self.high_water_mark:
+            self.high_water_mark = len(self.__items)
+        self.__not_empty.notify()
+
+    def __pop(self):
+        cell = self.__items.popleft()
+        key = cell[0]
+        if key is not None and self.__index.get(key) is cell:
+            del self.__index[key]
+        self.__not_full.notify()
+        return cell[1]
+
+    def put(self, item) -> bool:
+        """
+        Enqueues item according to overflow policy.
+        :return: True if item has been accepted (enqueued or merged into pending one), False if it has been dropped
+        """
+        key = self.__key_func(item) if self.overflow == OverflowPolicy.COALESCE else None
+        with self.__lock:
+            accepted, evicted = self.__put(item, key)
+        if evicted is not None and self.__on_evicted is not None:
+            self.__on_evicted(evicted)
+        return accepted
+
+    def put_coalesced(self, item) -> bool:
+        """
+        Latest-wins enqueue: if there is pending item with the same key it is replaced in place (keeping its position
+        in the queue), otherwise item is enqueued according to overflow policy.
+        :return: True if item has been accepted, False if it has been dropped
+        """
+        key = self.__key_func(item)
+        with self.__lock:
+            cell = self.__index.get(key) if not self.__closed else None
+            if cell is not None:
+                cell[1] = item if self.__merge_func is None else self.__merge_func(cell[1], item)
+                self.coalesced += 1
+                return True
+            accepted, evicted = self.__put(item, key)
+        if evicted is not None and self.__on_evicted is not None:
+            self.__on_evicted(evicted)
+        return accepted
+
+    def __put(self, item, key) -> Tuple[bool, Any]:
+        """
+        Should be called with lock held
+        :return: whether item has been accepted and the item evicted to free space for it (or None)
+        """
+        if self.__closed:
+            self.dropped += 1
+            return False, None
+        evicted = None
+        if self.__is_full():
+            if self.overflow == OverflowPolicy.BLOCK:
+                while self.__is_full() and not self.__closed:
+                    self.__not_full.wait()
+                if self.__closed:
+                    self.dropped += 1
+                    return False, None
+            elif self.overflow == OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+                return False, None
+            elif self.overflow == OverflowPolicy.DROP_OLDEST:
+                evicted = self.__pop()
+                self.dropped += 1
+            elif self.overflow == OverflowPolicy.COALESCE:
+                cell = self.__index.get(key)
+                if cell is None:
+                    self.dropped += 1
+                    return False, None
+                cell[1] = item if self.__merge_func is None else self.__merge_func(cell[1], item)
+                self.coalesced += 1
+                return True, None
+        self.__append(item, key)
+        return True, evicted
+
+    def force_put(self, item):
+        """
+        Enqueues item ignoring capacity limit and closed state. Intended for control messages e.g. stop signals
+        """
+        with self.__lock:
+            self.__append(item)
+
+    def get(self, timeout: float = None):
+        """
+        Removes and returns the oldest item. Blocks until item is available or queue is interrupted.
+        :param timeout: timeout in seconds. If it expires queue.Empty is raised
+        """
+        with self.__lock:
+            if not self.__items:
+                self.__not_empty.wait_for(lambda: self.__items or self.__interrupted, timeout)
+                if not self.__items:
+                    raise Empty()
+            return self.__pop()
+
+    def get_nowait(self):
+        with self.__lock:
+            if not self.__items:
+                raise Empty()
+            return self.__pop()
+
+    def close(self):
+        """
+        Makes queue reject all new items. Producers blocked on full queue are released.
+        """
+        with self.__lock:
+            self.__closed = True
+            self.__not_full.notify_all()
+
+    def interrupt(self):
+        """
+        Releases consumers blocked in get(). From now on get() raises queue.Empty instead of waiting for items,
+        so consumers could check other conditions between items
+        """
+        with self.__lock:
+            self.__interrupted = True
+            self.__not_empty.notify_all()
+
+    def stats(self) -> dict:
+        return dict(
+            name=self.name,
+            capacity=self.capacity,
+            overflow=self.overflow,
+            depth=len(self.__items),
+            high_water_mark=self.high_water_mark,
+            enqueued=self.enqueued,
+            dropped=self.dropped,
+            coalesced=self.coalesced,
+        )
@@ -0,0 +1,106 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import itertools
+import json
+import time
+
+from typing import List, Any
+
+
+class FlightRecorder(object):
+    """
+    Fixed size ring buffer keeping the most recent dispatched events and executed background tasks.
+    Storage is allocated once, recording is a single slot assignment of a tuple of references, all the formatting
+    is postponed until dump, so recorder is cheap enough to stay enabled all the time.
+    """
+    KIND_EVENT = 'event'
+    KIND_TASK = 'task'
+
+    def __init__(self, capacity: int):
+        super().__init__()
+        self.__capacity = capacity
+        self.__slots = [None] * capacity  # type: List[tuple]
+        self.__sequence = itertools.count()
+
+    @property
+    def capacity(self) -> int:
+        return self.__capacity
+
+    @property
+    def enabled(self) -> bool:
+        return self.__capacity > 0
+
+    def record(self, kind: str, start_time: float, source: Any, event_id: [int, None], targets: Any,
+               queue_wait: float, duration: float):
+        """
+        :param start_time: monotonic time in ms when handling has been started. Converted to wall clock time on dump,
+        which saves reading the wall clock for every record
+        :param source: sender device for events, callable for background tasks
+        :param targets: list of pipes for events, task args for background tasks. Resolved lazily on dump
+        :param queue_wait: time in ms spent in the queue
+        :param duration: handler duration in ms
+        """
+        if self.__capacity == 0:
+            return
+        seq = next(self.__sequence)  # atomic in CPython, no lock needed
+        self.__slots[seq % self.__capacity] = (seq, kind, start_time, source, event_id, targets, queue_wait, duration)
+
+    def clear(self):
+        for i in range(self.__capacity):
+            self.__slots[i] = None
+
+    @staticmethod
+    def __name_of(obj) -> [str, None]:
+        if obj is None:
+            return None
+        name = getattr(obj, 'name', None)
+        if isinstance(name, str):
+            return name
+        return getattr(obj, '__qualname__', None) or getattr(obj, '__name__', None) or repr(obj)
+
+    def __format(self, record: tuple, clock_offset: float) -> dict:
+        seq, kind, start_time, source, event_id, targets, queue_wait, duration = record
+        if kind == self.KIND_EVENT:
+            target_names = [self.__name_of(x.target) + '.' + x.action.name for x in targets]
+        else:
+            # Background tasks related to device receive it as the first argument
+            target_names = [x.name for x in targets[:1] if isinstance(getattr(x, 'name', None), str)]
+        return dict(seq=seq, kind=kind, time=round(start_time + clock_offset, 3), source=self.__name_of(source),
+                    event_id=event_id, targets=target_names, queue_wait_ms=round(queue_wait, 3),
+                    duration_ms=round(duration, 3))
+
+    def records(self) -> List[dict]:
+        """
+        :return: recorded entries from the oldest to the newest
+        """
+        snapshot = [x for x in list(self.__slots) if x is not None]
+        snapshot.sort(key=lambda x: x[0])
+        clock_offset = (time.time() - time.monotonic()) * 1000  # Monotonic to wall clock time
+        return [self.__format(x, clock_offset) for x in snapshot]
+
+    def dump(self, path: str) -> int:
+        """
+        Writes recorded entries into the file, one JSON object per line
+        :return: number of written records
+        """
+        records = self.records()
+        with open(path, 'w') as f:
+            f.write(json.dumps(dict(dumped_at=time.time() * 1000, capacity=self.__capacity)) + '\n')
+            for x in records:
+                f.write(json.dumps(x) + '\n')
+        return len(records)
@@ -0,0 +1,130 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import threading
+
+from typing import List, Tuple, Any
+
+from common import utils
+
+
+class DeviceScheduler(object):
+    """
+    Keeps devices which should be queried in main loop in a min-heap ordered by the time of the next iteration.
+    All times are monotonic milliseconds (see utils.capture_monotonic_time).
+    Scheduler is owned by the main loop thread, however add/remove/wakeup are safe to call from any thread.
+    """
+    MINIMAL_INTERVAL = 1  # Devices with MINIMAL_ITERATION_INTERVAL=0 will be queried at most once per millisecond
+
+    def __init__(self):
+        super().__init__()
+        self.__heap = []
+        self.__entries = {}  # device id -> heap entry
+        self.__in_flight = set()  # ids of devices returned by pop_due and not rescheduled yet
+        self.__counter = 0
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Event()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __push(self, device, deadline: float):
+        self.__counter += 1
+        entry = [deadline, self.__counter, device]
+        self.__entries[device.id] = entry
+        heapq.heappush(self.__heap, entry)
+
+    def add(self, device, deadline: float = None):
+        """
+        Schedules device for the next iteration. If deadline is not set device will be queried as soon as possible
+        """
+        if deadline is None:
+            deadline = utils.capture_monotonic_time()
+        with self.__lock:
+            self.__remove(device)
+            self.__push(device, deadline)
+        self.__wakeup.set()
+
+    def __remove(self, device):
+        # Device being processed now should not be returned to the schedule by reschedule
+        self.__in_flight.discard(device.id)
+        entry = self.__entries.pop(device.id, None)
+        if entry is not None:
+            # Lazy removal: entry will be discarded once it reaches the top of the heap
+            entry[2] = None
+
+    def remove(self, device):
+        with self.__lock:
+            self.__remove(device)
+        self.__wakeup.set()
+
+    def reschedule(self, device, now: float):
+        """
+        Schedules the next iteration for the device which has just been processed. Does nothing if device has been
+        removed (or removed and added again) while it was processed
+        """
+        interval = max(device.MINIMAL_ITERATION_INTERVAL, self.MINIMAL_INTERVAL)
+        with self.__lock:
+            if device.id not in self.__in_flight:
+                return
+            self.__in_flight.discard(device.id)
+            self.__push(device, now + interval)
+
+    def pop_due(self, now: float) -> List[Tuple[Any, float]]:
+        """
+        Removes from the schedule and returns all devices which are due at the given point in time along with
+        the time they were scheduled at: [(device, deadline), ...].
+        Processed devices should be returned back with reschedule method
+        """
+        result = []
+        heap = self.__heap
+        with self.__lock:
+            while heap and heap[0][0] <= now:
+                deadline, counter, device = heapq.heappop(heap)
+                if device is None:
+                    continue
+                self.__entries.pop(device.id, None)
+                self.__in_flight.add(device.id)
+                result.append((device, deadline))
+        return result
+
+    def next_deadline(self) -> [float, None]:
+        heap = self.__heap
+        with self.__lock:
+            while heap and heap[0][2] is None:
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def wait(self, now: float, max_wait: float = None) -> [float, None]:
+        """
+        Blocks calling thread until the earliest deadline or until wakeup is called
+        :param now: current monotonic time in milliseconds
+        :param max_wait: upper bound for the wait in milliseconds. None means wait for the deadline or wakeup
+        :return: the deadline the thread was waiting for or None if there are no scheduled devices
+        """
+        deadline = self.next_deadline()
+        timeout = None if deadline is None else max(deadline - now, 0)
+        if max_wait is not None and (timeout is None or timeout > max_wait):
+            timeout = max_wait
+        if timeout is not None and timeout <= 0:
+            return deadline
+        self.__wakeup.wait(None if timeout is None else timeout / 1000)
+        self.__wakeup.clear()
+        return deadline
+
+    def wakeup(self):
+        self.__wakeup.set()
@@ -0,0 +1,259 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import math
+import struct
+
+from typing import Dict, List, Tuple
+
+from common.errors import ConfigError
+
+
+class Serializer(object):
+    NAME = None  # type: str
+    CONTENT_TYPE = None  # type: str
+
+    def serialize(self, obj):
+        raise NotImplementedError("This method needs to be implemented in child class")
+
+    def deserialize(self, data):
+        raise NotImplementedError("This method needs to be implemented in child class")
+
+    def serialize_fields(self, fields: Tuple[str, ...], values: List):
+        """
+        Serializes mapping of fields to values skipping fields without value. Used to encode ModelState.
+        Implementations may cache encoded field names per fields tuple
+        """
+        return self.serialize({name: value for name, value in zip(fields, values) if value is not None})
+
+
+class JsonSerializer(Serializer):
+    NAME = 'json'
+    CONTENT_TYPE = 'application/json'
+
+    def __init__(self):
+        super().__init__()
+        self.__encoder = json.JSONEncoder(separators=(',', ':'))
+        self.__field_names = {}  # type: Dict[Tuple[str, ...], List[str]]
+
+    def serialize(self, obj: object) -> str:
+        return self.__encoder.encode(obj)
+
+    def deserialize(self, data: [str, bytes]):
+        if isinstance(data, bytes):
+            data = str(data, 'utf-8')
+        return json.loads(data)
+
+    def __encode_value(self, value) -> str:
+        value_type = type(value)
+        if value_type is float and math.isfinite(value):
+            return float.__repr__(value)
+        if value_type is int:
+            return int.__repr__(value)
+        if value_type is bool:
+            return 'true' if value else 'false'
+        return self.__encoder.encode(value)
+
+    def serialize_fields(self, fields: Tuple[str, ...], values: List) -> str:
+        names = self.__field_names.get(fields)
+        if names is None:
+            names = [self.__encoder.encode(x) + ':' for x in fields]
+            self.__field_names[fields] = names
+        encode = self.__encode_value
+        return '{' + ','.join(name + encode(value) for name, value in zip(names, values) if value is not None) + '}'
+
+
+class CborSerializer(Serializer):
+    """
+    Compact binary codec implementing subset of CBOR (RFC 7049): integers, floats, booleans, null, text and byte
+    strings, arrays and maps of definite length. Floats are encoded with the shortest precision which keeps value
+    intact, so typical sensor reading takes 3-5 bytes
+    """
+    NAME = 'cbor'
+    CONTENT_TYPE = 'application/cbor'
+
+    MAJOR_UNSIGNED = 0
+    MAJOR_NEGATIVE = 1
+    MAJOR_BYTES = 2
+    MAJOR_TEXT = 3
+    MAJOR_ARRAY = 4
+    MAJOR_MAP = 5
+    MAJOR_SIMPLE = 7
+
+    FALSE = b'\xf4'
+    TRUE = b'\xf5'
+    NULL = b'\xf6'
+
+    __uint8 = struct.Struct('>BB')
+    __uint16 = struct.Struct('>BH')
+    __uint32 = struct.Struct('>BI')
+    __uint64 = struct.Struct('>BQ')
+    __float16 = struct.Struct('>Be')
+    __float32 = struct.Struct('>Bf')
+    __float64 = struct.Struct('>Bd')
+
+    def __init__(self):
+        super().__init__()
+        self.__field_names = {}  # type: Dict[Tuple[str, ...], List[bytes]]
+
+    @classmethod
+    def _head(cls, major: int, length: int) -> bytes:
+        initial = major << 5
+        if length < 24:
+            return bytes((initial | length,))
+        if length < 0x100:
+            return cls.__uint8.pack(initial | 24, length)
+        if length < 0x10000:
+            return cls.__uint16.pack(initial | 25, length)
+        if length < 0x100000000:
+            return cls.__uint32.pack(initial | 26, length)
+        if length < 0x10000000000000000:
+            return cls.__uint64.pack(initial | 27, length)
+        raise ValueError("Integer {} is too big for CBOR encoding".format(length))
+
+    @classmethod
+    def _encode_float(cls, value: float) -> bytes:
+        if math.isnan(value):
+            return b'\xf9\x7e\x00'
+        try:
+            encoded = cls.__float16.pack(0xf9, value)
+            if cls.__float16.unpack(encoded)[1] == value:
+                return encoded
+        except (OverflowError, struct.error):
+            pass
+        try:
+            encoded = cls.__float32.pack(0xfa, value)
+            if cls.__float32.unpack(encoded)[1] == value:
+                return encoded
+        except (OverflowError, struct.error):
+            pass
+        return cls.__float64.pack(0xfb, value)
+
+    def encode(self, value) -> bytes:
+        value_type = type(value)
+        if value is None:
+            return self.NULL
+        if value_type is bool:
+            return self.TRUE if value else self.FALSE
+        if value_type is int:
+            return self._head(self.MAJOR_UNSIGNED, value) if value >= 0 else self._head(self.MAJOR_NEGATIVE, -1 - value)
+        if value_type is float:
+            return self._encode_float(value)
+        if isinstance(value, str):
+            data = value.encode('utf-8')
+            return self._head(self.MAJOR_TEXT, len(data)) + data
+        if isinstance(value, (bytes, bytearray)):
+            return self._head(self.MAJOR_BYTES, len(value)) + bytes(value)
+        if isinstance(value, (list, tuple)):
+            return self._head(self.MAJOR_ARRAY, len(value)) + b''.join(self.encode(x) for x in value)
+        if isinstance(value, dict):
+            return self._head(self.MAJOR_MAP, len(value)) + b''.join(
+                self.encode(k) + self.encode(v) for k, v in value.items())
+        if isinstance(value, int):
+            return self.encode(int(value))
+        if isinstance(value, float):
+            return self._encode_float(float(value))
+        raise ValueError("Type {} is not supported by CBOR serializer".format(value_type.__name__))
+
+    def serialize(self, obj) -> bytes:
+        return self.encode(obj)
+
+    def serialize_fields(self, fields: Tuple[str, ...], values: List) -> bytes:
+        names = self.__field_names.get(fields)
+        if names is None:
+            names = [self.encode(x) for x in fields]
+            self.__field_names[fields] = names
+        encode = self.encode
+        items = [name + encode(value) for name, value in zip(names, values) if value is not None]
+        return self._head(self.MAJOR_MAP, len(items)) + b''.join(items)
+
+    def __decode_length(self, data: bytes, offset: int, info: int) -> Tuple[int, int]:
+        if info < 24:
+            return info, offset
+        if info == 24:
+            return data[offset], offset + 1
+        if info == 25:
+            return struct.unpack_from('>H', data, offset)[0], offset + 2
+        if info == 26:
+            return struct.unpack_from('>I', data, offset)[0], offset + 4
+        if info == 27:
+            return struct.unpack_from('>Q', data, offset)[0], offset + 8
+        raise ValueError("Indefinite length items are not supported")
+
+    def decode(self, data: bytes, offset: int = 0) -> Tuple[object, int]:
+        """
+        :return: decoded value and offset of the next item
+        """
+        initial = data[offset]
+        offset += 1
+        major, info = initial >> 5, initial & 0x1f
+        if major == self.MAJOR_SIMPLE:
+            if info == 20:
+                return False, offset
+            if info == 21:
+                return True, offset
+            if info == 22 or info == 23:
+                return None, offset
+            if info == 25:
+                return struct.unpack_from('>e', data, offset)[0], offset + 2
+            if info == 26:
+                return struct.unpack_from('>f', data, offset)[0], offset + 4
+            if info == 27:
+                return struct.unpack_from('>d', data, offset)[0], offset + 8
+            raise ValueError("Unsupported CBOR simple value {}".format(info))
+        length, offset = self.__decode_length(data, offset, info)
+        if major == self.MAJOR_UNSIGNED:
+            return length, offset
+        if major == self.MAJOR_NEGATIVE:
+            return -1 - length, offset
+        if major == self.MAJOR_BYTES:
+            return bytes(data[offset:offset + length]), offset + length
+        if major == self.MAJOR_TEXT:
+            return str(data[offset:offset + length], 'utf-8'), offset + length
+        if major == self.MAJOR_ARRAY:
+            items = []
+            for i in range(length):
+                item, offset = self.decode(data, offset)
+                items.append(item)
+            return items, offset
+        if major == self.MAJOR_MAP:
+            result = {}
+            for i in range(length):
+                key, offset = self.decode(data, offset)
+                result[key], offset = self.decode(data, offset)
+            return result, offset
+        raise ValueError("Unsupported CBOR major type {}".format(major))
+
+    def deserialize(self, data: bytes):
+        value, offset = self.decode(data)
+        if offset != len(data):
+            raise ValueError("Unexpected {} bytes after CBOR item".format(len(data) - offset))
+        return value
+
+
+SERIALIZERS = {
+    JsonSerializer.NAME: JsonSerializer(),
+    CborSerializer.NAME: CborSerializer(),
+}  # type: Dict[str, Serializer]
+
+
+def get_serializer(name: str) -> Serializer:
+    serializer = SERIALIZERS.get(name)
+    if serializer is None:
+        raise ConfigError("Unknown serializer {}. Supported: {}".format(name, ', '.join(sorted(SERIALIZERS.keys()))))
+    return serializer
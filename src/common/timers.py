@@ -0,0 +1,157 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import heapq
+import itertools
+import logging
+import threading
+
+from typing import Callable, List, Tuple
+
+from common import utils
+
+SCHEDULE_FIXED_DELAY = 'fixed_delay'  # Sleep for interval after each step. Real period is interval + step time
+SCHEDULE_SKIP = 'skip'  # Fixed rate. Ticks missed because of the slow step are skipped
+SCHEDULE_CATCH_UP = 'catch_up'  # Fixed rate. Ticks missed because of the slow step are run back-to-back
+
+SUPPORTED_SCHEDULES = (SCHEDULE_FIXED_DELAY, SCHEDULE_SKIP, SCHEDULE_CATCH_UP)
+
+
+def next_tick(schedule: str, interval: float, next_time: float, now: float) -> Tuple[float, int]:
+    """
+    Calculates time of the next tick of periodic job which has just finished the step scheduled at next_time
+    :return: time of the next tick and number of overrun ticks
+    """
+    if schedule == SCHEDULE_FIXED_DELAY:
+        return now + interval, 0
+    next_time += interval
+    if now <= next_time:
+        return next_time, 0
+    if schedule == SCHEDULE_SKIP:
+        missed = int((now - next_time) // interval) + 1
+        return next_time + missed * interval, missed
+    # Catch up: late tick is executed immediately
+    return next_time, 1
+
+
+class PeriodicTimer(object):
+    """
+    Periodic callback served by TimerService
+    """
+
+    def __init__(self, name: str, callback: Callable, context, interval: float, schedule: str):
+        super().__init__()
+        self.name = name
+        self.interval = interval
+        self.schedule = schedule
+        self.steps = 0
+        self.overruns = 0
+        self.cancelled = False
+        self.callback = callback
+        self.context = context
+        self.next_time = utils.capture_monotonic_time()
+
+
+class TimerService(object):
+    """
+    Runs many periodic callbacks on a single thread. Callbacks must not block, otherwise they delay each other.
+    Blocking jobs should use dedicated thread (ThreadManager.request_thread)
+    """
+    THREAD_NAME = 'm-Timer'
+    SLOW_CALLBACK_THRESHOLD = 100  # ms
+
+    def __init__(self, logger: logging.Logger):
+        super().__init__()
+        self.__heap = []  # type: List[Tuple[float, int, PeriodicTimer]]
+        self.__counter = itertools.count()
+        self.__condition = threading.Condition()
+        self.__thread = None  # type: threading.Thread
+        self.__terminating = False
+        self.__logger = logger
+
+    @property
+    def thread(self) -> [threading.Thread, None]:
+        return self.__thread
+
+    def schedule(self, timer: PeriodicTimer):
+        with self.__condition:
+            if self.__thread is None:
+                self.__terminating = False
+                self.__thread = threading.Thread(target=self.__run, name=self.THREAD_NAME)
+                self.__thread.start()
+            heapq.heappush(self.__heap, (timer.next_time, next(self.__counter), timer))
+            self.__condition.notify()
+
+    def cancel(self, timer: PeriodicTimer):
+        # Entry is dropped from the heap lazily when it becomes due
+        timer.cancelled = True
+
+    def stop(self, timeout: float) -> bool:
+        """
+        Stops timer thread and waits up to timeout ms for current callback to complete
+        :return: True if thread has been stopped
+        """
+        with self.__condition:
+            thread = self.__thread
+            self.__thread = None
+            self.__terminating = True
+            self.__heap.clear()
+            self.__condition.notify()
+        if thread is None or thread is threading.current_thread():
+            return True
+        thread.join(max(timeout, 0) / 1000)
+        return not thread.is_alive()
+
+    def __next_due(self) -> [PeriodicTimer, None]:
+        with self.__condition:
+            while not self.__terminating:
+                if len(self.__heap) == 0:
+                    self.__condition.wait()
+                    continue
+                deadline, seq, timer = self.__heap[0]
+                if timer.cancelled:
+                    heapq.heappop(self.__heap)
+                    continue
+                now = utils.capture_monotonic_time()
+                if deadline > now:
+                    self.__condition.wait((deadline - now) / 1000)
+                    continue
+                heapq.heappop(self.__heap)
+                return timer
+        return None
+
+    def __run(self):
+        while True:
+            timer = self.__next_due()
+            if timer is None:
+                return
+            start_time = utils.capture_monotonic_time()
+            try:
+                timer.callback(*timer.context)
+            except Exception as e:
+                self.__logger.error('Timer {} execution failed: {}'.format(timer.name, e))
+            now = utils.capture_monotonic_time()
+            if now - start_time > self.SLOW_CALLBACK_THRESHOLD:
+                self.__logger.warning('Timer {} took {:.0f}ms and delayed other timers. '
+                                      'Blocking jobs should use dedicated thread'.format(timer.name, now - start_time))
+            timer.steps += 1
+            timer.next_time, overruns = next_tick(timer.schedule, timer.interval, timer.next_time, now)
+            timer.overruns += overruns
+            if not timer.cancelled:
+                with self.__condition:
+                    if not self.__terminating:
+                        heapq.heappush(self.__heap, (timer.next_time, next(self.__counter), timer))
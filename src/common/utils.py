@@ -31,6 +31,13 @@ def capture_time() -> int:
     return int(time.time() * 1000)  # Fractional seconds to millis
 
 
+def capture_monotonic_time() -> float:
+    """
+    :return: Monotonic time in milliseconds. Unaffected by system clock changes, use it for measuring intervals only
+    """
+    return time.monotonic() * 1000
+
+
 def delta_time(point_in_time: int, now: int = None) -> int:
     """
     :param point_in_time: time in milliseconds
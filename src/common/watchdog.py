@@ -0,0 +1,109 @@
+#    JointBox - Your DIY smart home. Simplified.
+#    Copyright (C) 2017 Dmitry Berezovsky
+#    
+#    JointBox is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#    
+#    JointBox is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import logging
+import sys
+import threading
+import traceback
+
+from typing import Callable, Dict, List, Tuple
+
+from common import utils
+
+
+class Watchdog(object):
+    """
+    Periodically inspects work markers of the application threads (main loop, event loop, background workers).
+    Work which takes longer than the threshold is reported once along with the stack of the stalled thread and
+    passed to the stall handler which may quarantine the device and replace the stalled worker.
+    """
+
+    def __init__(self, work_markers: Callable[[], Dict[int, Tuple[str, object, float]]],
+                 heartbeats: Callable[[], Dict[int, Tuple[str, float]]],
+                 stall_handler: Callable[[int, str, object], None], threshold: float):
+        """
+        :param work_markers: returns mapping thread ident -> (label, device or None, monotonic start time)
+        :param heartbeats: returns mapping thread ident -> (loop name, monotonic time of the last heartbeat)
+        :param stall_handler: called as handler(thread ident, label, device) for every detected stall
+        :param threshold: max duration of single unit of work in ms
+        """
+        super().__init__()
+        self.threshold = threshold
+        self.stalls = 0
+        self.__work_markers = work_markers
+        self.__heartbeats = heartbeats
+        self.__stall_handler = stall_handler
+        self.__reported = {}  # type: Dict[Tuple[int, float], dict]  # (thread ident, start time) -> stall info
+        self.__thread = None  # type: common.core.ManagedThread
+        self.__logger = logging.getLogger('Watchdog')
+
+    @property
+    def check_interval(self) -> float:
+        return max(self.threshold / 4, 100)
+
+    def start(self, thread_manager):
+        """
+        :type thread_manager: common.core.ThreadManager
+        """
+        # Dedicated thread: callback blocked on the shared timer thread must not stop stall detection
+        if self.__thread is None:
+            self.__thread = thread_manager.request_thread('Watchdog', self.check, step_interval=self.check_interval)
+
+    def stop(self, thread_manager):
+        """
+        :type thread_manager: common.core.ThreadManager
+        """
+        if self.__thread is not None:
+            thread_manager.dispose_thread(self.__thread, wait=False)
+            self.__thread = None
+
+    def check(self):
+        now = utils.capture_monotonic_time()
+        markers = self.__work_markers()
+        # Forget stalls which have been resolved
+        for key in [k for k in self.__reported.keys() if markers.get(k[0], (None, None, None))[2] != k[1]]:
+            del self.__reported[key]
+        for ident, (label, device, start_time) in markers.items():
+            if now - start_time < self.threshold or (ident, start_time) in self.__reported:
+                continue
+            self.__report(ident, label, device, now - start_time)
+            self.__reported[(ident, start_time)] = dict(label=label, duration=now - start_time)
+
+    def __report(self, ident: int, label: str, device, duration: float):
+        self.stalls += 1
+        names = {t.ident: t.name for t in threading.enumerate()}
+        frame = sys._current_frames().get(ident)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else '<unavailable>\n'
+        self.__logger.error("Thread {} is stalled in {} for {:.0f}ms. Stack:\n{}".format(
+            names.get(ident, ident), label, duration, stack.rstrip()))
+        try:
+            self.__stall_handler(ident, label, device)
+        except Exception as e:
+            self.__logger.error("Unable to handle stall of {}: {}".format(label, e))
+
+    def stats(self) -> dict:
+        now = utils.capture_monotonic_time()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        markers = self.__work_markers()
+        loops = []  # type: List[dict]
+        for ident, (loop, heartbeat) in sorted(self.__heartbeats().items(), key=lambda x: x[1][0]):
+            work = markers.get(ident)
+            loops.append(dict(thread=names.get(ident, str(ident)), loop=loop, heartbeat_age=now - heartbeat,
+                              work=work[0] if work is not None else None,
+                              work_duration=now - work[2] if work is not None else None))
+        return dict(threshold=self.threshold, stalls=self.stalls, loops=loops,
+                    stalled=[dict(thread=names.get(k[0], str(k[0])), **v) for k, v in self.__reported.items()])
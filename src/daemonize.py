@@ -22,11 +22,14 @@ import logging
 import gc
 import os
 import signal
+import threading
 
 from daemons.prefab import run
 
+import app
 import cli
 from common import bootstrap
+from common.model import InstanceSettings
 from common.utils import CLI
 
 CMD_START = 'start'
@@ -37,17 +40,22 @@ ALLOWED_COMMANDS = (CMD_START, CMD_STOP, CMD_RESTART)
 parser = argparse.ArgumentParser(add_help=False)
 parser.add_argument("-c", "--config", dest='config', type=argparse.FileType('r'), required=False,
                     help="File containing JointBox configuration in yaml or JSON format")
+parser.add_argument("-r", "--runtime", dest='runtime', choices=InstanceSettings.SUPPORTED_RUNTIMES, required=False,
+                    help="Overrides runtime defined in instance section of the config")
 parser.add_argument("action", choices=ALLOWED_COMMANDS)
 
 
 class JointBoxDaemon(run.RunDaemon):
-    def __init__(self, logger: logging.Logger, *args, **kwargs):
+    def __init__(self, logger: logging.Logger, *args, runtime: str = None, **kwargs):
         super().__init__(*args, **kwargs)
         self.config = None
+        self.runtime = runtime
         self.application = None
         self.logger = logger
         for s in self.kill_signals:
             self.handle(s, self.on_shutdown)
+        self.handle(signal.SIGUSR1, self.on_dump_flight_recorder)
+        self.handle(signal.SIGUSR2, self.on_toggle_profiler)
 
     def on_shutdown(self, *args, **kwargs):
         try:
@@ -56,18 +64,44 @@ class JointBoxDaemon(run.RunDaemon):
         except Exception as e:
             self.logger.exception("Unable to shutdown application gracefully")
 
+    def on_dump_flight_recorder(self, *args, **kwargs):
+        if self.application is not None:
+            self.__run_diagnostics('FlightRecorderDump', self.application.dump_flight_recorder)
+
+    def on_toggle_profiler(self, *args, **kwargs):
+        if self.application is not None:
+            self.__run_diagnostics('ProfilerToggle', self.application.toggle_profiler)
+
+    def __run_diagnostics(self, name: str, func):
+        """
+        Signal handler interrupts main loop, so actual work is done in short-lived thread. Worker pool is not used
+        because diagnostics are most needed exactly when it is saturated or stuck
+        """
+        def target():
+            try:
+                func()
+            except Exception:
+                self.logger.exception("{} has failed".format(name))
+
+        try:
+            threading.Thread(target=target, name=name, daemon=True).start()
+        except RuntimeError as e:
+            self.logger.error("Unable to start {}: {}".format(name, e))
+
     def run(self):
+        if self.runtime is not None:
+            self.config['instance'] = dict(self.config.get('instance') or {}, runtime=self.runtime)
         application = bootstrap.bootstrap(self.config)
         self.application = application
-        self.logger.info("Started main application loop")
-        application.main_loop()
+        app.run_main_loop(application)
 
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
     try:
         args = parser.parse_args()
-        daemon = JointBoxDaemon(logging.getLogger('App'), pidfile=os.path.join(os.getcwd(), "daemon.pid"))
+        daemon = JointBoxDaemon(logging.getLogger('App'), pidfile=os.path.join(os.getcwd(), "daemon.pid"),
+                                runtime=args.runtime)
         if args.action == CMD_START:
             if args.config is None:
                 config_path = cli.get_default_config_path()
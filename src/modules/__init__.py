@@ -15,18 +15,39 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from common.catalogue import ModuleCatalogue
 from common.drivers import ModuleDiscoveryDriver
 from common.core import ModuleRegistry
-from modules.button import ButtonModule
-from modules.cli_mng import CliMngModule
-from modules.communication_bus import CommunicationBusModule
-from modules.dhtxx import DHTxxModule
-from modules.key_reader import KeyReaderModule
-from modules.pcf8574 import PCF8574Module
-from modules.logger_module import LoggerModule
-from modules.motion_sensor import MotionSensorModule
-from modules.onewire_thermometer import OneWireThermometerModule
-from modules.power_key import PowerKeyModule
+
+
+class ModuleCatalogueDriver(ModuleDiscoveryDriver):
+    """
+    Discovers standard modules and modules provided by installed packages via "jointbox.modules" entry points.
+    Modules are registered lazily, module class is imported only when device config refers to it.
+    In CLI mode modules providing CLI extensions are imported eagerly so their commands are available.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.__logger = logging.getLogger('ModuleCatalogueDriver')
+        self.__application = None
+
+    def on_initialized(self, application):
+        self.__application = application
+
+    def discover_modules(self, module_registry: ModuleRegistry):
+        settings = self.__application.get_instance_settings()
+        catalogue = ModuleCatalogue(settings.module_catalogue)
+        catalogue.scan_package(__name__)
+        catalogue.scan_entry_points()
+        catalogue.save()
+        for entry in catalogue.entries.values():
+            if entry.cli and settings.enable_cli:
+                module_registry.register(entry.load())
+            else:
+                module_registry.register_lazy(entry.type_name, entry.typeid, entry.load)
+        self.__logger.debug("Discovered {} modules, {} sources imported".format(len(catalogue.entries),
+                                                                              catalogue.imported))
 
 
 class StandardModulesOnlyDriver(ModuleDiscoveryDriver):
@@ -36,6 +57,17 @@ class StandardModulesOnlyDriver(ModuleDiscoveryDriver):
         self.__logger = logging.getLogger('StandardModulesOnlyDriver')
 
     def discover_modules(self, module_registry: ModuleRegistry):
+        # Imported here so importing the package doesn't import all the modules
+        from modules.button import ButtonModule
+        from modules.cli_mng import CliMngModule
+        from modules.communication_bus import CommunicationBusModule
+        from modules.dhtxx import DHTxxModule
+        from modules.key_reader import KeyReaderModule
+        from modules.pcf8574 import PCF8574Module
+        from modules.logger_module import LoggerModule
+        from modules.motion_sensor import MotionSensorModule
+        from modules.onewire_thermometer import OneWireThermometerModule
+        from modules.power_key import PowerKeyModule
         self.__logger.debug("Do discovery!")
         module_registry.register(CliMngModule)
         module_registry.register(PowerKeyModule)
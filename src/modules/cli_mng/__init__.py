@@ -16,11 +16,24 @@
 
 from argparse import ArgumentParser
 
+from common.control import ControlClient
 from common.model import Module, CliExtension
 from common import utils
 from common.utils import CLI
 
 
+class ControlClientCliExtension(CliExtension):
+    """
+    Base class for commands which query running instance via control socket
+    """
+
+    def call_running_instance(self, command: str, **kwargs):
+        path = self.get_application_manager().get_instance_settings().control_socket
+        if path is None:
+            raise Exception("Control socket is disabled in instance configuration")
+        return ControlClient(path).call(command, **kwargs)
+
+
 class CoreDriversList(CliExtension):
     COMMAND_NAME = 'drivers:list'
     COMMAND_DESCRIPTION = 'Returns the list of the registered drivers'
@@ -44,16 +57,172 @@ class CoreModulesList(CliExtension):
         pass
 
     def handle(self, args):
-        modules = self.get_application_manager().get_module_registry().modules.values()
-        for module in modules:
-            CLI.print_data('* {} (id: {})'.format(module.type_name(), utils.int_to_hex4str(module.typeid())))
+        for type_name, typeid in self.get_application_manager().get_module_registry().list_modules():
+            CLI.print_data('* {} (id: {})'.format(type_name, utils.int_to_hex4str(typeid)))
+
+
+class CoreQueuesStats(ControlClientCliExtension):
+    COMMAND_NAME = 'queues:stats'
+    COMMAND_DESCRIPTION = 'Returns depth, high-water mark and drop counters of the queues of running instance'
+
+    def handle(self, args):
+        try:
+            stats = self.call_running_instance('queues:stats')
+        except Exception as e:
+            CLI.print_error(e)
+            return
+        CLI.print_data('{:<20} {:>8} {:>12} {:>6} {:>6} {:>10} {:>8} {:>10}'.format(
+            'queue', 'capacity', 'overflow', 'depth', 'hwm', 'enqueued', 'dropped', 'coalesced'))
+        for q in stats:
+            CLI.print_data('{name:<20} {capacity:>8} {overflow:>12} {depth:>6} {high_water_mark:>6} {enqueued:>10} '
+                           '{dropped:>8} {coalesced:>10}'.format(**q))
+
+
+class CoreThreadsStats(ControlClientCliExtension):
+    COMMAND_NAME = 'threads:stats'
+    COMMAND_DESCRIPTION = 'Returns schedule, number of steps and overruns of the managed threads of running instance'
+
+    def handle(self, args):
+        try:
+            stats = self.call_running_instance('threads:stats')
+        except Exception as e:
+            CLI.print_error(e)
+            return
+        CLI.print_data('{:<30} {:>12} {:>10} {:>10} {:>10} {:>6}'.format(
+            'thread', 'schedule', 'interval', 'steps', 'overruns', 'alive'))
+        for t in stats:
+            CLI.print_data('{name:<30} {schedule:>12} {interval:>10.0f} {steps:>10} {overruns:>10} {alive!s:>6}'
+                           .format(**t))
+
+
+class CoreWatchdog(ControlClientCliExtension):
+    COMMAND_NAME = 'watchdog'
+    COMMAND_DESCRIPTION = 'Returns heartbeats of the loops, detected stalls and quarantined devices of running instance'
+
+    @classmethod
+    def setup_parser(cls, parser: ArgumentParser):
+        parser.add_argument('-r', '--release', dest='release', required=False, default=None, metavar='DEVICE',
+                            help='Releases device from quarantine')
+
+    def handle(self, args):
+        try:
+            if args.release is not None:
+                if self.call_running_instance('devices:release', name=args.release):
+                    CLI.print_info('Device {} has been released'.format(args.release))
+                else:
+                    CLI.print_error('Device {} is not quarantined'.format(args.release))
+                return
+            stats = self.call_running_instance('watchdog:stats')
+        except Exception as e:
+            CLI.print_error(e)
+            return
+        CLI.print_data('Threshold: {}ms, stalls detected: {}'.format(stats['threshold'], stats['stalls']))
+        CLI.print_data('{:<24} {:<20} {:>14} {:<30} {:>10}'.format('thread', 'loop', 'heartbeat age', 'work', 'busy'))
+        for x in stats['loops']:
+            CLI.print_data('{:<24} {:<20} {:>14.0f} {:<30} {:>10}'.format(
+                x['thread'], x['loop'], x['heartbeat_age'], x['work'] or '-',
+                '{:.0f}'.format(x['work_duration']) if x['work_duration'] is not None else '-'))
+        for x in stats['stalled']:
+            CLI.print_data('STALLED: {thread} in {label}'.format(**x))
+        if len(stats['quarantined']) > 0:
+            CLI.print_data('Quarantined devices: ' + ', '.join(stats['quarantined']))
+
+
+class CoreStats(ControlClientCliExtension):
+    COMMAND_NAME = 'stats'
+    COMMAND_DESCRIPTION = 'Returns step timings, main loop jitter and queue wait times of running instance'
+
+    @staticmethod
+    def __format_labels(labels: dict) -> str:
+        if not labels:
+            return ''
+        return '{' + ','.join('{}={}'.format(k, v) for k, v in sorted(labels.items())) + '}'
+
+    def handle(self, args):
+        try:
+            metrics = self.call_running_instance('metrics:stats')
+        except Exception as e:
+            CLI.print_error(e)
+            return
+        histograms = [m for m in metrics if m['type'] == 'histogram']
+        values = [m for m in metrics if m['type'] != 'histogram']
+        CLI.print_data('{:<60} {:>8} {:>9} {:>9} {:>9}'.format('timing (ms)', 'count', 'p50', 'p99', 'max'))
+        for m in histograms:
+            CLI.print_data('{:<60} {:>8} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                m['name'] + self.__format_labels(m['labels']), m['count'], m['p50'], m['p99'], m['max']))
+        if len(values) > 0:
+            CLI.print_data('')
+            for m in values:
+                CLI.print_data('{:<60} {:>8}'.format(m['name'] + self.__format_labels(m['labels']), m['value']))
+
+
+class CoreProfiler(ControlClientCliExtension):
+    COMMAND_NAME = 'profiler'
+    COMMAND_DESCRIPTION = 'Starts or stops sampling profiler in running instance. ' \
+                          'On stop collapsed stacks are written into the file (flamegraph.pl compatible)'
+
+    @classmethod
+    def setup_parser(cls, parser: ArgumentParser):
+        parser.add_argument('action', choices=('start', 'stop'))
+        parser.add_argument('-i', '--interval', dest='interval', type=int, required=False, default=None,
+                            help='Sampling interval in milliseconds')
+        parser.add_argument('-o', '--output', dest='output', required=False, default=None,
+                            help='Name of the file in instance dump_dir to write collapsed stacks to. '
+                                 'New file is created by default')
+
+    def handle(self, args):
+        try:
+            if args.action == 'start':
+                kwargs = {} if args.interval is None else dict(interval=args.interval)
+                self.call_running_instance('profiler:start', **kwargs)
+                CLI.print_info('Profiler started')
+                return
+            kwargs = {} if args.output is None else dict(output=args.output)
+            result = self.call_running_instance('profiler:stop', **kwargs)
+        except Exception as e:
+            CLI.print_error(e)
+            return
+        if not result.get('output'):
+            CLI.print_info('Profiler is not running')
+            return
+        CLI.print_info('Collected {} samples. Collapsed stacks: {}'.format(result['samples'], result['output']))
+        for marker, count in sorted(result['breakdown'].items(), key=lambda x: -x[1]):
+            CLI.print_data('{:<40} {:>8}'.format(marker, count))
+
+
+class CoreRecorderDump(ControlClientCliExtension):
+    COMMAND_NAME = 'recorder:dump'
+    COMMAND_DESCRIPTION = 'Dumps recent events and background tasks kept by flight recorder of running instance'
+
+    @classmethod
+    def setup_parser(cls, parser: ArgumentParser):
+        parser.add_argument('-o', '--output', dest='output', required=False, default=None,
+                            help='Name of the file in instance dump_dir to write records to. New file is created by default')
+
+    def handle(self, args):
+        kwargs = {} if args.output is None else dict(output=args.output)
+        try:
+            result = self.call_running_instance('recorder:dump', **kwargs)
+        except Exception as e:
+            CLI.print_error(e)
+            return
+        if result['output'] is None:
+            CLI.print_info('Flight recorder is disabled')
+            return
+        CLI.print_info('Dumped {} records into {}'.format(result['records'], result['output']))
 
 
 class CliMngModule(Module):
     CLI_NAMESPACE = 'core'
     CLI_EXTENSIONS = [
         CoreDriversList,
-        CoreModulesList
+        CoreModulesList,
+        CoreQueuesStats,
+        CoreThreadsStats,
+        CoreWatchdog,
+        CoreStats,
+        CoreProfiler,
+        CoreRecorderDump,
     ]
 
     @staticmethod
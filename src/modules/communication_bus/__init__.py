@@ -19,6 +19,7 @@ from typing import Dict
 from common.config_parser import ACLParser
 from common.drivers import DataChannelDriver
 from common.errors import RPCError
+from common.serializers import SERIALIZERS
 from common.model import DeviceModule, ParameterDef, ActionDef, Driver, EventDef, ModelState, ACL
 from common import validators
 
@@ -72,6 +73,7 @@ class CommunicationBusModule(DeviceModule):
         self.server_address = ''
         self.server_port = self.DEFAULT_BROKER_PORT
         self.bind_address = ''
+        self.state_format = None  # Serializer name. None - each state field is published separately
         self.topic_name = CommunicationBusModule.TOPIC_PREFIX + (
             application.get_instance_settings().id if application.get_instance_settings().id is not None else ''
         )
@@ -90,7 +92,7 @@ class CommunicationBusModule(DeviceModule):
             return  # We can't sync message until establish connection
         try:
             assert isinstance(data, ModelState), "push_state action expects StateModel, got " + str(data)
-            self.channel.send('/{}/state'.format(sender.name), data.as_dict())
+            self.channel.send_state('/{}/state'.format(sender.name), data)
         except Exception as e:
             self.logger.error("Unable to push device state: " + str(e))
 
@@ -99,6 +101,7 @@ class CommunicationBusModule(DeviceModule):
             "server_address": self.server_address,
             "server_port": self.server_port,
             "bind_address": self.bind_address,
+            "state_format": self.state_format,
             "topic_prefix": self.topic_name
         })
         self.channel.on_data_received = self.__on_message_received
@@ -123,6 +126,7 @@ class CommunicationBusModule(DeviceModule):
         ParameterDef(name='server_address', is_required=True),
         ParameterDef(name='server_port', is_required=False, validators=[validators.integer]),
         ParameterDef(name='bind_address', is_required=False),
+        ParameterDef(name='state_format', is_required=False, validators=[lambda x: x in SERIALIZERS]),
         ParameterDef(name='acl', is_required=False, parser=ACLParser())
     ]
     IN_LOOP = True
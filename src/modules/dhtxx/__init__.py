@@ -19,7 +19,7 @@ from typing import Dict
 from common.drivers import OneWireDriver
 from common.drivers.gpio import GPIODriver, GPIOMode
 from common.errors import InvalidModuleError
-from common.model import StateAwareModule, ParameterDef, Driver
+from common.model import StateAwareModule, ParameterDef, Driver, BG_LANE_SENSORS
 from modules.dhtxx.dht11 import DHT11
 
 
@@ -35,8 +35,6 @@ class DHTxxModule(StateAwareModule):
     def __init__(self, application, drivers: Dict[int, Driver]):
         super().__init__(application, drivers)
         self.gpio = 0
-        self.temperature = None  # type: float
-        self.humidity = None  # type: float
         self.__gpio_driver = drivers.get(GPIODriver.typeid())  # type: GPIODriver
         self.__dht11 = None  # type: DHT11
 
@@ -52,8 +50,8 @@ class DHTxxModule(StateAwareModule):
             self.logger.exception(str(e))
             return
         if result.is_valid():
-            self.temperature = result.temperature
-            self.humidity = result.humidity
+            self.state.temperature = result.temperature
+            self.state.humidity = result.humidity
             self.commit_state()
         else:
             self.logger.error("Failed to read data from DHTxx sensor on GPIO {}: Error code: {}"
@@ -66,3 +64,4 @@ class DHTxxModule(StateAwareModule):
     STATE_FIELDS = ['temperature', 'humidity']
     REQUIRED_DRIVERS = [GPIODriver.typeid()]
     IN_BACKGROUND = True
+    BACKGROUND_LANE = BG_LANE_SENSORS
@@ -46,3 +46,4 @@ class LoggerModule(DeviceModule):
     ACTIONS = [
         ActionDef(ACTION_LOG, 'log', log),
     ]
+    IN_LOOP = False
@@ -18,7 +18,7 @@ from typing import Dict
 
 from common.drivers import OneWireDriver
 from common.errors import InvalidModuleError
-from common.model import StateAwareModule, ParameterDef, Driver
+from common.model import StateAwareModule, ParameterDef, Driver, BG_LANE_SENSORS
 
 
 class OneWireThermometerModule(StateAwareModule):
@@ -63,3 +63,4 @@ class OneWireThermometerModule(StateAwareModule):
     MINIMAL_ITERATION_INTERVAL = 5 * 60 * 1000
     REQUIRED_DRIVERS = [OneWireDriver.typeid()]
     IN_BACKGROUND = True
+    BACKGROUND_LANE = BG_LANE_SENSORS
@@ -24,6 +24,8 @@ from common.core import ApplicationManager
 from common.drivers import DataChannelDriver, OneWireDriver, I2cDriver
 from common.drivers.gpio import GPIODriver
 from common.errors import ConfigError
+from common.metrics import Counter
+from common.serializers import get_serializer
 
 
 class FakeGPIODriver(GPIODriver):
@@ -59,6 +61,44 @@ class FakeI2cDriver(I2cDriver):
         return FakeI2cDriver.I2cBus(bus_id)
 
 
+class FakeDataChannelDriver(DataChannelDriver):
+    """
+    In-memory data channel. Sent messages are counted and passed to on_data_sent callback instead of network
+    """
+
+    class FakeChannel(DataChannelDriver.Channel):
+        def __init__(self, connection_options: dict):
+            super().__init__(connection_options)
+            self.on_data_sent = self.noop
+            self.sent = 0
+            self.subscriptions = []  # type: List[str]
+            self._connected = False
+            self._was_connected = False
+
+        def is_connected(self) -> bool:
+            return self._connected
+
+        def connect(self):
+            self._connected = True
+            if not self._was_connected:
+                self._was_connected = True
+                self.on_connect_first_time(self)
+            self.on_connect(self)
+
+        def disconnect(self):
+            self._connected = False
+
+        def send(self, destination: str, data):
+            self.sent += 1
+            self.on_data_sent(destination, data)
+
+        def subscribe(self, topic: str):
+            self.subscriptions.append(topic)
+
+    def new_channel(self, connection_options: dict) -> FakeChannel:
+        return FakeDataChannelDriver.FakeChannel(connection_options)
+
+
 class MQTTDriver(DataChannelDriver):
     class MQTTChannel(DataChannelDriver.Channel):
 
@@ -123,6 +163,8 @@ class MQTTDriver(DataChannelDriver):
             """
             super().__init__(connection_options)
             self.logger = driver.logger
+            self.published = driver.published
+            self.publish_errors = driver.publish_errors
             self._connected = False
             self._was_connected = False
             self._thread = None
@@ -131,6 +173,9 @@ class MQTTDriver(DataChannelDriver):
                 self.server_address = connection_options.get('server_address', '127.0.0.1')
                 self.server_port = connection_options.get('port', 1883)
                 self.topic_prefix = connection_options.get('topic_prefix', 'rmod')
+                # None - each state field is published into its own topic
+                state_format = connection_options.get('state_format')
+                self.state_serializer = get_serializer(state_format) if state_format is not None else None
             except KeyError as e:
                 raise ConfigError("Unable to build MQTT communication channel because of configuration error: "
                                   + str(e))
@@ -145,6 +190,18 @@ class MQTTDriver(DataChannelDriver):
             else:
                 return str(value)
 
+        def __publish(self, topic: str, payload):
+            try:
+                rc = self._mqtt_client.publish(topic, payload)[0]  # (rc, mid) tuple or MQTTMessageInfo
+                if rc == mqtt.MQTT_ERR_SUCCESS:
+                    self.published.inc()
+                else:
+                    self.publish_errors.inc()
+                    self.logger.error("Unable to send MQTT message: " + mqtt.error_string(rc))
+            except Exception as e:
+                self.publish_errors.inc()
+                self.logger.error("Unable to send MQTT message: " + str(e))
+
         def send(self, destination: str, data):
             raw_data = None
             if isinstance(data, dict):
@@ -152,11 +209,18 @@ class MQTTDriver(DataChannelDriver):
             else:
                 raise ValueError("MQTTChannel supports only dictionary data")
             for key, value in raw_data.items():
-                try:
-                    result, msg_id = self._mqtt_client.publish('{}{}/{}'.format(self.topic_prefix, destination, key),
-                                                               self.__encode_value(value))
-                except Exception as e:
-                    self.logger.error("Unable to send MQTT message: " + str(e))
+                self.__publish('{}{}/{}'.format(self.topic_prefix, destination, key), self.__encode_value(value))
+
+        def send_state(self, destination: str, state):
+            """
+            Publishes the whole state as single message if state_format is configured. Encoded payload is cached by
+            the state, so it is computed once per change
+            :type state: common.model.ModelState
+            """
+            if self.state_serializer is None:
+                self.send(destination, state.as_dict())
+            else:
+                self.__publish(self.topic_prefix + destination, state.encode(self.state_serializer))
 
         def is_connected(self) -> bool:
             return self._connected
@@ -169,17 +233,22 @@ class MQTTDriver(DataChannelDriver):
 
         def step(self):
             try:
-                self._mqtt_client.loop()
+                # Non-blocking: channel is served by shared timer thread together with other periodic jobs
+                self._mqtt_client.loop(timeout=0)
             except Exception as e:
                 pass
 
         def disconnect(self):
             self._mqtt_client.disconnect()
 
+    CHANNEL_POLL_INTERVAL = 50  # ms. Max delay of handling incoming messages and outgoing queue
+
     def __init__(self):
         super().__init__()
         self.__thread_manager = None  # type: common.core.ThreadManager
         self.__channel_counter = 0
+        self.published = Counter()
+        self.publish_errors = Counter()
 
     def on_initialized(self, application):
         """
@@ -187,6 +256,8 @@ class MQTTDriver(DataChannelDriver):
         :return:
         """
         self.__thread_manager = application.thread_manager
+        self.published = application.metrics.counter('mqtt_published', 'Number of published MQTT messages')
+        self.publish_errors = application.metrics.counter('mqtt_publish_errors', 'Number of failed MQTT publishes')
 
     def new_channel(self, connection_options: dict) -> MQTTChannel:
         def do_step(channel):
@@ -194,6 +265,7 @@ class MQTTDriver(DataChannelDriver):
 
         channel = MQTTDriver.MQTTChannel(self, connection_options)
         self.__channel_counter += 1
-        thread = self.__thread_manager.request_thread('MQTTDriver-ch' + str(self.__channel_counter), channel.step, [])
-        channel.dispose = lambda: self.__thread_manager.dispose_thread(thread)
+        timer = self.__thread_manager.request_timer('MQTTDriver-ch' + str(self.__channel_counter), channel.step, [],
+                                                    step_interval=self.CHANNEL_POLL_INTERVAL)
+        channel.dispose = lambda: self.__thread_manager.cancel_timer(timer)
         return channel
@@ -17,8 +17,10 @@
 import os
 from typing import Tuple, List
 from smbus2 import SMBus
+from common import utils
 from common.drivers import I2cDriver as BaseI2cDriver
 from common.errors import InvalidDriverError
+from common.metrics import Histogram, MetricsRegistry
 
 DEV_DIR = '/dev'
 I2C_DEV_PREFIX = 'i2c-'
@@ -29,6 +31,7 @@ class I2cDriver(BaseI2cDriver):
 
         def __init__(self, bus_id):
             super().__init__(bus_id)
+            self.transaction_duration = Histogram()  # Replaced with registered histogram by the driver
             try:
                 self.bus = SMBus(bus_id)
             except Exception as e:
@@ -39,27 +42,39 @@ class I2cDriver(BaseI2cDriver):
             if self.bus is not None:
                 self.bus.close()
 
+        def __timed(self, operation, *args):
+            start_time = utils.capture_monotonic_time()
+            try:
+                return operation(*args)
+            finally:
+                self.transaction_duration.observe(utils.capture_monotonic_time() - start_time)
+
         def read_byte(self, addr: int, register: int) -> int:
-            return self.bus.read_byte_data(addr, register)
+            return self.__timed(self.bus.read_byte_data, addr, register)
 
         def read_word(self, addr: int, register: int) -> int:
-            return self.bus.read_word_data(addr, register)
+            return self.__timed(self.bus.read_word_data, addr, register)
 
         def read_block(self, addr: int, register, length: int) -> List[int]:
-            return self.bus.read_i2c_block_data(addr, register, length)
+            return self.__timed(self.bus.read_i2c_block_data, addr, register, length)
 
         def write_byte_data(self, addr, register, value):
-            self.bus.write_byte_data(addr, register, value)
+            self.__timed(self.bus.write_byte_data, addr, register, value)
 
         def write_word_data(self, addr, register, value):
-            self.bus.write_word_data(addr, register, value)
+            self.__timed(self.bus.write_word_data, addr, register, value)
 
         def write_block_data(self, addr, register, data):
-            self.bus.write_i2c_block_data(addr, register, data)
+            self.__timed(self.bus.write_i2c_block_data, addr, register, data)
 
     def __init__(self):
         super().__init__()
         self.buses = {}
+        self.__metrics = None  # type: MetricsRegistry
+
+    def on_initialized(self, application):
+        super().on_initialized(application)
+        self.__metrics = application.metrics
 
     def list_buses(self) -> List[Tuple[str, int]]:
         result = []
@@ -75,6 +90,9 @@ class I2cDriver(BaseI2cDriver):
             return self.buses[bus_id]
         else:
             bus = self.I2cBus(bus_id)
+            if self.__metrics is not None:
+                bus.transaction_duration = self.__metrics.histogram(
+                    'i2c_transaction_duration_ms', 'Duration of I2C transaction', bus=bus_id)
             self.buses[bus_id] = bus
             return bus
 
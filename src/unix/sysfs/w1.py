@@ -18,8 +18,10 @@ import os
 
 from typing import List
 
+from common import utils
 from common.drivers import OneWireDriver
 from common.errors import SimpleException
+from common.metrics import MetricsRegistry
 
 
 class SysfsOneWireDriverError(SimpleException):
@@ -31,8 +33,10 @@ class SysfsOneWireDriver(OneWireDriver):
         super().__init__()
         self.fs_root = '/sys/bus/w1'
         self.__devices_dir = ''
+        self.__metrics = None  # type: MetricsRegistry
 
     def on_initialized(self, application):
+        self.__metrics = application.metrics
         self.__devices_dir = os.path.join(self.fs_root, 'devices')
         try:
             self.logger.debug('Available devices: ' + str(self.get_available_devices()))
@@ -60,6 +64,7 @@ class SysfsOneWireDriver(OneWireDriver):
         device_path = os.path.join(self.__devices_dir, str(device_name))
         if not os.path.exists(device_path):
             raise ValueError("W1 Device {} doesn't exist".format(device_name))
+        start_time = utils.capture_monotonic_time()
         try:
             with open(os.path.join(device_path, 'w1_slave'), 'r') as f:
                 temperature = self.__parse_raw_temperature_data(f.readlines())
@@ -68,6 +73,10 @@ class SysfsOneWireDriver(OneWireDriver):
                 return temperature
         except Exception as e:
             raise SysfsOneWireDriverError("Unable to read temperature from DS18B20 device {}: " + str(e), ex=e)
+        finally:
+            if self.__metrics is not None:
+                self.__metrics.histogram('w1_transaction_duration_ms', 'Duration of 1-wire device read',
+                                         device=device_name).observe(utils.capture_monotonic_time() - start_time)
 
     def get_available_devices(self) -> List[str]:
         return [os.path.basename(x) for x in os.listdir(self.__devices_dir)]